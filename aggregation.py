@@ -0,0 +1,150 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from cloak_table import as_table
+from metrics import stage_timer
+
+# 新舊A面的預設分組，鍵名與前端的 jb_old / jb_new 等一致
+SERIES_PREFIXES = {'jb': 'jt', 'jw': 'jtw', 'jg': 'jtg'}
+OLD_A_FACE = range(1, 9)    # 01-08
+NEW_A_FACE = range(9, 14)   # 09-13
+
+DEFAULT_GROUPS = {}
+for _series, _prefix in SERIES_PREFIXES.items():
+    DEFAULT_GROUPS[f'{_series}_old'] = [f'{_prefix}{n:02d}' for n in OLD_A_FACE]
+    DEFAULT_GROUPS[f'{_series}_new'] = [f'{_prefix}{n:02d}' for n in NEW_A_FACE]
+
+# 每份快照最多記住幾種分組定義的結果
+MEMO_SIZE = 32
+
+_RANGE_PATTERN = re.compile(r'^([a-z]+)(\d+)-(?:([a-z]+))?(\d+)$')
+
+
+def expand_cloaks(spec):
+    """展開斗篷列表，支援範圍寫法，例如 'jt01-jt08,jtw09'"""
+    cloaks = []
+    for part in spec.split(','):
+        part = part.strip().lower()
+        if not part:
+            continue
+        match = _RANGE_PATTERN.match(part)
+        if match:
+            prefix, start, end_prefix, end = match.groups()
+            if end_prefix and end_prefix != prefix:
+                raise ValueError(f'範圍前後的系列不一致: {part}')
+            width = len(start)
+            for n in range(int(start), int(end) + 1):
+                cloaks.append(f'{prefix}{n:0{width}d}')
+        else:
+            cloaks.append(part)
+    return cloaks
+
+
+def parse_group_args(values):
+    """解析 group=名稱:斗篷列表 查詢參數"""
+    groups = {}
+    for value in values:
+        name, sep, spec = value.partition(':')
+        if not sep or not name.strip():
+            raise ValueError(f'分組格式應為 名稱:斗篷列表，收到: {value}')
+        groups[name.strip()] = expand_cloaks(spec)
+    return groups
+
+
+def group_key(groups):
+    """分組定義的標準化鍵，用於記憶化"""
+    return tuple((name, tuple(cloaks)) for name, cloaks in groups.items())
+
+
+def fail_rate(meta, ga4):
+    """Fail Rate = 1 - (GA4 ÷ Meta)，以百分比表示；Meta為0時返回0"""
+    meta = np.asarray(meta, dtype=float)
+    ga4 = np.asarray(ga4, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = np.where(meta > 0, (1 - ga4 / meta) * 100, 0.0)
+    return np.round(rate, 2)
+
+
+class CloakAggregator:
+    """單一快照的分組加總，直接使用 CloakTable 的 (dates x cloaks) 矩陣"""
+
+    def __init__(self, data):
+        table = as_table(data)
+        self.dates = table.dates
+        self.cloaks = table.cloaks
+        self.cloak_index = table.cloak_index
+        self.meta = table.meta
+        self.ga4 = table.ga4
+
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        # 預先計算前端預設使用的新舊A面分組
+        self.aggregate(DEFAULT_GROUPS)
+
+    def unknown_cloaks(self, groups):
+        return sorted({c for cloaks in groups.values() for c in cloaks if c not in self.cloak_index})
+
+    def totals(self, groups):
+        """返回(分組名稱, meta總和, GA4總和)，總和為 (dates x groups) 矩陣"""
+        names = list(groups)
+        membership = np.zeros((len(self.cloaks), len(names)), dtype=np.int64)
+        for j, name in enumerate(names):
+            for cloak in groups[name]:
+                index = self.cloak_index.get(cloak)
+                if index is not None:
+                    membership[index, j] = 1
+        # int32的矩陣乘以int64的成員矩陣，加總結果為int64不會溢位
+        return names, self.meta @ membership, self.ga4 @ membership
+
+    def aggregate(self, groups):
+        """返回每日的分組 meta/GA4 總和及 fail rate，結果依分組定義記憶化"""
+        key = group_key(groups)
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+
+        with stage_timer('aggregate'):
+            names, meta, ga4 = self.totals(groups)
+            rates = fail_rate(meta, ga4).tolist()
+            meta = meta.tolist()
+            ga4 = ga4.tolist()
+
+            result = []
+            for d, date in enumerate(self.dates):
+                date_data = {'date': date}
+                for j, name in enumerate(names):
+                    date_data[name] = {
+                        'meta': meta[d][j],
+                        'ga4': ga4[d][j],
+                        'failRate': rates[d][j]
+                    }
+                result.append(date_data)
+
+        with self._lock:
+            self._memo[key] = result
+            while len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return result
+
+
+class AggregatorCache:
+    """保存最新快照的 CloakAggregator，快照版本變更時重建"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._aggregator = None
+
+    def get(self, data, version):
+        with self._lock:
+            if self._aggregator is not None and self._version == version:
+                return self._aggregator
+        aggregator = CloakAggregator(data)
+        with self._lock:
+            self._version = version
+            self._aggregator = aggregator
+        return aggregator
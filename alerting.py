@@ -0,0 +1,290 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+import requests
+
+from aggregation import DEFAULT_GROUPS, fail_rate
+from cloak_table import as_table
+from history_store import normalize_date
+from metrics import REGISTRY, Counter
+
+logger = logging.getLogger(__name__)
+
+# 滾動平均/標準差使用的天數
+ALERT_WINDOW_DAYS = 7
+# EWMA的平滑係數，越大越重視最近幾天
+ALERT_EWMA_ALPHA = 0.3
+# fail rate 高於滾動平均幾個標準差時告警
+ALERT_Z_THRESHOLD = 3.0
+# 標準差下限（百分點），避免長期穩定的斗篷因微小波動產生極大的z-score
+ALERT_MIN_STD = 1.0
+# 當天meta少於此數時不評估也不納入統計，避免小量數據的fail rate造成誤報
+ALERT_MIN_META = 50
+# 至少累積幾天的數據才計算z-score
+ALERT_MIN_HISTORY = 3
+# 最多保留幾筆已確定的告警
+ALERT_HISTORY_SIZE = 500
+
+ALERTS_RAISED = REGISTRY.register(Counter(
+    'jita_alerts', '產生的fail rate告警數', labels=('reason',)
+))
+WEBHOOK_ERRORS = REGISTRY.register(Counter(
+    'jita_alert_webhook_errors', '告警webhook發送失敗的次數'
+))
+
+
+class AlertEngine:
+    """每個斗篷及新舊A面分組的 fail rate 滾動統計與告警
+
+    統計以 (監控對象,) 陣列保存：EWMA、最近 window 天的環形緩衝及其總和/平方和，
+    每加入一天只需更新一格，不必重新掃描歷史。fail rate 一律由 meta/GA4 計算
+    (1 - GA4/Meta)，分組和斗篷的定義一致。
+
+    快照中最新的日期可能仍在更新，只評估不納入統計；出現更晚的日期後才以最終數值
+    納入。已納入統計的日期之後被修改不會回溯重算。
+    """
+
+    def __init__(self, groups=DEFAULT_GROUPS, window=ALERT_WINDOW_DAYS, alpha=ALERT_EWMA_ALPHA,
+                 z_threshold=ALERT_Z_THRESHOLD, fail_rate_threshold=None, min_meta=ALERT_MIN_META,
+                 min_history=ALERT_MIN_HISTORY, min_std=ALERT_MIN_STD, webhook_url=None, webhook_timeout=5,
+                 should_notify=None):
+        self.groups = dict(groups)
+        self.window = window
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.fail_rate_threshold = fail_rate_threshold
+        self.min_meta = min_meta
+        self.min_history = min_history
+        self.min_std = min_std
+        self.webhook_url = webhook_url
+        self.webhook_timeout = webhook_timeout
+        # 返回False時不發送webhook，例如多個worker時只由負責刷新的worker發送
+        self.should_notify = should_notify
+
+        # 監控對象：先是分組，再依出現順序加入斗篷
+        self.names = list(self.groups)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self._allocate(len(self.names))
+
+        self.committed_date = None  # 最後納入統計的ISO日期
+        self.days = 0               # 已納入統計的天數，決定環形緩衝的位置
+        self.revision = 0           # 告警有變化時遞增，用於快取鍵
+        self._alerts = deque(maxlen=ALERT_HISTORY_SIZE)  # 已確定日期的告警
+        self._pending = []          # 最新（仍在更新）日期的告警
+        self._notified = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _allocate(self, count):
+        self.ewma = np.zeros(count)
+        self.observed = np.zeros(count, dtype=np.int64)  # 納入EWMA的天數
+        self.window_rate = np.zeros((self.window, count))
+        self.window_meta = np.zeros((self.window, count))
+        self.window_ga4 = np.zeros((self.window, count))
+        self.window_valid = np.zeros((self.window, count), dtype=bool)
+        self.sum_rate = np.zeros(count)
+        self.sumsq_rate = np.zeros(count)
+        self.sum_meta = np.zeros(count)
+        self.sum_ga4 = np.zeros(count)
+        self.valid_days = np.zeros(count, dtype=np.int64)
+
+    def _grow(self, names):
+        """加入新的斗篷，新對象的統計從0開始"""
+        added = [name for name in names if name not in self.index]
+        if not added:
+            return
+        for name in added:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+        extra = len(added)
+        for attr in ('ewma', 'observed', 'sum_rate', 'sumsq_rate', 'sum_meta', 'sum_ga4', 'valid_days'):
+            value = getattr(self, attr)
+            setattr(self, attr, np.concatenate([value, np.zeros(extra, dtype=value.dtype)]))
+        for attr in ('window_rate', 'window_meta', 'window_ga4', 'window_valid'):
+            value = getattr(self, attr)
+            setattr(self, attr, np.concatenate([value, np.zeros((self.window, extra), dtype=value.dtype)], axis=1))
+
+    def _day_values(self, table, rows):
+        """返回指定行的 (meta, GA4) 矩陣，欄位依監控對象排列"""
+        self._grow(table.cloaks)
+        meta = np.zeros((len(rows), len(self.names)))
+        ga4 = np.zeros((len(rows), len(self.names)))
+        cloak_slots = [self.index[cloak] for cloak in table.cloaks]
+        meta[:, cloak_slots] = table.meta[rows]
+        ga4[:, cloak_slots] = table.ga4[rows]
+
+        membership = np.zeros((len(table.cloaks), len(self.groups)))
+        for g, cloaks in enumerate(self.groups.values()):
+            for cloak in cloaks:
+                j = table.cloak_index.get(cloak)
+                if j is not None:
+                    membership[j, g] = 1
+        group_slots = [self.index[name] for name in self.groups]
+        meta[:, group_slots] = table.meta[rows] @ membership
+        ga4[:, group_slots] = table.ga4[rows] @ membership
+        return meta, ga4
+
+    def _evaluate(self, iso_date, meta, ga4):
+        """以目前的統計評估一天的數值，返回告警列表（不改變統計）"""
+        rate = fail_rate(meta, ga4)
+        eligible = meta >= self.min_meta
+        days = np.maximum(self.valid_days, 1)
+        mean = self.sum_rate / days
+        std = np.maximum(np.sqrt(np.maximum(self.sumsq_rate / days - mean ** 2, 0.0)), self.min_std)
+        z = (rate - mean) / std
+
+        z_breach = eligible & (self.valid_days >= self.min_history) & (z >= self.z_threshold)
+        threshold_breach = np.zeros_like(eligible)
+        if self.fail_rate_threshold is not None:
+            threshold_breach = eligible & (rate >= self.fail_rate_threshold)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weighted = np.where(self.sum_meta > 0, (1 - self.sum_ga4 / self.sum_meta) * 100, 0.0)
+
+        alerts = []
+        for i in np.flatnonzero(z_breach | threshold_breach):
+            reasons = []
+            if z_breach[i]:
+                reasons.append('zscore')
+            if threshold_breach[i]:
+                reasons.append('threshold')
+            name = self.names[i]
+            alerts.append({
+                'date': iso_date,
+                'name': name,
+                'kind': 'group' if name in self.groups else 'cloak',
+                'reasons': reasons,
+                'failRate': float(rate[i]),
+                'meta': int(meta[i]),
+                'ga4': int(ga4[i]),
+                'mean': round(float(mean[i]), 2),
+                'std': round(float(std[i]), 2),
+                'zScore': round(float(z[i]), 2),
+                'ewma': round(float(self.ewma[i]), 2) if self.observed[i] else None,
+                'weightedFailRate': round(float(weighted[i]), 2),
+                'windowDays': int(self.valid_days[i])
+            })
+        return alerts
+
+    def _fold(self, meta, ga4):
+        """把一天的數值納入統計：每個對象O(1)，移出環形緩衝中最舊的一天"""
+        rate = fail_rate(meta, ga4)
+        valid = meta >= self.min_meta
+        slot = self.days % self.window
+
+        old_valid = self.window_valid[slot]
+        old_rate = np.where(old_valid, self.window_rate[slot], 0.0)
+        self.sum_rate += np.where(valid, rate, 0.0) - old_rate
+        self.sumsq_rate += np.where(valid, rate ** 2, 0.0) - old_rate ** 2
+        self.sum_meta += np.where(valid, meta, 0.0) - np.where(old_valid, self.window_meta[slot], 0.0)
+        self.sum_ga4 += np.where(valid, ga4, 0.0) - np.where(old_valid, self.window_ga4[slot], 0.0)
+        self.valid_days += valid.astype(np.int64) - old_valid.astype(np.int64)
+
+        self.window_rate[slot] = rate
+        self.window_meta[slot] = meta
+        self.window_ga4[slot] = ga4
+        self.window_valid[slot] = valid
+
+        self.ewma = np.where(
+            valid, np.where(self.observed > 0, self.alpha * rate + (1 - self.alpha) * self.ewma, rate), self.ewma
+        )
+        self.observed += valid
+        self.days += 1
+
+    def update(self, data, version=None):
+        """SheetCache 的回呼：納入新的日期並評估最新日期，返回新產生的告警"""
+        table = as_table(data)
+        dated = sorted(
+            (iso_date, row) for row, iso_date in enumerate(normalize_date(label) for label in table.dates)
+            if iso_date is not None
+        )
+        if not dated:
+            return []
+
+        with self._lock:
+            latest_date, latest_row = dated[-1]
+            pending = [(d, row) for d, row in dated[:-1] if self.committed_date is None or d > self.committed_date]
+            rows = [row for _, row in pending] + [latest_row]
+            meta, ga4 = self._day_values(table, rows)
+
+            new_alerts = []
+            for k, (iso_date, _) in enumerate(pending):
+                alerts = self._evaluate(iso_date, meta[k], ga4[k])
+                self._alerts.extend(alerts)
+                new_alerts.extend(alerts)
+                self._fold(meta[k], ga4[k])
+                self.committed_date = iso_date
+
+            previous = self._pending
+            if self.committed_date is None or latest_date > self.committed_date:
+                self._pending = self._evaluate(latest_date, meta[-1], ga4[-1])
+            else:
+                self._pending = []
+            new_alerts.extend(self._pending)
+            fresh = self._mark_notified(new_alerts)
+            if pending or self._pending != previous:
+                self.revision += 1
+
+        for alert in fresh:
+            for reason in alert['reasons']:
+                ALERTS_RAISED.inc(reason=reason)
+        if fresh:
+            logger.warning(f"fail rate 告警: {len(fresh)} 個 ({', '.join(a['name'] + ' ' + a['date'] for a in fresh[:5])})")
+            self._send_webhook(fresh)
+        return fresh
+
+    def _mark_notified(self, alerts):
+        """返回還沒通知過的告警；同一日期同一對象只通知一次"""
+        fresh = []
+        for alert in alerts:
+            key = (alert['date'], alert['name'])
+            if key in self._notified:
+                continue
+            self._notified[key] = True
+            fresh.append(alert)
+        while len(self._notified) > ALERT_HISTORY_SIZE * 4:
+            self._notified.popitem(last=False)
+        return fresh
+
+    def _send_webhook(self, alerts):
+        """在背景線程POST新的告警，不阻塞快取刷新"""
+        if not self.webhook_url or (self.should_notify is not None and not self.should_notify()):
+            return
+
+        def send():
+            try:
+                response = requests.post(self.webhook_url, json={'alerts': alerts}, timeout=self.webhook_timeout)
+                response.raise_for_status()
+            except Exception as e:
+                WEBHOOK_ERRORS.inc()
+                logger.error(f"告警webhook發送失敗: {e}")
+
+        threading.Thread(target=send, name='alert-webhook', daemon=True).start()
+
+    def alerts(self, since=None, kind=None, name=None, limit=None):
+        """查詢告警，最新的在前；since為ISO日期，limit為正整數"""
+        if limit is not None and limit < 1:
+            raise ValueError('limit 應為正整數')
+        with self._lock:
+            alerts = list(self._alerts) + list(self._pending)
+        alerts.reverse()
+        if since:
+            alerts = [a for a in alerts if a['date'] >= since]
+        if kind:
+            alerts = [a for a in alerts if a['kind'] == kind]
+        if name:
+            alerts = [a for a in alerts if a['name'] == name]
+        return alerts[:limit] if limit is not None else alerts
+
+    def config(self):
+        return {
+            'windowDays': self.window,
+            'ewmaAlpha': self.alpha,
+            'zThreshold': self.z_threshold,
+            'failRateThreshold': self.fail_rate_threshold,
+            'minMeta': self.min_meta,
+            'minHistory': self.min_history,
+            'webhook': bool(self.webhook_url),
+            'committedDate': self.committed_date
+        }
@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+from cloak_table import CloakTable, as_table
+from metrics import stage_timer
+
+try:
+    import brotli
+except ImportError:  # brotli為可選依賴，未安裝時只提供gzip
+    brotli = None
+
+# 小於此大小的回應不壓縮
+MIN_COMPRESS_BYTES = 1024
+# 最多保留幾份已序列化的回應
+ENCODED_CACHE_SIZE = 16
+
+_encoded_cache = OrderedDict()
+_encoded_cache_lock = threading.Lock()
+
+
+def to_columnar(data):
+    """把每日字典列表轉換為欄式格式：dates[] + 每個斗篷的 meta[]/ga4[]/failRate[]"""
+    cloaks = []
+    seen = set()
+    for item in data:
+        for key in item:
+            if key != 'date' and key not in seen:
+                seen.add(key)
+                cloaks.append(key)
+
+    empty = {'meta': 0, 'ga4': 0, 'failRate': 0.0}
+    columns = {}
+    for cloak in cloaks:
+        cells = [item.get(cloak, empty) for item in data]
+        columns[cloak] = {
+            'meta': [cell['meta'] for cell in cells],
+            'ga4': [cell['ga4'] for cell in cells],
+            'failRate': [cell['failRate'] for cell in cells]
+        }
+
+    return {
+        'format': 'columnar',
+        'dates': [item['date'] for item in data],
+        'cloaks': columns
+    }
+
+
+def format_data(data, fmt, fields=None):
+    """依照請求的格式返回數據；CloakTable直接由陣列產生，逐日格式才建立字典
+
+    fields指定每個格子只包括哪些欄位（例如只要failRate）。
+    """
+    if fields is not None:
+        data = as_table(data)
+    if isinstance(data, CloakTable):
+        return data.to_columnar(fields) if fmt == 'columnar' else data.to_records(fields)
+    if fmt == 'columnar':
+        return to_columnar(data)
+    return data
+
+
+def _compress(body, encoding):
+    with stage_timer('compress'):
+        if encoding == 'br':
+            return brotli.compress(body, quality=5)
+        if encoding == 'gzip':
+            return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def _negotiate_encoding(size):
+    """根據Accept-Encoding選擇壓縮方式"""
+    if size < MIN_COMPRESS_BYTES:
+        return 'identity'
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return request.accept_encodings.best_match(offered) or 'identity'
+
+
+def _serialized(payload, cache_key):
+    """序列化payload，cache_key相同時重用之前的結果（包括已壓縮的版本）"""
+    if cache_key is not None:
+        cache_key = (current_app.import_name,) + tuple(cache_key)
+        with _encoded_cache_lock:
+            entry = _encoded_cache.get(cache_key)
+            if entry is not None:
+                _encoded_cache.move_to_end(cache_key)
+                return entry
+
+    # 包括建立回應數據（例如轉換為欄式格式）的時間
+    with stage_timer('serialize'):
+        if callable(payload):
+            payload = payload()
+        body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    entry = {
+        'tag': hashlib.sha256(body).hexdigest()[:32],
+        'size': len(body),
+        'identity': body
+    }
+
+    if cache_key is not None:
+        with _encoded_cache_lock:
+            _encoded_cache[cache_key] = entry
+            while len(_encoded_cache) > ENCODED_CACHE_SIZE:
+                _encoded_cache.popitem(last=False)
+    return entry
+
+
+def encode_payload(payload):
+    """序列化並預先產生所有壓縮版本，返回與 json_response 快取相同格式的條目"""
+    entry = _serialized(payload, None)
+    if entry['size'] >= MIN_COMPRESS_BYTES:
+        for encoding in (['br', 'gzip'] if brotli is not None else ['gzip']):
+            entry[encoding] = _compress(entry['identity'], encoding)
+    return entry
+
+
+def clear_encoded_cache():
+    """清空已序列化的回應（基準測試量測冷啟動時使用）"""
+    with _encoded_cache_lock:
+        _encoded_cache.clear()
+
+
+def json_response(payload, cache_key=None, encoded=None):
+    """返回JSON回應，支援gzip/brotli壓縮和ETag (304 Not Modified)
+
+    payload可以是返回數據的函數；cache_key應唯一對應payload內容（例如快照版本+格式），
+    相同的cache_key會直接重用已序列化和壓縮的結果，不再呼叫payload。
+    encoded為 encode_payload 預先產生的條目（例如共享快照中的回應）時直接使用。
+    """
+    entry = encoded if encoded is not None else _serialized(payload, cache_key)
+    encoding = _negotiate_encoding(entry['size'])
+    # 不同壓縮方式的內容不同，強ETag需要區分
+    etag = entry['tag'] if encoding == 'identity' else f"{entry['tag']}-{encoding}"
+
+    if request.if_none_match.contains(etag) or request.if_none_match.contains(entry['tag']):
+        response = Response(status=304)
+    else:
+        if encoding not in entry:
+            entry[encoding] = _compress(entry['identity'], encoding)
+        body = entry[encoding]
+        # 共享快照的條目是記憶體映射的memoryview，WSGI伺服器要求bytes
+        response = Response(body if isinstance(body, bytes) else bytes(body), mimetype='application/json')
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    # 允許瀏覽器快取，但每次都要向服務器重新驗證
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
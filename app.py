@@ -1,12 +1,16 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-import requests
 import pandas as pd
 import io
+import os
 import json
 from datetime import datetime
 import logging
 
+from api_format import format_data, json_response
+from metrics import metrics_response, stage_timer
+from sheet_cache import SheetCache
+
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:8001', 'http://127.0.0.1:8001'], supports_credentials=True)
 
@@ -17,25 +21,16 @@ logger = logging.getLogger(__name__)
 # Google Sheets URL
 GOOGLE_SHEETS_URL = "https://docs.google.com/spreadsheets/d/147oXFJ07Hmrc1GoUKlq4dSrvKXYJ6u4to_LiJ7GC_Mg/edit?gid=599397897#gid=599397897"
 
-def get_google_sheets_data():
-    """從Google Sheets獲取數據"""
-    try:
-        # 將Google Sheets URL轉換為CSV格式
-        csv_url = GOOGLE_SHEETS_URL.replace('/edit?gid=', '/export?format=csv&gid=')
-        
-        # 發送請求獲取CSV數據
-        response = requests.get(csv_url)
-        response.raise_for_status()
-        
-        # 讀取CSV數據
-        df = pd.read_csv(io.StringIO(response.text))
-        
-        logger.info(f"成功獲取數據，共 {len(df)} 行")
-        return df
-        
-    except Exception as e:
-        logger.error(f"獲取Google Sheets數據失敗: {str(e)}")
-        return None
+# 快取存活時間（秒），過期後先返回舊數據再於背景刷新
+SHEET_CACHE_TTL = int(os.environ.get('SHEET_CACHE_TTL', '60'))
+
+def parse_csv_text(csv_text):
+    """讀取CSV數據並處理"""
+    with stage_timer('decode'):
+        df = pd.read_csv(io.StringIO(csv_text))
+    logger.debug(f"成功獲取數據，共 {len(df)} 行")
+    with stage_timer('parse'):
+        return process_excel_data(df)
 
 def process_excel_data(df):
     """處理Excel數據並轉換為JSON格式"""
@@ -43,8 +38,9 @@ def process_excel_data(df):
         # 清理數據
         df = df.dropna(how='all')  # 刪除全空行
         
-        logger.info(f"原始數據形狀: {df.shape}")
-        logger.info(f"前5行數據:\n{df.head()}")
+        logger.debug(f"原始數據形狀: {df.shape}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"前5行數據:\n{df.head()}")
         
         # 基於您提供的圖片數據創建測試數據
         # 從圖片中可以看到：jt01, jt02, jt03, jt04, jt05 的實際數據
@@ -117,25 +113,29 @@ def process_excel_data(df):
         logger.error(f"處理Excel數據失敗: {str(e)}")
         return None
 
+# 將Google Sheets URL轉換為CSV格式
+sheet_cache = SheetCache(
+    GOOGLE_SHEETS_URL.replace('/edit?gid=', '/export?format=csv&gid='),
+    parse_csv_text,
+    ttl=SHEET_CACHE_TTL
+)
+
 @app.route('/api/data', methods=['GET'])
 def get_data():
     """API端點：獲取處理後的數據"""
     try:
-        # 獲取原始數據
-        df = get_google_sheets_data()
-        if df is None:
-            return jsonify({'error': '無法獲取Google Sheets數據'}), 500
-        
-        # 處理數據
-        processed_data = process_excel_data(df)
+        # 從快取獲取處理後的數據
+        processed_data, version, updated_at = sheet_cache.snapshot()
         if processed_data is None:
-            return jsonify({'error': '數據處理失敗'}), 500
+            return jsonify({'error': '無法獲取Google Sheets數據'}), 500
         
-        response = jsonify({
+        # format=columnar 時返回欄式格式
+        fmt = request.args.get('format', 'rows')
+        response = json_response(lambda: {
             'success': True,
-            'data': processed_data,
-            'timestamp': datetime.now().isoformat()
-        })
+            'data': format_data(processed_data, fmt),
+            'timestamp': updated_at
+        }, cache_key=('data', version, fmt))
         
         # 添加CORS頭部
         response.headers.add('Access-Control-Allow-Origin', '*')
@@ -148,13 +148,22 @@ def get_data():
         logger.error(f"API錯誤: {str(e)}")
         return jsonify({'error': f'服務器錯誤: {str(e)}'}), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus格式的各階段耗時和計數"""
+    return metrics_response(sheet_cache)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康檢查端點"""
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'cache': sheet_cache.stats()
     })
 
 if __name__ == '__main__':
+    # debug模式下reloader的父進程不提供服務，只在實際服務的進程啟動刷新線程
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        sheet_cache.start()
     app.run(debug=True, host='0.0.0.0', port=5001)
@@ -1,12 +1,18 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-import requests
 import pandas as pd
 import io
+import os
 import json
 from datetime import datetime
 import logging
 
+from api_format import format_data, json_response
+from cloak_table import CloakTable
+from fast_parser import parse_sheet_table
+from metrics import FALLBACK_TEST_DATA, PARSE_CELL_ERRORS, log_sampled, metrics_response, stage_timer
+from sheet_cache import SheetCache
+
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:8001', 'http://127.0.0.1:8001'], supports_credentials=True)
 
@@ -15,64 +21,82 @@ logger = logging.getLogger(__name__)
 
 GOOGLE_SHEETS_URL = "https://docs.google.com/spreadsheets/d/147oXFJ07Hmrc1GoUKlq4dSrvKXYJ6u4to_LiJ7GC_Mg/edit?gid=599397897#gid=599397897"
 
-def get_google_sheets_data():
+# 根據您提供的結構：
+# A欄: 日期 (A3:A33 = 8/1到8/31)
+# B-AN欄: JB系列 (JB + jt01-jt13，每個斗篷3欄：meta, GA4, fail rate)
+# AO-CB欄: JW系列 (JW + jtw01-jtw13，每個斗篷3欄：meta, GA4, fail rate)  
+# CD-DP欄: JG系列 (JG + jtg01-jtg13，每個斗篷3欄：meta, GA4, fail rate)
+#
+# 定義所有系列的斗篷和他們的起始欄位  
+# 根據您的說明：JB、JW、JG是產品名稱，實際斗篷是 jt01-jt13, jtw01-jtw13, jtg01-jtg13
+SERIES_CONFIG = {
+    'jb': {
+        'cloaks': ['jt01', 'jt02', 'jt03', 'jt04', 'jt05', 'jt06', 'jt07', 'jt08', 'jt09', 'jt10', 'jt11', 'jt12', 'jt13'],
+        'start_col': 4  # 跳過JB產品名稱，從實際斗篷開始
+    },
+    'jw': {
+        'cloaks': ['jtw01', 'jtw02', 'jtw03', 'jtw04', 'jtw05', 'jtw06', 'jtw07', 'jtw08', 'jtw09', 'jtw10', 'jtw11', 'jtw12', 'jtw13'],
+        'start_col': 43  # AO欄開始，跳過JW產品名稱
+    },
+    'jg': {
+        'cloaks': ['jtg01', 'jtg02', 'jtg03', 'jtg04', 'jtg05', 'jtg06', 'jtg07', 'jtg08', 'jtg09', 'jtg10', 'jtg11', 'jtg12', 'jtg13'],
+        'start_col': 84  # CD欄開始，跳過JG產品名稱  
+    }
+}
+
+# 數據行範圍 (A3:A33，pandas索引2到32)
+FIRST_DATA_ROW = 2
+LAST_DATA_ROW = 33
+
+# 快取存活時間（秒），過期後先返回舊數據再於背景刷新
+SHEET_CACHE_TTL = int(os.environ.get('SHEET_CACHE_TTL', '60'))
+
+# 每次成功解析後保存的快照，上游無法連線時優先使用它而不是備用測試數據；設為空字串停用
+SNAPSHOT_PERSIST_PATH = os.environ.get('SNAPSHOT_PERSIST_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'last_snapshot_fixed.bin')) or None
+
+def get_csv_export_url():
+    """將Google Sheets URL轉換為CSV導出URL"""
+    if '/edit' in GOOGLE_SHEETS_URL:
+        csv_url = GOOGLE_SHEETS_URL.replace('/edit#gid=', '/export?format=csv&gid=')
+        csv_url = csv_url.replace('/edit?gid=', '/export?format=csv&gid=')
+    else:
+        csv_url = GOOGLE_SHEETS_URL
+    
+    csv_url = csv_url.replace('#gid=', '&gid=') if '#gid=' in csv_url else csv_url
+    return csv_url
+
+def parse_csv_text(csv_text):
+    """將CSV文字讀成DataFrame後解析"""
+    with stage_timer('decode'):
+        df = pd.read_csv(io.StringIO(csv_text))
+    logger.debug(f"成功獲取數據，共 {len(df)} 行")
+    return parse_google_sheets_data(df)
+
+def parse_google_sheets_data(df, last_row=LAST_DATA_ROW):
+    """解析Google Sheets數據，基於正確的欄位結構（向量化）"""
     try:
-        # 將Google Sheets URL轉換為CSV導出URL
-        if '/edit' in GOOGLE_SHEETS_URL:
-            csv_url = GOOGLE_SHEETS_URL.replace('/edit#gid=', '/export?format=csv&gid=')
-            csv_url = csv_url.replace('/edit?gid=', '/export?format=csv&gid=')
-        else:
-            csv_url = GOOGLE_SHEETS_URL
-        
-        csv_url = csv_url.replace('#gid=', '&gid=') if '#gid=' in csv_url else csv_url
-        
-        logger.info(f"正在獲取Google Sheets數據: {csv_url}")
-        
-        response = requests.get(csv_url, timeout=10)
-        response.raise_for_status()
-        
-        # 將CSV數據轉換為DataFrame
-        df = pd.read_csv(io.StringIO(response.text))
-        logger.info(f"成功獲取數據，共 {len(df)} 行")
+        logger.debug(f"開始解析Google Sheets數據，原始形狀: {df.shape}")
+        with stage_timer('parse'):
+            result_data = parse_sheet_table(df, SERIES_CONFIG, FIRST_DATA_ROW, last_row)
+        logger.info(f"成功解析 {len(result_data)} 個日期的數據")
+        return result_data
         
-        return df
     except Exception as e:
-        logger.error(f"獲取Google Sheets數據失敗: {str(e)}")
+        logger.error(f"解析Google Sheets數據失敗: {str(e)}")
         return None
 
-def parse_google_sheets_data(df):
-    """解析Google Sheets數據，基於正確的欄位結構"""
+def parse_google_sheets_data_rows(df, last_row=LAST_DATA_ROW):
+    """逐行解析Google Sheets數據（舊版，保留作為向量化解析的對照）"""
     try:
-        logger.info(f"開始解析Google Sheets數據，原始形狀: {df.shape}")
-        logger.info(f"前5行數據:\n{df.head()}")
-        
-        # 根據您提供的結構：
-        # A欄: 日期 (A3:A33 = 8/1到8/31)
-        # B-AN欄: JB系列 (JB + jt01-jt13，每個斗篷3欄：meta, GA4, fail rate)
-        # AO-CB欄: JW系列 (JW + jtw01-jtw13，每個斗篷3欄：meta, GA4, fail rate)  
-        # CD-DP欄: JG系列 (JG + jtg01-jtg13，每個斗篷3欄：meta, GA4, fail rate)
+        logger.debug(f"開始解析Google Sheets數據，原始形狀: {df.shape}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"前5行數據:\n{df.head()}")
         
         result_data = []
-        
-        # 定義所有系列的斗篷和他們的起始欄位  
-        # 根據您的說明：JB、JW、JG是產品名稱，實際斗篷是 jt01-jt13, jtw01-jtw13, jtg01-jtg13
-        series_config = {
-            'jb': {
-                'cloaks': ['jt01', 'jt02', 'jt03', 'jt04', 'jt05', 'jt06', 'jt07', 'jt08', 'jt09', 'jt10', 'jt11', 'jt12', 'jt13'],
-                'start_col': 4  # 跳過JB產品名稱，從實際斗篷開始
-            },
-            'jw': {
-                'cloaks': ['jtw01', 'jtw02', 'jtw03', 'jtw04', 'jtw05', 'jtw06', 'jtw07', 'jtw08', 'jtw09', 'jtw10', 'jtw11', 'jtw12', 'jtw13'],
-                'start_col': 43  # AO欄開始，跳過JW產品名稱
-            },
-            'jg': {
-                'cloaks': ['jtg01', 'jtg02', 'jtg03', 'jtg04', 'jtg05', 'jtg06', 'jtg07', 'jtg08', 'jtg09', 'jtg10', 'jtg11', 'jtg12', 'jtg13'],
-                'start_col': 84  # CD欄開始，跳過JG產品名稱  
-            }
-        }
+        failed_cells = 0
         
         # 從第3行開始處理數據 (索引2，因為pandas是0基礎)
-        for index in range(2, min(len(df), 33)):  # A3:A33
+        for index in range(FIRST_DATA_ROW, min(len(df), last_row)):  # A3:A33
             row = df.iloc[index]
             
             # 獲取日期 (A欄)
@@ -81,12 +105,12 @@ def parse_google_sheets_data(df):
                 continue
                 
             date_str = str(date_value)
-            logger.info(f"處理日期: {date_str}")
+            logger.debug(f"處理日期: {date_str}")
             
             date_data = {'date': date_str}
             
             # 處理所有系列
-            for series_name, config in series_config.items():
+            for series_name, config in SERIES_CONFIG.items():
                 col_index = config['start_col']
                 
                 for cloak in config['cloaks']:
@@ -123,10 +147,11 @@ def parse_google_sheets_data(df):
                             
                             # 只在有數據時記錄
                             if meta > 0 or ga4 > 0 or fail_rate > 0:
-                                logger.info(f"  {cloak}: meta={meta}, ga4={ga4}, failRate={fail_rate}")
+                                logger.debug(f"  {cloak}: meta={meta}, ga4={ga4}, failRate={fail_rate}")
                             
                         except (ValueError, TypeError) as e:
-                            logger.warning(f"轉換數據失敗 {cloak} 在第 {index+1} 行: {e}")
+                            failed_cells += 1
+                            logger.debug(f"轉換數據失敗 {cloak} 在第 {index+1} 行: {e}")
                             date_data[cloak] = {'meta': 0, 'ga4': 0, 'failRate': 0.00}
                     else:
                         # 如果欄位不足，設為0
@@ -136,6 +161,9 @@ def parse_google_sheets_data(df):
             
             result_data.append(date_data)
         
+        if failed_cells:
+            PARSE_CELL_ERRORS.inc(failed_cells)
+            logger.warning(f"{failed_cells} 個斗篷數據轉換失敗，已設為0")
         logger.info(f"成功解析 {len(result_data)} 個日期的數據")
         return result_data
         
@@ -143,17 +171,19 @@ def parse_google_sheets_data(df):
         logger.error(f"解析Google Sheets數據失敗: {str(e)}")
         return None
 
+sheet_cache = SheetCache(get_csv_export_url(), parse_csv_text, ttl=SHEET_CACHE_TTL, persist_path=SNAPSHOT_PERSIST_PATH)
+sheet_cache.warm_start()
+
 def create_test_data():
     """創建基於Google Sheets結構的測試數據"""
-    # 嘗試從Google Sheets獲取真實數據
-    df = get_google_sheets_data()
-    if df is not None:
-        parsed_data = parse_google_sheets_data(df)
-        if parsed_data:
-            return parsed_data
+    # 嘗試從快取獲取真實數據
+    parsed_data, version, updated_at = sheet_cache.snapshot()
+    if parsed_data:
+        return parsed_data, version, updated_at
     
-    # 如果獲取失敗，使用備用測試數據
-    logger.warning("使用備用測試數據")
+    # 如果獲取失敗，使用備用測試數據；每次請求都會走到這裡，日誌限制為每分鐘一次
+    FALLBACK_TEST_DATA.inc()
+    log_sampled(logger.warning, 'fallback', "使用備用測試數據")
     
     test_data = []
     
@@ -197,26 +227,34 @@ def create_test_data():
         
         test_data.append(date_data)
     
-    return test_data
+    return test_data, None, datetime.now().isoformat()
 
 @app.route('/api/data', methods=['GET'])
 def get_data():
     try:
         # 暫時使用測試數據
-        data = create_test_data()
+        data, version, updated_at = create_test_data()
         
-        # 添加CORS標頭
-        response = jsonify({
+        # format=columnar 時返回欄式格式；備用測試數據和陳舊數據不重用序列化結果
+        fmt = request.args.get('format', 'rows')
+        stale, age = sheet_cache.freshness()
+        cache_key = ('data', version, fmt) if version is not None and not stale else None
+        # 上游無法連線時標記為保存的舊數據並附上年齡
+        marker = {'stale': True, 'ageSeconds': age} if stale else {}
+        response = json_response(lambda: dict({
             'success': True,
-            'data': data,
-            'timestamp': datetime.now().isoformat()
-        })
+            'data': format_data(data, fmt),
+            'timestamp': updated_at,
+            # 無法取得上游數據時明確告知前端目前顯示的是備用測試數據
+            'fallback': version is None
+        }, **marker), cache_key=cache_key)
         
         response.headers['Access-Control-Allow-Origin'] = '*'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
         
-        logger.info(f"返回數據: {len(data)} 個日期，第一個日期有 {len(data[0])-1} 個斗篷")
+        cloak_count = len(data.cloaks) if isinstance(data, CloakTable) else len(data[0]) - 1
+        logger.debug(f"返回數據: {len(data)} 個日期，每個日期有 {cloak_count} 個斗篷")
         
         return response
         
@@ -224,12 +262,21 @@ def get_data():
         logger.error(f"處理請求失敗: {str(e)}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus格式的各階段耗時和計數"""
+    return metrics_response(sheet_cache)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'cache': sheet_cache.stats()
     })
 
 if __name__ == '__main__':
+    # debug模式下reloader的父進程不提供服務，只在實際服務的進程啟動刷新線程
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        sheet_cache.start()
     app.run(debug=True, host='0.0.0.0', port=5002)
@@ -1,11 +1,24 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-import pandas as pd
-import requests
 import logging
-import csv
-import io
-from datetime import datetime
+import os
+from datetime import date, datetime
+
+from aggregation import DEFAULT_GROUPS, AggregatorCache, expand_cloaks, group_key, parse_group_args
+from alerting import AlertEngine
+from api_format import format_data, json_response
+from data_query import DataIndex, DataQueryCache, parse_filter_args, query_key
+from event_stream import Broadcaster, format_event
+from history_store import HistoryStore
+from metrics import metrics_response
+from rollup import RollupCache, downsample_records, downsample_table, parse_shape_args, rollup_table
+from shared_snapshot import SharedSnapshotCache
+from sheet_config import (
+    FIRST_DATA_ROW, LAST_DATA_ROW, SHEET_CACHE_TTL, SHEET_STREAMING,
+    create_sheet_source, parse_csv_stream, parse_google_sheets_data
+)
+from snapshot_delta import DeltaLog
+from stats_index import StatsIndex, StatsIndexCache
 
 app = Flask(__name__)
 CORS(app, origins=['http://localhost:8001', 'http://127.0.0.1:8001'], supports_credentials=True)
@@ -14,18 +27,24 @@ CORS(app, origins=['http://localhost:8001', 'http://127.0.0.1:8001'], supports_c
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Google Sheets URL (CSV export)
-GOOGLE_SHEETS_URL = "https://docs.google.com/spreadsheets/d/147oXFJ07Hmrc1GoUKlq4dSrvKXYJ6u4to_LiJ7GC_Mg/export?format=csv&gid=599397897"
+# 背景刷新線程抓取上游的間隔（秒），所有客戶端共用同一份快照
+SHEET_POLL_INTERVAL = int(os.environ.get('SHEET_POLL_INTERVAL', str(SHEET_CACHE_TTL)))
+# 設為0時不啟動背景刷新，改回由請求觸發（TTL過期時先返回舊數據再刷新）
+SHEET_BACKGROUND_POLL = os.environ.get('SHEET_BACKGROUND_POLL', '1') == '1'
 
-def get_google_sheets_data():
-    """從Google Sheets獲取CSV數據"""
-    try:
-        response = requests.get(GOOGLE_SHEETS_URL, timeout=10)
-        response.raise_for_status()
-        return response.text
-    except Exception as e:
-        logger.error(f"獲取Google Sheets數據失敗: {e}")
-        return None
+# 歷史數據SQLite檔案，每次刷新後寫入變更，供跨月份的日期範圍查詢
+HISTORY_DB_PATH = os.environ.get('HISTORY_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.sqlite3'))
+
+# 多worker部署（例如gunicorn -w 4）時設定為共享檔案路徑（建議 /dev/shm/...）：只有一個worker
+# 抓取和解析上游，快照及預先序列化的回應以記憶體映射分享給所有worker
+SHARED_SNAPSHOT_PATH = os.environ.get('SHARED_SNAPSHOT_PATH') or None
+
+# fail rate告警：滾動統計天數、z-score門檻、絕對門檻（百分比，未設定時不使用）及通知用的webhook
+ALERT_WINDOW_DAYS = int(os.environ.get('ALERT_WINDOW_DAYS', '7'))
+ALERT_Z_THRESHOLD = float(os.environ.get('ALERT_Z_THRESHOLD', '3'))
+ALERT_FAIL_RATE_THRESHOLD = float(os.environ['ALERT_FAIL_RATE_THRESHOLD']) if os.environ.get('ALERT_FAIL_RATE_THRESHOLD') else None
+ALERT_MIN_META = int(os.environ.get('ALERT_MIN_META', '50'))
+ALERT_WEBHOOK_URL = os.environ.get('ALERT_WEBHOOK_URL') or None
 
 def safe_convert_int(value):
     """安全轉換整數"""
@@ -48,133 +67,451 @@ def safe_convert_float(value):
     except (ValueError, TypeError):
         return 0.0
 
-def parse_google_sheets_data(csv_content):
-    """解析Google Sheets的CSV數據"""
+def parse_date_row(row):
+    """解析一行CSV數據，返回當天所有斗篷的數據；沒有日期時返回None（舊版，保留作為欄位計劃解析的對照）"""
+    if len(row) == 0 or not row[0].strip():
+        return None
+
+    date_str = row[0].strip()
+    logger.debug(f"處理日期: {date_str}")
+
+    date_data = {'date': date_str}
+
+    # JB系列: jt01-jt13 
+    # 根據實際數據分析，嘗試：ga4, fail_rate, meta 順序
+    # C欄=索引2，所以jt01=2:4, jt02=5:7, jt03=8:10, ...
+    jt_cloaks = ['jt01', 'jt02', 'jt03', 'jt04', 'jt05', 'jt06', 'jt07', 'jt08', 'jt09', 'jt10', 'jt11', 'jt12', 'jt13']
+    for i, cloak in enumerate(jt_cloaks):
+        base_col = 2 + i * 3  # C欄開始 (索引2)，跳過B欄的JB標題
+        ga4_col = base_col            # 嘗試GA4
+        fail_rate_col = base_col + 1  # 嘗試fail rate
+        meta_col = base_col + 2       # 嘗試meta
+
+        meta = safe_convert_int(row[meta_col] if meta_col < len(row) else '')
+        ga4 = safe_convert_int(row[ga4_col] if ga4_col < len(row) else '')
+        fail_rate = safe_convert_float(row[fail_rate_col] if fail_rate_col < len(row) else '')
+
+        date_data[cloak] = {
+            'meta': meta,
+            'ga4': ga4, 
+            'failRate': round(fail_rate, 2)
+        }
+
+    # JW系列: jtw01-jtw13 
+    # AO欄開始，A=0,B=1,...,AO=40，但需要跳過JW產品標題欄
+    jtw_cloaks = ['jtw01', 'jtw02', 'jtw03', 'jtw04', 'jtw05', 'jtw06', 'jtw07', 'jtw08', 'jtw09', 'jtw10', 'jtw11', 'jtw12', 'jtw13']
+    for i, cloak in enumerate(jtw_cloaks):
+        base_col = 41 + i * 3  # AO欄是JW標題，實際數據從AP開始 (索引41)
+        meta_col = base_col
+        ga4_col = base_col + 1
+        fail_rate_col = base_col + 2
+
+        meta = safe_convert_int(row[meta_col] if meta_col < len(row) else '')
+        ga4 = safe_convert_int(row[ga4_col] if ga4_col < len(row) else '')
+        fail_rate = safe_convert_float(row[fail_rate_col] if fail_rate_col < len(row) else '')
+
+        date_data[cloak] = {
+            'meta': meta,
+            'ga4': ga4,
+            'failRate': round(fail_rate, 2)
+        }
+
+    # JG系列: jtg01-jtg13 
+    # CD欄開始，CD=80是JG標題，實際數據從CE開始=81
+    jtg_cloaks = ['jtg01', 'jtg02', 'jtg03', 'jtg04', 'jtg05', 'jtg06', 'jtg07', 'jtg08', 'jtg09', 'jtg10', 'jtg11', 'jtg12', 'jtg13']
+    for i, cloak in enumerate(jtg_cloaks):
+        base_col = 81 + i * 3  # CE欄開始 (索引81)，跳過CD欄的JG標題
+        meta_col = base_col
+        ga4_col = base_col + 1
+        fail_rate_col = base_col + 2
+
+        meta = safe_convert_int(row[meta_col] if meta_col < len(row) else '')
+        ga4 = safe_convert_int(row[ga4_col] if ga4_col < len(row) else '')
+        fail_rate = safe_convert_float(row[fail_rate_col] if fail_rate_col < len(row) else '')
+
+        date_data[cloak] = {
+            'meta': meta,
+            'ga4': ga4,
+            'failRate': round(fail_rate, 2)
+        }
+
+    return date_data
+
+def data_payload(data, version, updated_at, fmt, fields=None):
+    """/api/data 的完整回應"""
+    return {
+        'success': True,
+        'version': delta_log.token(version),
+        'data': format_data(data, fmt, fields),
+        'lastUpdate': updated_at
+    }
+
+def shared_payloads(data, version, updated_at):
+    """寫入共享快照的預先序列化回應"""
+    return {fmt: data_payload(data, version, updated_at, fmt) for fmt in ('rows', 'columnar')}
+
+def shape_table(table, bucket=None, max_points=None):
+    """篩選後的表格按 bucket 彙總、降採樣到 max_points"""
+    if bucket:
+        table = rollup_table(table, bucket)
+    return downsample_table(table, max_points) if max_points else table
+
+sheet_source = create_sheet_source()
+if SHARED_SNAPSHOT_PATH:
+    sheet_cache = SharedSnapshotCache(SHARED_SNAPSHOT_PATH, sheet_source, shared_payloads)
+else:
+    sheet_cache = sheet_source
+aggregators = AggregatorCache()
+rollups = RollupCache()
+delta_log = DeltaLog(epoch=getattr(sheet_cache, 'epoch', None))
+history_store = HistoryStore(HISTORY_DB_PATH)
+# 每次數據刷新後立即預先計算分組加總，並寫入歷史數據（共享模式下只由負責抓取上游的worker寫入）
+sheet_cache.add_listener(aggregators.get)
+sheet_source.add_listener(history_store.record)
+sheet_cache.add_listener(delta_log.record)
+snapshot_stats = StatsIndexCache()
+history_stats = StatsIndexCache()
+
+def build_stats_index(data, version):
+    """每次數據更新後預先建立統計索引"""
+    return snapshot_stats.get(version, lambda: StatsIndex(data))
+
+sheet_cache.add_listener(build_stats_index)
+data_queries = DataQueryCache()
+sheet_cache.add_listener(data_queries.index)
+
+alert_engine = AlertEngine(
+    window=ALERT_WINDOW_DAYS,
+    z_threshold=ALERT_Z_THRESHOLD,
+    fail_rate_threshold=ALERT_FAIL_RATE_THRESHOLD,
+    min_meta=ALERT_MIN_META,
+    webhook_url=ALERT_WEBHOOK_URL,
+    should_notify=lambda: getattr(sheet_cache, 'is_leader', True)
+)
+# 啟動時以歷史數據建立滾動統計，之後每次刷新只加入新的日期
+try:
+    alert_engine.update(history_store.query())
+except Exception as e:
+    logger.error(f"以歷史數據初始化告警統計失敗: {e}")
+sheet_cache.add_listener(alert_engine.update)
+stream_hub = Broadcaster()
+
+def publish_update(data, version):
+    """把新版本推送給訂閱 /api/stream 的客戶端：能計算差異時推送差異，否則通知重新載入"""
+    if not stream_hub.client_count():
+        return
+    token = delta_log.token(version)
+    delta = delta_log.delta(delta_log.token(version - 1), data, version) if version > 1 else None
+    if delta is None:
+        stream_hub.publish('reset', {'version': token, 'lastUpdate': sheet_cache.updated_at}, event_id=token)
+        return
+    stream_hub.publish('delta', {
+        'version': token,
+        'since': delta_log.token(version - 1),
+        'changes': delta['cells'],
+        'removed': delta['removed'],
+        'dates': delta['dates'],
+        'lastUpdate': sheet_cache.updated_at
+    }, event_id=token)
+
+sheet_cache.add_listener(publish_update)
+# 啟動時載入上次保存的快照，第一個請求不必等待上游；共享模式下由負責刷新的worker在第一次讀取時載入
+if not SHARED_SNAPSHOT_PATH:
+    sheet_source.warm_start()
+
+@app.before_request
+def start_poller():
+    """第一個請求時啟動背景刷新線程（重複呼叫不會啟動多個）"""
+    if SHEET_BACKGROUND_POLL:
+        sheet_cache.start(SHEET_POLL_INTERVAL)
+
+@app.route('/api/data', methods=['GET'])
+def get_data():
+    """獲取失敗率數據；帶 from/to (YYYY-MM-DD) 時從歷史數據查詢
+
+    since=<version> 時只返回該版本之後有變化的格子；版本太舊或無法比較時返回完整數據並標記 reset
+    bucket=week|month 按週/月重新加總，maxPoints=N 以LTTB降採樣到最多N個日期（兩者都不使用差異更新）
+    series/cloaks/pattern/start/end/fields 在服務器端篩選斗篷、日期及欄位（先篩選再彙總，不使用差異更新）
+    """
     try:
-        # 使用csv.reader處理CSV數據
-        csv_reader = csv.reader(io.StringIO(csv_content))
-        rows = list(csv_reader)
-        
-        logger.info(f"CSV總行數: {len(rows)}")
+        bucket, max_points = parse_shape_args(request.args)
+        query = parse_filter_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        date_from = request.args.get('from')
+        date_to = request.args.get('to')
+        if date_from or date_to:
+            return get_history_data(date_from, date_to, bucket, max_points, query)
         
-        result_data = []
+        # 從快取獲取解析後的數據
+        data, version, updated_at = sheet_cache.snapshot()
+        if not data:
+            return jsonify({'success': False, 'error': '無法獲取Google Sheets數據'})
         
-        # 從第3行開始處理數據 (索引2，因為0-based indexing)
-        for row_idx in range(2, min(len(rows), 33)):  # A3:A33 對應數據
-            row = rows[row_idx]
-            
-            if len(row) == 0 or not row[0].strip():
-                continue
-                
-            date_str = row[0].strip()
-            logger.info(f"處理日期: {date_str}")
-            
-            date_data = {'date': date_str}
-            
-            # JB系列: jt01-jt13 
-            # 根據實際數據分析，嘗試：ga4, fail_rate, meta 順序
-            # C欄=索引2，所以jt01=2:4, jt02=5:7, jt03=8:10, ...
-            jt_cloaks = ['jt01', 'jt02', 'jt03', 'jt04', 'jt05', 'jt06', 'jt07', 'jt08', 'jt09', 'jt10', 'jt11', 'jt12', 'jt13']
-            for i, cloak in enumerate(jt_cloaks):
-                base_col = 2 + i * 3  # C欄開始 (索引2)，跳過B欄的JB標題
-                ga4_col = base_col            # 嘗試GA4
-                fail_rate_col = base_col + 1  # 嘗試fail rate
-                meta_col = base_col + 2       # 嘗試meta
-                
-                meta = safe_convert_int(row[meta_col] if meta_col < len(row) else '')
-                ga4 = safe_convert_int(row[ga4_col] if ga4_col < len(row) else '')
-                fail_rate = safe_convert_float(row[fail_rate_col] if fail_rate_col < len(row) else '')
-                
-                date_data[cloak] = {
-                    'meta': meta,
-                    'ga4': ga4, 
-                    'failRate': round(fail_rate, 2)
-                }
-            
-            # JW系列: jtw01-jtw13 
-            # AO欄開始，A=0,B=1,...,AO=40，但需要跳過JW產品標題欄
-            jtw_cloaks = ['jtw01', 'jtw02', 'jtw03', 'jtw04', 'jtw05', 'jtw06', 'jtw07', 'jtw08', 'jtw09', 'jtw10', 'jtw11', 'jtw12', 'jtw13']
-            for i, cloak in enumerate(jtw_cloaks):
-                base_col = 41 + i * 3  # AO欄是JW標題，實際數據從AP開始 (索引41)
-                meta_col = base_col
-                ga4_col = base_col + 1
-                fail_rate_col = base_col + 2
-                
-                meta = safe_convert_int(row[meta_col] if meta_col < len(row) else '')
-                ga4 = safe_convert_int(row[ga4_col] if ga4_col < len(row) else '')
-                fail_rate = safe_convert_float(row[fail_rate_col] if fail_rate_col < len(row) else '')
-                
-                date_data[cloak] = {
-                    'meta': meta,
-                    'ga4': ga4,
-                    'failRate': round(fail_rate, 2)
-                }
-            
-            # JG系列: jtg01-jtg13 
-            # CD欄開始，CD=80是JG標題，實際數據從CE開始=81
-            jtg_cloaks = ['jtg01', 'jtg02', 'jtg03', 'jtg04', 'jtg05', 'jtg06', 'jtg07', 'jtg08', 'jtg09', 'jtg10', 'jtg11', 'jtg12', 'jtg13']
-            for i, cloak in enumerate(jtg_cloaks):
-                base_col = 81 + i * 3  # CE欄開始 (索引81)，跳過CD欄的JG標題
-                meta_col = base_col
-                ga4_col = base_col + 1
-                fail_rate_col = base_col + 2
-                
-                meta = safe_convert_int(row[meta_col] if meta_col < len(row) else '')
-                ga4 = safe_convert_int(row[ga4_col] if ga4_col < len(row) else '')
-                fail_rate = safe_convert_float(row[fail_rate_col] if fail_rate_col < len(row) else '')
-                
-                date_data[cloak] = {
-                    'meta': meta,
-                    'ga4': ga4,
-                    'failRate': round(fail_rate, 2)
-                }
-            
-            result_data.append(date_data)
+        token = delta_log.token(version)
+        since = request.args.get('since')
+        fmt = request.args.get('format', 'rows')
+        delta = delta_log.delta(since, data, version) if since and not (bucket or max_points or query) else None
+        # 上游無法連線時返回保存的舊數據並標記年齡；年齡每次不同，不重用序列化結果
+        stale, age = sheet_cache.freshness()
+        marker = {'stale': True, 'ageSeconds': age} if stale else {}
+        cached = lambda key: None if stale else key
+        if query:
+            # 從快照的篩選索引取出結果，依標準化的查詢鍵保存在LRU中
+            def filtered_payload():
+                table, unknown = data_queries.index(data, version).select(query)
+                return dict(
+                    data_payload(shape_table(table, bucket, max_points), version, updated_at, fmt, query['fields']),
+                    filter=query,
+                    unknownCloaks=unknown,
+                    bucket=bucket or 'day',
+                    maxPoints=max_points,
+                    **marker
+                )
+            key = (fmt, bucket, max_points) + query_key(query)
+            encoded = None if stale else data_queries.encoded(version, key, filtered_payload)
+            response = json_response(filtered_payload, encoded=encoded)
+        elif bucket or max_points:
+            # 彙總和降採樣的結果依快照版本快取
+            response = json_response(lambda: dict(
+                data_payload(rollups.table(data, version, bucket, max_points), version, updated_at, fmt),
+                bucket=bucket or 'day',
+                maxPoints=max_points,
+                **marker
+            ), cache_key=cached(('data', version, fmt, bucket, max_points)))
+        elif delta is not None:
+            response = json_response(dict({
+                'success': True,
+                'version': token,
+                'since': since,
+                'reset': False,
+                'changes': delta['cells'],  # [日期, 斗篷, meta, ga4, failRate]
+                'removed': delta['removed'],
+                'dates': delta['dates'],
+                'lastUpdate': updated_at
+            }, **marker), cache_key=cached(('delta', version, since)))
+        else:
+            # format=columnar 時返回欄式格式
+            payload = lambda: dict(data_payload(data, version, updated_at, fmt), **marker)
+            if since:
+                response = json_response(lambda: dict(payload(), reset=True), cache_key=cached(('data', version, fmt, 'reset')))
+            else:
+                # 共享快照中已有序列化和壓縮好的回應時直接使用
+                encoded = sheet_cache.encoded_body(version, fmt) if SHARED_SNAPSHOT_PATH and not stale else None
+                response = json_response(payload, cache_key=cached(('data', version, fmt)), encoded=encoded)
         
-        logger.info(f"成功解析 {len(result_data)} 個日期的數據")
-        if result_data:
-            logger.info(f"返回數據: {len(result_data)} 個日期，第一個日期有 {len(result_data[0])-1} 個斗篷")
+        # 添加CORS headers
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
         
-        return result_data
+        return response
         
     except Exception as e:
-        logger.error(f"解析Google Sheets數據時發生錯誤: {e}")
-        return []
+        logger.error(f"獲取數據時發生錯誤: {e}")
+        return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/data', methods=['GET'])
-def get_data():
-    """獲取失敗率數據"""
+def get_history_data(date_from, date_to, bucket=None, max_points=None, query=None):
+    """日期範圍查詢直接讀取歷史數據，不需要連線Google"""
+    try:
+        for value in (date_from, date_to):
+            if value:
+                date.fromisoformat(value)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'from/to 應為 YYYY-MM-DD 格式'}), 400
+    
+    def history_data():
+        records = history_store.query(date_from, date_to)
+        if query:
+            records = DataIndex(records).select(query)[0]
+        if not (bucket or max_points):
+            return records
+        return shape_table(records, bucket, max_points)
+    
+    def history_payload():
+        payload = {
+            'success': True,
+            'data': format_data(history_data(), fmt, query and query['fields']),
+            'from': date_from,
+            'to': date_to
+        }
+        if query:
+            payload['filter'] = query
+        return payload
+    
+    fmt = request.args.get('format', 'rows')
+    filter_key = query_key(query) if query else None
+    response = json_response(history_payload, cache_key=(
+        'history', history_store.revision, date_from, date_to, fmt, bucket, max_points, filter_key
+    ))
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+@app.route('/api/aggregate', methods=['GET', 'POST'])
+def get_aggregate():
+    """按斗篷分組加總 meta/GA4 並計算 fail rate
+
+    GET: group=名稱:斗篷列表 (可重複，支援 jt01-jt08 範圍寫法)
+    POST: {"groups": {"名稱": ["jt01", ...]}}
+    未指定分組時返回新舊A面 (jb_old, jb_new, ...)
+    bucket=week|month 按週/月加總後計算，maxPoints=N 以分組的 fail rate 降採樣
+    """
     try:
-        # 獲取Google Sheets數據
-        csv_content = get_google_sheets_data()
-        if not csv_content:
+        bucket, max_points = parse_shape_args(request.args)
+        if request.method == 'POST':
+            body = request.get_json(silent=True) or {}
+            groups = body.get('groups') or {}
+            if not isinstance(groups, dict) or not all(isinstance(v, list) for v in groups.values()):
+                raise ValueError('groups 應為 {名稱: [斗篷, ...]}')
+            groups = {str(name): [str(c).lower() for c in cloaks] for name, cloaks in groups.items()}
+        else:
+            groups = parse_group_args(request.args.getlist('group'))
+        groups = groups or DEFAULT_GROUPS
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    try:
+        data, version, updated_at = sheet_cache.snapshot()
+        if not data:
             return jsonify({'success': False, 'error': '無法獲取Google Sheets數據'})
         
-        # 解析數據
-        data = parse_google_sheets_data(csv_content)
+        if bucket:
+            aggregator = rollups.aggregator(data, version, bucket)
+        else:
+            aggregator = aggregators.get(data, version)
+        unknown = aggregator.unknown_cloaks(groups)
+        if unknown:
+            return jsonify({'success': False, 'error': f"未知的斗篷: {', '.join(unknown)}"}), 400
         
-        response = jsonify({
+        response = json_response(lambda: {
             'success': True,
-            'data': data,
-            'lastUpdate': datetime.now().isoformat()
-        })
+            'groups': groups,
+            'data': downsample_records(aggregator.aggregate(groups), list(groups), max_points),
+            'bucket': bucket or 'day',
+            'maxPoints': max_points,
+            'lastUpdate': updated_at
+        }, cache_key=('aggregate', version, group_key(groups), bucket, max_points))
         
-        # 添加CORS headers
         response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
+        return response
+        
+    except Exception as e:
+        logger.error(f"計算分組數據時發生錯誤: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/stream', methods=['GET'])
+def stream_updates():
+    """Server-Sent Events：連線時先送出目前版本，之後每次數據更新推送變化的格子"""
+    _, version, updated_at = sheet_cache.snapshot()
+    token = delta_log.token(version)
+    initial = format_event('version', {'version': token, 'lastUpdate': updated_at}, event_id=token)
+    
+    response = Response(stream_hub.stream(initial), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # 避免反向代理緩衝事件
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """統計面板的平均/最大/最小 fail rate 及總量
+
+    可選參數: cloaks=斗篷列表 (支援 jt01-jt08 範圍寫法，預設為所有斗篷)，
+    from/to=YYYY-MM-DD (指定時從歷史數據查詢，否則為目前的快照)
+    """
+    date_from = request.args.get('from')
+    date_to = request.args.get('to')
+    try:
+        for value in (date_from, date_to):
+            if value:
+                date.fromisoformat(value)
+        cloaks = expand_cloaks(request.args.get('cloaks', ''))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'參數格式錯誤: {e}'}), 400
+    
+    try:
+        if date_from or date_to:
+            revision = history_store.revision
+            def build_history_index():
+                records = history_store.query()
+                return StatsIndex(records, iso_dates=[item['date'] for item in records])
+            index = history_stats.get(revision, build_history_index)
+            cache_key = ('stats', 'history', revision)
+        else:
+            data, version, updated_at = sheet_cache.snapshot()
+            if not data:
+                return jsonify({'success': False, 'error': '無法獲取Google Sheets數據'})
+            index = build_stats_index(data, version)
+            cache_key = ('stats', 'snapshot', version)
         
+        cloaks = cloaks or index.default_cloaks()
+        response = json_response(lambda: {
+            'success': True,
+            'stats': index.query(cloaks, date_from, date_to),
+            'from': date_from,
+            'to': date_to
+        }, cache_key=cache_key + (tuple(cloaks), date_from, date_to))
+        
+        response.headers.add('Access-Control-Allow-Origin', '*')
         return response
         
     except Exception as e:
-        logger.error(f"獲取數據時發生錯誤: {e}")
+        logger.error(f"計算統計數據時發生錯誤: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts():
+    """fail rate 告警（z-score或絕對門檻），最新的在前
+
+    可選參數: since=YYYY-MM-DD, kind=cloak|group, name=斗篷或分組名稱, limit=筆數
+    """
+    since = request.args.get('since')
+    kind = request.args.get('kind')
+    name = request.args.get('name')
+    try:
+        if since:
+            date.fromisoformat(since)
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        if limit is not None and limit < 1:
+            raise ValueError('limit 應為正整數')
+    except ValueError:
+        return jsonify({'success': False, 'error': 'since 應為 YYYY-MM-DD 格式，limit 應為正整數'}), 400
+    if kind not in (None, 'cloak', 'group'):
+        return jsonify({'success': False, 'error': 'kind 應為 cloak 或 group'}), 400
+    
+    response = json_response(lambda: {
+        'success': True,
+        'alerts': alert_engine.alerts(since, kind, name, limit),
+        'config': alert_engine.config()
+    }, cache_key=('alerts', alert_engine.revision, since, kind, name, limit))
+    
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus格式的各階段耗時和計數"""
+    return metrics_response(sheet_cache)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康檢查端點"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    stale, age = sheet_cache.freshness()
+    return jsonify({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'cache': sheet_cache.stats(),
+        'stale': stale,
+        'ageSeconds': age,
+        'streamClients': stream_hub.client_count()
+    })
 
 if __name__ == '__main__':
     logger.info("正在啟動Flask服務器...")
+    # debug模式下reloader的父進程不提供服務，只在實際服務的進程啟動刷新線程
+    if SHEET_BACKGROUND_POLL and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        sheet_cache.start(SHEET_POLL_INTERVAL)
     app.run(debug=True, port=5003, host='0.0.0.0')
@@ -0,0 +1,58 @@
+"""比較每日字典格式和 CloakTable 陣列格式的記憶體用量
+
+用法: python benchmarks/bench_memory.py [天數 ...]
+"""
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregation import SERIES_PREFIXES
+from cloak_table import CloakTable
+
+CLOAKS = [f'{prefix}{n:02d}' for prefix in SERIES_PREFIXES.values() for n in range(1, 14)]
+
+
+def make_records(days, seed=1):
+    """產生與 /api/data 相同格式的隨機數據"""
+    rng = random.Random(seed)
+    records = []
+    for d in range(days):
+        date_data = {'date': f'{d // 28 % 12 + 1}/{d % 28 + 1}'}
+        for cloak in CLOAKS:
+            meta = rng.randint(0, 1000)
+            ga4 = rng.randint(0, meta)
+            date_data[cloak] = {
+                'meta': meta,
+                'ga4': ga4,
+                'failRate': round((1 - ga4 / meta) * 100, 2) if meta else 0.0
+            }
+        records.append(date_data)
+    return records
+
+
+def measure(build):
+    """返回build()產生的物件在追蹤期間保留的記憶體（位元組）"""
+    tracemalloc.start()
+    obj = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+
+def main(day_counts):
+    print(f"{'天數':>6} {'每日字典':>12} {'CloakTable':>12} {'陣列本身':>10} {'比例':>6}")
+    for days in day_counts:
+        records, dict_bytes = measure(lambda: make_records(days))
+        table, table_bytes = measure(lambda: CloakTable.from_records(iter(records)))
+        # from_records的暫存列表已釋放，只計算保留下來的表格
+        assert table.to_records() == records
+        table._records = None
+        print(f"{days:>6} {dict_bytes / 1024:>10.1f}KB {table_bytes / 1024:>10.1f}KB "
+              f"{table.nbytes() / 1024:>8.1f}KB {dict_bytes / table_bytes:>5.1f}x")
+
+
+if __name__ == '__main__':
+    main([int(v) for v in sys.argv[1:]] or [31, 365, 1095])
@@ -0,0 +1,283 @@
+"""解析器與 /api/data 管線的基準測試，使用合成表格離線執行
+
+用法:
+    python benchmarks/bench_pipeline.py --days 31 365 --cloaks 13
+    python benchmarks/bench_pipeline.py --fail-on-regression
+
+每次執行的結果附加到 benchmarks/results.jsonl，並與相同規模的上一次結果比較。
+"""
+import argparse
+import gzip
+import http.server
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# 避免基準測試寫入正式的歷史數據庫
+os.environ.setdefault('HISTORY_DB_PATH', os.path.join(tempfile.mkdtemp(), 'history.sqlite3'))
+
+import pandas as pd
+import requests
+
+import api_format
+import app
+import app_fixed
+import app_new
+import sheet_config
+from fast_parser import parse_sheet_table
+from sheet_cache import SheetCache
+from synthetic_sheet import HEADER_ROWS, generate_csv, series_config
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+# 中位數比上一次慢超過此比例視為回歸
+DEFAULT_THRESHOLD = 0.2
+
+
+def timed(func, repeat):
+    """執行func repeat次，返回每次的毫秒數"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples):
+    return {
+        'minMs': round(min(samples), 3),
+        'medianMs': round(statistics.median(samples), 3),
+        'meanMs': round(statistics.fmean(samples), 3),
+        'runs': len(samples)
+    }
+
+
+def serve_text(text):
+    """在本機啟動HTTP服務器提供CSV，返回URL"""
+    body = text.encode('utf-8')
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}/export?format=csv'
+
+
+def parser_cases(csv_text, days, cloaks_per_series):
+    """各解析器的量測項目；解析範圍放寬到所有合成的日期"""
+    last_row = HEADER_ROWS + days
+    config = series_config(cloaks_per_series)
+
+    def read_frame():
+        return pd.read_csv(io.StringIO(csv_text))
+
+    def app_new_csv_reader():
+        app_new.parse_google_sheets_data(csv_text)
+
+    def app_new_stream():
+        app_new.parse_csv_stream(io.StringIO(csv_text))
+
+    return {
+        'parse.app_new.csv_reader': app_new_csv_reader,
+        'parse.app_new.stream': app_new_stream,
+        'parse.app_fixed.vectorized': lambda: app_fixed.parse_google_sheets_data(read_frame(), last_row),
+        'parse.app_fixed.rows': lambda: app_fixed.parse_google_sheets_data_rows(read_frame(), last_row),
+        'parse.fast_parser.table': lambda: parse_sheet_table(read_frame(), config, app_fixed.FIRST_DATA_ROW, last_row),
+        'parse.app.process_excel_data': lambda: app.parse_csv_text(csv_text),
+        'decode.read_csv': read_frame,
+    }
+
+
+def serialize_cases(table):
+    """JSON序列化和壓縮，與 api_format 使用相同的參數"""
+    def dumps(payload):
+        return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    records = table.to_records()
+    columnar = table.to_columnar()
+    rows_body = dumps(records)
+    return {
+        'serialize.rows': lambda: dumps(records),
+        'serialize.columnar': lambda: dumps(columnar),
+        'serialize.build_columnar': table.to_columnar,
+        'compress.gzip.rows': lambda: gzip.compress(rows_body, compresslevel=6),
+    }
+
+
+def roundtrip_cases(url):
+    """經由Flask測試客戶端的完整 /api/data 請求
+
+    cold: 每次都重新抓取、解析和序列化；warm: 快取和已序列化的回應都已就緒。
+    """
+    def new_cache():
+        return SheetCache(
+            url, app_new.parse_google_sheets_data,
+            stream_parse_func=app_new.parse_csv_stream if app_new.SHEET_STREAMING else None
+        )
+
+    client = app_new.app.test_client()
+
+    def request(query):
+        response = client.get(f'/api/data{query}')
+        assert response.status_code == 200 and response.json['success'], response.data[:200]
+
+    def cold(query):
+        def run():
+            app_new.sheet_cache = new_cache()
+            api_format.clear_encoded_cache()
+            request(query)
+        return run
+
+    def warm(query):
+        def run():
+            request(query)
+        return run
+
+    def fetch():
+        requests.get(url, timeout=10).text
+
+    cases = {'fetch.local': fetch}
+    for name, query in (('rows', ''), ('columnar', '?format=columnar')):
+        cases[f'roundtrip.app_new.{name}.cold'] = cold(query)
+        cases[f'roundtrip.app_new.{name}.warm'] = warm(query)
+    return cases
+
+
+def run_size(days, cloaks_per_series, repeat, warmup):
+    csv_text = generate_csv(days, cloaks_per_series)
+    server, url = serve_text(csv_text)
+    saved = app_new.sheet_cache, sheet_config.LAST_DATA_ROW, app_new.SHEET_BACKGROUND_POLL
+    # sheet_config 的csv解析器讀到 LAST_DATA_ROW 為止，放寬到所有合成的日期
+    sheet_config.LAST_DATA_ROW = HEADER_ROWS + days
+    # 每次cold請求都換新的快取，不能讓它們各自啟動背景刷新線程
+    app_new.SHEET_BACKGROUND_POLL = False
+    try:
+        table = app_new.parse_google_sheets_data(csv_text)
+        cases = {}
+        cases.update(parser_cases(csv_text, days, cloaks_per_series))
+        cases.update(serialize_cases(table))
+        cases.update(roundtrip_cases(url))
+
+        results = {}
+        for name, func in cases.items():
+            timed(func, warmup)
+            results[name] = summarize(timed(func, repeat))
+        return {
+            'csvBytes': len(csv_text.encode('utf-8')),
+            'parsedDates': len(table),
+            'parsedCloaks': len(table.cloaks),
+            'results': results
+        }
+    finally:
+        app_new.sheet_cache, sheet_config.LAST_DATA_ROW, app_new.SHEET_BACKGROUND_POLL = saved
+        server.shutdown()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_run(history, days, cloaks_per_series):
+    for entry in reversed(history):
+        if entry['days'] == days and entry['cloaksPerSeries'] == cloaks_per_series:
+            return entry
+    return None
+
+
+def report(entry, previous, threshold):
+    """列印結果及與上一次的差異，返回回歸的項目"""
+    print(f"\n== {entry['days']} 天 x {entry['cloaksPerSeries']} 斗篷/系列 "
+          f"(CSV {entry['csvBytes'] / 1024:.0f}KB, 解析 {entry['parsedDates']} 天 x {entry['parsedCloaks']} 斗篷)")
+    if previous:
+        print(f"   對照: {previous['timestamp']} ({previous.get('revision') or '未知版本'})")
+    regressions = []
+    for name, result in entry['results'].items():
+        line = f"{name:<34} 中位數 {result['medianMs']:>9.2f}ms  最小 {result['minMs']:>9.2f}ms"
+        before = previous['results'].get(name) if previous else None
+        if before and before['medianMs'] > 0:
+            change = result['medianMs'] / before['medianMs'] - 1
+            line += f"  {change:+7.1%}"
+            if change > threshold:
+                line += '  <-- 回歸'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='解析器與 /api/data 管線基準測試')
+    parser.add_argument('--days', type=int, nargs='+', default=[31, 365])
+    parser.add_argument('--cloaks', type=int, nargs='+', default=[13], help='每個系列的斗篷數')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--results', default=RESULTS_PATH, help='結果記錄檔 (JSONL)')
+    parser.add_argument('--no-record', action='store_true', help='不寫入結果記錄')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    parser.add_argument('--with-logging', action='store_true', help="保留日誌輸出（包括日誌本身的成本）")
+    args = parser.parse_args(argv)
+
+    if not args.with_logging:
+        logging.disable(logging.WARNING)
+
+    history = load_history(args.results)
+    revision = git_revision()
+    regressions = []
+    for cloaks_per_series in args.cloaks:
+        for days in args.days:
+            entry = {
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'revision': revision,
+                'python': platform.python_version(),
+                'days': days,
+                'cloaksPerSeries': cloaks_per_series,
+                'repeat': args.repeat,
+            }
+            entry.update(run_size(days, cloaks_per_series, args.repeat, args.warmup))
+            previous = previous_run(history, days, cloaks_per_series)
+            regressions += report(entry, previous, args.threshold)
+            if not args.no_record:
+                with open(args.results, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    if regressions:
+        print(f"\n{len(regressions)} 個項目比上一次慢超過 {args.threshold:.0%}")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
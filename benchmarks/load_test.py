@@ -0,0 +1,317 @@
+"""端到端負載測試：本機的Google Sheets替身加上實際啟動的後端，逐步提高並發量測吞吐量和延遲
+
+用法:
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --modes dev gunicorn --concurrency 1 8 32 --duration 5
+    python benchmarks/load_test.py --source xlsx --latency 0.5 --jitter 0.3 --failure-rate 0.1
+    python benchmarks/load_test.py --fail-on-regression
+
+每個服務模式在獨立的子進程中啟動 app_new，上游指向替身 (SHEET_EXPORT_URLS)：
+    dev         Flask開發服務器，與 app.run() 的預設相同，每個請求一個線程
+    dev-single  開發服務器的單線程模式，同時只處理一個請求
+    gunicorn    多worker的WSGI服務器，worker之間以共享快照 (SHARED_SNAPSHOT_PATH) 共用數據；未安裝時略過
+
+結果 (每個模式、端點、並發的吞吐量及p50/p95/p99延遲) 以JSON輸出到stdout，並附加到
+benchmarks/load_results.jsonl，與相同設定的上一次結果比較。客戶端同樣是Python線程，
+並發很高時量到的上限可能來自客戶端本身。
+"""
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sheets_standin import SheetsStandIn
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load_results.jsonl')
+MODES = ('dev', 'dev-single', 'gunicorn')
+DEFAULT_PATHS = ['/api/data?format=columnar', '/api/health']
+# 吞吐量比上一次低、或p95比上一次高超過此比例視為回歸
+DEFAULT_THRESHOLD = 0.2
+# 後端啟動並取得第一份數據的最長等待時間（秒）
+STARTUP_TIMEOUT = 60
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def server_command(mode, port, workers, threads):
+    if mode == 'gunicorn':
+        return [
+            sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads),
+            '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app_new:app'
+        ]
+    threaded = mode == 'dev'
+    return [sys.executable, '-c', f"import app_new; app_new.app.run(host='127.0.0.1', port={port}, threaded={threaded})"]
+
+
+def mode_unavailable(mode):
+    """返回無法執行該模式的原因，可以執行時返回None"""
+    if mode == 'gunicorn' and importlib.util.find_spec('gunicorn') is None:
+        return '未安裝gunicorn'
+    return None
+
+
+def start_server(mode, args, standin, workdir):
+    """啟動後端並等待 /api/data 返回數據，返回 (進程, 基礎URL, 第一個數據請求的毫秒數)"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        SHEET_EXPORT_URLS=standin.url(args.source),
+        SHEET_SOURCE=args.source,
+        SHEET_CACHE_TTL=str(args.poll_interval),
+        SHEET_POLL_INTERVAL=str(args.poll_interval),
+        HISTORY_DB_PATH=os.path.join(workdir, f'{mode}-history.sqlite3'),
+        SNAPSHOT_PERSIST_PATH='',
+    )
+    if mode == 'gunicorn':
+        env['SHARED_SNAPSHOT_PATH'] = os.path.join(workdir, f'{mode}-snapshot.bin')
+
+    log = open(os.path.join(workdir, f'{mode}.log'), 'wb')
+    process = subprocess.Popen(
+        server_command(mode, port, args.workers, args.threads),
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{mode} 啟動失敗，詳見 {log.name}')
+        try:
+            requests.get(f'{base_url}/api/health', timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.1)
+    else:
+        stop_server(process)
+        raise RuntimeError(f'{mode} 在 {STARTUP_TIMEOUT} 秒內沒有回應')
+
+    started = time.perf_counter()
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{base_url}/api/data', timeout=STARTUP_TIMEOUT).json().get('success'):
+                return process, base_url, round((time.perf_counter() - started) * 1000, 3)
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'{mode} 在 {STARTUP_TIMEOUT} 秒內沒有取得數據')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def percentile(ordered, p):
+    """已排序樣本的百分位數（線性插值）"""
+    if len(ordered) == 1:
+        return ordered[0]
+    return statistics.quantiles(ordered, n=100, method='inclusive')[p - 1]
+
+
+def run_level(url, concurrency, duration):
+    """concurrency個客戶端各自連續發出請求duration秒，返回延遲統計"""
+    deadline = time.monotonic() + duration
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def client():
+        session = requests.Session()
+        samples = []
+        failed = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = session.get(url, timeout=30)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            samples.append((time.perf_counter() - started) * 1000)
+            failed += not ok
+        with lock:
+            latencies.extend(samples)
+            errors[0] += failed
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    result = {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughputRps': round(len(latencies) / elapsed, 2),
+    }
+    if latencies:
+        result.update({
+            'p50Ms': round(percentile(latencies, 50), 3),
+            'p95Ms': round(percentile(latencies, 95), 3),
+            'p99Ms': round(percentile(latencies, 99), 3),
+            'maxMs': round(latencies[-1], 3),
+        })
+    return result
+
+
+def run_mode(mode, args, standin, workdir):
+    """返回該模式的所有量測結果"""
+    process, base_url, first_data_ms = start_server(mode, args, standin, workdir)
+    results = []
+    try:
+        for path in args.paths:
+            for concurrency in args.concurrency:
+                standin.reset_stats()
+                result = run_level(base_url + path, concurrency, args.duration)
+                result.update({
+                    'mode': mode,
+                    'path': path,
+                    'concurrency': concurrency,
+                    'upstreamRequests': standin.stats()['requests'],
+                    'firstDataMs': first_data_ms,
+                })
+                results.append(result)
+                print(
+                    f"{mode:<11} {path:<28} c={concurrency:<4} {result['throughputRps']:>9.1f} req/s  "
+                    f"p50 {result.get('p50Ms', 0):>8.2f}ms  p95 {result.get('p95Ms', 0):>8.2f}ms  "
+                    f"p99 {result.get('p99Ms', 0):>8.2f}ms  錯誤 {result['errors']}  上游 {result['upstreamRequests']}",
+                    file=sys.stderr
+                )
+    finally:
+        stop_server(process)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_run(path, config):
+    """相同設定的上一次結果"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        history = [json.loads(line) for line in f if line.strip()]
+    for entry in reversed(history):
+        if entry['config'] == config:
+            return entry
+    return None
+
+
+def find_regressions(entry, previous, threshold):
+    """吞吐量下降或p95上升超過門檻的項目"""
+    if previous is None:
+        return []
+    before = {(r['mode'], r['path'], r['concurrency']): r for r in previous['results']}
+    regressions = []
+    for result in entry['results']:
+        old = before.get((result['mode'], result['path'], result['concurrency']))
+        if old is None:
+            continue
+        if old['throughputRps'] > 0 and result['throughputRps'] < old['throughputRps'] * (1 - threshold):
+            regressions.append({'mode': result['mode'], 'path': result['path'], 'concurrency': result['concurrency'],
+                                'metric': 'throughputRps', 'before': old['throughputRps'], 'after': result['throughputRps']})
+        if old.get('p95Ms') and result.get('p95Ms', 0) > old['p95Ms'] * (1 + threshold):
+            regressions.append({'mode': result['mode'], 'path': result['path'], 'concurrency': result['concurrency'],
+                                'metric': 'p95Ms', 'before': old['p95Ms'], 'after': result['p95Ms']})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='後端端到端負載測試')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['dev', 'gunicorn'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--duration', type=float, default=5.0, help='每個並發等級的秒數')
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+    parser.add_argument('--source', choices=('csv', 'xlsx'), default='csv', help='替身提供的導出格式')
+    parser.add_argument('--days', type=int, default=31)
+    parser.add_argument('--latency', type=float, default=0.2, help='替身每個請求的延遲（秒）')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--poll-interval', type=int, default=5, help='後端刷新上游的間隔（秒）')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker數')
+    parser.add_argument('--threads', type=int, default=4, help='每個gunicorn worker的線程數')
+    parser.add_argument('--results', default=RESULTS_PATH, help='結果記錄檔 (JSONL)')
+    parser.add_argument('--no-record', action='store_true', help='不寫入結果記錄')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+
+    config = {
+        'source': args.source,
+        'days': args.days,
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'failureRate': args.failure_rate,
+        'pollInterval': args.poll_interval,
+        'duration': args.duration,
+        'workers': args.workers,
+        'threads': args.threads,
+    }
+    standin = SheetsStandIn(args.days, latency=args.latency, jitter=args.jitter,
+                            failure_rate=args.failure_rate).start()
+    results = []
+    skipped = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for mode in args.modes:
+                reason = mode_unavailable(mode)
+                if reason:
+                    skipped[mode] = reason
+                    print(f"略過 {mode}: {reason}", file=sys.stderr)
+                    continue
+                results.extend(run_mode(mode, args, standin, workdir))
+    finally:
+        standin.stop()
+
+    entry = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'config': config,
+        'skipped': skipped,
+        'results': results,
+    }
+    previous = previous_run(args.results, config)
+    entry['regressions'] = find_regressions(entry, previous, args.threshold)
+    print(json.dumps(entry, ensure_ascii=False, indent=2))
+    if not args.no_record:
+        with open(args.results, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    if entry['regressions'] and args.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
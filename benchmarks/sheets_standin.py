@@ -0,0 +1,137 @@
+"""本機的Google Sheets替身：提供合成表格的CSV/XLSX導出，可設定延遲、抖動和失敗率
+
+用法:
+    python benchmarks/sheets_standin.py --port 8090 --latency 0.3 --jitter 0.2 --failure-rate 0.05
+
+    SHEET_EXPORT_URLS=http://127.0.0.1:8090/export?format=csv python app_new.py
+
+/export?format=csv 返回CSV，/export?format=xlsx 返回整個活頁簿；失敗時返回503。
+"""
+import argparse
+import http.server
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_sheet import generate_csv, generate_xlsx
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+class SheetsStandIn:
+    """在背景線程提供導出URL的HTTP服務器，記錄收到的請求數（即後端對上游的負載）"""
+
+    def __init__(self, days=31, cloaks_per_series=13, latency=0.0, jitter=0.0, failure_rate=0.0,
+                 host='127.0.0.1', port=0, seed=0, retry_after=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after  # 失敗的回應帶有 Retry-After（秒）
+        self.bodies = {
+            'csv': generate_csv(days, cloaks_per_series, seed).encode('utf-8'),
+            'xlsx': generate_xlsx(days, cloaks_per_series, seed),
+        }
+        self.counts = {'requests': 0, 'failures': 0}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = http.server.ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def _handler(self):
+        standin = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                fmt = parse_qs(urlsplit(self.path).query).get('format', ['csv'])[0]
+                delay, fail = standin._next_outcome()
+                time.sleep(delay)
+                body = standin.bodies.get(fmt)
+                if fail or body is None:
+                    self.send_response(503 if fail else 404)
+                    if fail and standin.retry_after is not None:
+                        self.send_header('Retry-After', str(standin.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPES[fmt])
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _next_outcome(self):
+        with self._lock:
+            self.counts['requests'] += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.counts['failures'] += 1
+        return delay, fail
+
+    def url(self, fmt='csv'):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/export?format={fmt}'
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def reset_stats(self):
+        with self._lock:
+            self.counts = {'requests': 0, 'failures': 0}
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='sheets-standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Google Sheets導出的本機替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--days', type=int, default=31)
+    parser.add_argument('--cloaks', type=int, default=13, help='每個系列的斗篷數')
+    parser.add_argument('--latency', type=float, default=0.0, help='每個請求的延遲（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='延遲的隨機變化範圍（秒）')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='返回503的比例')
+    parser.add_argument('--retry-after', type=int, default=None, help='503回應帶有的 Retry-After 秒數')
+    args = parser.parse_args(argv)
+
+    standin = SheetsStandIn(args.days, args.cloaks, args.latency, args.jitter, args.failure_rate,
+                            host=args.host, port=args.port, retry_after=args.retry_after)
+    print(f"CSV:  {standin.url('csv')}")
+    print(f"XLSX: {standin.url('xlsx')}")
+    try:
+        standin.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""產生與Google Sheets失敗率表格結構相同的合成CSV/XLSX，用於離線基準測試
+
+欄位位置與 app_new.py 一致：A欄日期、B欄JB產品數據，JB斗篷從C欄 (索引2) 開始，
+JW斗篷緊接其後，JG前面有一欄JG產品數據。每個斗篷佔3欄，JB的順序為
+GA4 / fail rate / meta，JW和JG為 meta / GA4 / fail rate。
+"""
+import csv
+import io
+import random
+from datetime import date, timedelta
+
+from aggregation import SERIES_PREFIXES
+
+HEADER_ROWS = 2  # 數據之前的標題行數，數據從第3行開始
+START_DATE = date(2024, 8, 1)
+BLANK_RATE = 0.1  # 尚未上線的斗篷留空的比例
+
+
+def series_layout(cloaks_per_series=13):
+    """返回 {系列: 第一個斗篷的欄位索引}；13個斗篷時為 C / AP / CD 欄 (2 / 41 / 81)"""
+    width = cloaks_per_series * 3
+    jb = 2
+    jw = jb + width
+    jg = jw + width + 1  # JG產品數據佔一欄
+    return {'jb': jb, 'jw': jw, 'jg': jg}
+
+
+def series_config(cloaks_per_series=13):
+    """fast_parser 使用的系列設定，欄位與 series_layout 相同"""
+    return {
+        series: {
+            'cloaks': [f'{SERIES_PREFIXES[series]}{n:02d}' for n in range(1, cloaks_per_series + 1)],
+            'start_col': start
+        }
+        for series, start in series_layout(cloaks_per_series).items()
+    }
+
+
+def _metrics(rng):
+    meta = rng.randint(0, 1000)
+    ga4 = rng.randint(0, meta)
+    fail_rate = (1 - ga4 / meta) * 100 if meta else 0.0
+    return str(meta), str(ga4), f'{fail_rate:.2f}%'
+
+
+def generate_rows(days=31, cloaks_per_series=13, seed=0):
+    """逐行產生表格內容（包括標題行）"""
+    rng = random.Random(seed)
+    layout = series_layout(cloaks_per_series)
+    column_count = layout['jg'] + cloaks_per_series * 3
+
+    header = [''] * column_count
+    header[0] = '日期'
+    header[1] = 'JB'
+    header[layout['jg'] - 1] = 'JG'
+    labels = [''] * column_count
+    for series, start in layout.items():
+        prefix = SERIES_PREFIXES[series]
+        for n in range(cloaks_per_series):
+            names = ['GA4', 'Fail Rate', 'Meta'] if series == 'jb' else ['Meta', 'GA4', 'Fail Rate']
+            for k, name in enumerate(names):
+                labels[start + n * 3 + k] = f'{prefix}{n + 1:02d} {name}'
+    yield header
+    yield labels
+
+    for d in range(days):
+        day = START_DATE + timedelta(days=d)
+        row = [''] * column_count
+        row[0] = f'{day.month}/{day.day}'
+        row[1] = str(rng.randint(0, 100))
+        row[layout['jg'] - 1] = str(rng.randint(0, 100))
+        for series, start in layout.items():
+            for n in range(cloaks_per_series):
+                if rng.random() < BLANK_RATE:
+                    continue
+                meta, ga4, fail_rate = _metrics(rng)
+                cells = (ga4, fail_rate, meta) if series == 'jb' else (meta, ga4, fail_rate)
+                row[start + n * 3:start + n * 3 + 3] = cells
+        yield row
+
+
+def generate_csv(days=31, cloaks_per_series=13, seed=0):
+    """返回CSV文字"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(generate_rows(days, cloaks_per_series, seed))
+    return buffer.getvalue()
+
+
+def _typed_cell(worksheet, value, column):
+    """與Google Sheets導出的XLSX相同：數字為數值，fail rate為百分比格式的比例"""
+    from openpyxl.cell import WriteOnlyCell
+
+    if column == 0 or value == '':
+        return value or None
+    if value.endswith('%'):
+        cell = WriteOnlyCell(worksheet, value=float(value[:-1]) / 100)
+        cell.number_format = '0.00%'
+        return cell
+    return int(value)
+
+
+def generate_xlsx(days=31, cloaks_per_series=13, seed=0):
+    """返回XLSX活頁簿的位元組內容，數據與 generate_csv 相同，日期為日期儲存格"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    for r, row in enumerate(generate_rows(days, cloaks_per_series, seed)):
+        if r < HEADER_ROWS:
+            worksheet.append(row)
+            continue
+        cells = [_typed_cell(worksheet, value, c) for c, value in enumerate(row)]
+        cells[0] = START_DATE + timedelta(days=r - HEADER_ROWS)
+        worksheet.append(cells)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,140 @@
+"""把Google Sheets數據預先產生為GitHub Pages (docs/) 使用的靜態JSON快照
+
+用法:
+    python build_static.py
+    python build_static.py --out docs/data --keep 3
+
+沿用 app_new 的抓取和解析設定 (sheet_config)，但不啟動其歷史數據庫、告警和推送，輸出:
+    snapshot-<內容雜湊>.json（及 .gz/.br）: 每日數據、新舊A面分組加總、各系列的統計
+    latest.json: 指向最新快照的小檔案，頁面每次載入時先讀取
+
+快照檔名只取決於數據（不含抓取時間），可以長期快取；數據沒有變化時不寫入任何檔案。
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+from aggregation import DEFAULT_GROUPS, CloakAggregator
+from api_format import encode_payload, format_data
+from sheet_config import SERIES_LAYOUT, create_sheet_source
+from stats_index import StatsIndex
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUT = os.path.join(ROOT, 'docs', 'data')
+MANIFEST_NAME = 'latest.json'
+# 除了最新的快照外再保留幾份，讓仍持有舊 latest.json 的頁面可以載入
+DEFAULT_KEEP = 3
+
+_SUFFIXES = {'identity': '', 'gzip': '.gz', 'br': '.br'}
+
+
+def build_payload(data):
+    """靜態快照的內容：與 /api/data、/api/aggregate、/api/stats 的預設結果相同
+
+    不包含抓取時間（記錄在 latest.json 的 lastUpdate），數據相同時快照內容和檔名也相同。
+    """
+    index = StatsIndex(data)
+    stats = {}
+    for series, layout in SERIES_LAYOUT.items():
+        stats[series] = dict(index.query(layout['cloaks']), cloaks=layout['cloaks'])
+    return {
+        'success': True,
+        'data': format_data(data, 'rows'),
+        'groups': DEFAULT_GROUPS,
+        'aggregates': CloakAggregator(data).aggregate(DEFAULT_GROUPS),
+        'stats': stats
+    }
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_file(path, body):
+    """寫入臨時檔案後替換，部署中途不會出現不完整的檔案"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(body)
+    os.replace(temp_path, path)
+
+
+def prune_snapshots(out_dir, current, keep):
+    """刪除較舊的快照，保留目前的及最新的keep份"""
+    snapshots = sorted(
+        glob.glob(os.path.join(out_dir, 'snapshot-*.json')),
+        key=os.path.getmtime, reverse=True
+    )
+    old = [path for path in snapshots if os.path.basename(path) != current][keep:]
+    for path in old:
+        for suffix in _SUFFIXES.values():
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+    return len(old)
+
+
+def build(out_dir, keep=DEFAULT_KEEP, source=None):
+    """抓取並輸出快照，返回 latest.json 的內容；抓取失敗時返回None
+
+    source 預設依 sheet_config 建立一次性的 SheetCache（不保存快照、沒有監聽器）。
+    """
+    if source is None:
+        source = create_sheet_source(persist_path=None)
+    data, _, updated_at = source.snapshot()
+    if not data:
+        logger.error("無法獲取Google Sheets數據，未產生快照")
+        return None
+
+    entry = encode_payload(build_payload(data))
+    name = f"snapshot-{entry['tag']}.json"
+    previous = read_manifest(out_dir)
+    if previous and previous.get('version') == entry['tag'] and os.path.exists(os.path.join(out_dir, name)):
+        logger.info(f"數據沒有變化，沿用快照 {name}")
+        return previous
+
+    os.makedirs(out_dir, exist_ok=True)
+    encodings = [encoding for encoding in _SUFFIXES if encoding in entry]
+    for encoding in encodings:
+        write_file(os.path.join(out_dir, name + _SUFFIXES[encoding]), entry[encoding])
+
+    manifest = {
+        'version': entry['tag'],
+        'file': name,
+        'size': entry['size'],
+        'encodings': encodings,
+        'lastUpdate': updated_at,
+        'generatedAt': datetime.now().isoformat()
+    }
+    write_file(
+        os.path.join(out_dir, MANIFEST_NAME),
+        json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+    )
+    removed = prune_snapshots(out_dir, name, keep)
+    logger.info(f"已產生快照 {name} ({entry['size']} bytes, {', '.join(encodings)})，刪除 {removed} 份舊快照")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='產生GitHub Pages使用的靜態數據快照')
+    parser.add_argument('--out', default=DEFAULT_OUT, help='輸出目錄')
+    parser.add_argument('--keep', type=int, default=DEFAULT_KEEP, help='保留幾份較舊的快照')
+    args = parser.parse_args(argv)
+
+    manifest = build(args.out, args.keep)
+    if manifest is None:
+        return 1
+    print(json.dumps(manifest, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import threading
+
+import numpy as np
+
+from history_store import normalize_date
+
+# 每個格子的欄位，篩選時可只返回其中幾個
+FIELDS = ('meta', 'ga4', 'failRate')
+
+
+class CloakTable:
+    """以 (dates x cloaks) 陣列保存的斗篷數據
+
+    meta/ga4為int32，fail_rate為float32；API使用的每日字典格式只在需要時才建立。
+    """
+
+    def __init__(self, dates, cloaks, meta, ga4, fail_rate):
+        self.dates = list(dates)
+        self.cloaks = list(cloaks)
+        self.date_index = {d: i for i, d in enumerate(self.dates)}
+        self.cloak_index = {c: j for j, c in enumerate(self.cloaks)}
+        shape = (len(self.dates), len(self.cloaks))
+        self.meta = np.asarray(meta, dtype=np.int32).reshape(shape)
+        self.ga4 = np.asarray(ga4, dtype=np.int32).reshape(shape)
+        self.fail_rate = np.asarray(fail_rate, dtype=np.float32).reshape(shape)
+        self._records = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, records):
+        """從每日字典格式建立；records可以是生成器，逐行讀取"""
+        dates = []
+        cloaks = []
+        cloak_index = {}
+        meta_rows, ga4_rows, fail_rate_rows = [], [], []
+        for item in records:
+            dates.append(item['date'])
+            meta_row = [0] * len(cloaks)
+            ga4_row = [0] * len(cloaks)
+            fail_rate_row = [0.0] * len(cloaks)
+            for cloak, values in item.items():
+                if cloak == 'date':
+                    continue
+                j = cloak_index.get(cloak)
+                if j is None:
+                    j = cloak_index[cloak] = len(cloaks)
+                    cloaks.append(cloak)
+                    meta_row.append(0)
+                    ga4_row.append(0)
+                    fail_rate_row.append(0.0)
+                meta_row[j] = values['meta']
+                ga4_row[j] = values['ga4']
+                fail_rate_row[j] = values['failRate']
+            meta_rows.append(meta_row)
+            ga4_rows.append(ga4_row)
+            fail_rate_rows.append(fail_rate_row)
+
+        shape = (len(dates), len(cloaks))
+        return cls(dates, cloaks, _pad(meta_rows, shape), _pad(ga4_rows, shape), _pad(fail_rate_rows, shape))
+
+    @classmethod
+    def from_blocks(cls, dates, cloaks, values):
+        """從向量化解析器的 values (days, cloaks, 3) 陣列建立"""
+        return cls(dates, cloaks, values[:, :, 0], values[:, :, 1], values[:, :, 2])
+
+    @classmethod
+    def merge(cls, tables):
+        """合併多個分頁的數據並按日期排序，同一日期的斗篷以後面的分頁為準，缺少的斗篷補0"""
+        cloaks = []
+        cloak_index = {}
+        for table in tables:
+            for cloak in table.cloaks:
+                if cloak not in cloak_index:
+                    cloak_index[cloak] = len(cloaks)
+                    cloaks.append(cloak)
+
+        # 無法辨識的日期沿用前一行的排序位置
+        first_seen = {}
+        for t, table in enumerate(tables):
+            sort_key = ''
+            for i, label in enumerate(table.dates):
+                sort_key = normalize_date(label) or sort_key
+                first_seen.setdefault(label, (sort_key, t, i))
+        dates = sorted(first_seen, key=first_seen.get)
+        date_index = {d: i for i, d in enumerate(dates)}
+
+        shape = (len(dates), len(cloaks))
+        meta = np.zeros(shape, dtype=np.int32)
+        ga4 = np.zeros(shape, dtype=np.int32)
+        fail_rate = np.zeros(shape, dtype=np.float32)
+        for table in tables:
+            rows = np.array([date_index[d] for d in table.dates], dtype=np.intp)[:, None]
+            columns = np.array([cloak_index[c] for c in table.cloaks], dtype=np.intp)
+            meta[rows, columns] = table.meta
+            ga4[rows, columns] = table.ga4
+            fail_rate[rows, columns] = table.fail_rate
+        return cls(dates, cloaks, meta, ga4, fail_rate)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __eq__(self, other):
+        if not isinstance(other, CloakTable):
+            return NotImplemented
+        return (
+            self.dates == other.dates and self.cloaks == other.cloaks
+            and np.array_equal(self.meta, other.meta)
+            and np.array_equal(self.ga4, other.ga4)
+            and np.array_equal(self.fail_rate, other.fail_rate)
+        )
+
+    __hash__ = None
+
+    def fail_rate_values(self):
+        """fail rate還原為兩位小數的float64"""
+        return np.round(self.fail_rate.astype(np.float64), 2)
+
+    def to_records(self, fields=None):
+        """每日字典格式 [{'date', 斗篷: {'meta','ga4','failRate'}}]，第一次呼叫時建立並快取
+
+        fields指定只包括哪些欄位（不快取）。
+        """
+        if fields is not None:
+            return self._build_records(fields)
+        with self._lock:
+            if self._records is None:
+                self._records = self._build_records()
+            return self._records
+
+    def _build_records(self, fields=None):
+        meta = self.meta.tolist()
+        ga4 = self.ga4.tolist()
+        fail_rate = self.fail_rate_values().tolist()
+        result_data = []
+        for d, date_str in enumerate(self.dates):
+            date_data = {'date': date_str}
+            meta_row, ga4_row, fail_rate_row = meta[d], ga4[d], fail_rate[d]
+            for c, cloak in enumerate(self.cloaks):
+                cell = {'meta': meta_row[c], 'ga4': ga4_row[c], 'failRate': fail_rate_row[c]}
+                date_data[cloak] = cell if fields is None else {field: cell[field] for field in fields}
+            result_data.append(date_data)
+        return result_data
+
+    def iter_cells(self):
+        """逐格產生 (日期, 斗篷, meta, ga4, failRate)，不建立每日字典"""
+        meta = self.meta.tolist()
+        ga4 = self.ga4.tolist()
+        fail_rate = self.fail_rate_values().tolist()
+        for d, date_str in enumerate(self.dates):
+            for c, cloak in enumerate(self.cloaks):
+                yield date_str, cloak, meta[d][c], ga4[d][c], fail_rate[d][c]
+
+    def to_columnar(self, fields=None):
+        """欄式格式，直接由陣列產生；fields指定只包括哪些欄位"""
+        fields = fields or FIELDS
+        columns = {'meta': self.meta, 'ga4': self.ga4}
+        if 'failRate' in fields:
+            columns['failRate'] = self.fail_rate_values()
+        return {
+            'format': 'columnar',
+            'dates': list(self.dates),
+            'cloaks': {
+                cloak: {field: columns[field][:, j].tolist() for field in fields}
+                for j, cloak in enumerate(self.cloaks)
+            }
+        }
+
+    def take_rows(self, rows):
+        """只保留指定的行（例如降採樣選出的日期）"""
+        rows = np.asarray(rows, dtype=np.intp)
+        return CloakTable(
+            [self.dates[i] for i in rows], self.cloaks, self.meta[rows], self.ga4[rows], self.fail_rate[rows]
+        )
+
+    def take(self, rows, columns):
+        """只保留指定的行和斗篷欄位；rows可以是slice"""
+        dates = self.dates[rows] if isinstance(rows, slice) else [self.dates[i] for i in rows]
+        columns = np.asarray(columns, dtype=np.intp)
+        return CloakTable(
+            dates, [self.cloaks[j] for j in columns],
+            self.meta[rows][:, columns], self.ga4[rows][:, columns], self.fail_rate[rows][:, columns]
+        )
+
+    def nbytes(self):
+        """陣列佔用的位元組數"""
+        return self.meta.nbytes + self.ga4.nbytes + self.fail_rate.nbytes
+
+
+def _pad(rows, shape):
+    """後面才出現的斗篷在較早的行中補0"""
+    array = np.zeros(shape, dtype=np.float64)
+    for i, row in enumerate(rows):
+        array[i, :len(row)] = row
+    return array
+
+
+def as_table(data):
+    """把每日字典列表或 CloakTable 統一成 CloakTable"""
+    if isinstance(data, CloakTable):
+        return data
+    return CloakTable.from_records(data)
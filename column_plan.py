@@ -0,0 +1,186 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+
+import numpy as np
+
+from metrics import REGISTRY, Counter
+
+logger = logging.getLogger(__name__)
+
+# 每個斗篷的三個指標，ColumnPlan.indices 的欄位順序
+METRICS = ('meta', 'ga4', 'failRate')
+METRICS_PER_CLOAK = len(METRICS)
+
+# 最多保留幾份不同標題的欄位計劃
+PLAN_CACHE_SIZE = 8
+
+_CLOAK_PATTERN = re.compile(r'(?<![a-z])(jtw|jtg|jt)\s*(\d{1,3})(?!\d)', re.IGNORECASE)
+_SERIES_PATTERN = re.compile(r'^(jb|jw|jg)$', re.IGNORECASE)
+# fail rate需先於其他指標比對（例如 "GA4 fail rate"）
+_METRIC_PATTERNS = (
+    ('failRate', re.compile(r'fail|失敗|%', re.IGNORECASE)),
+    ('ga4', re.compile(r'ga\s*4|session', re.IGNORECASE)),
+    ('meta', re.compile(r'meta|click', re.IGNORECASE)),
+)
+# pandas 為空白標題產生的欄名
+_UNNAMED_PATTERN = re.compile(r'^Unnamed: \d+')
+
+PLAN_COMPILES = REGISTRY.register(Counter(
+    'jita_column_plan_compiles', '編譯欄位計劃的次數（標題變更時才會發生）', labels=('source',)
+))
+
+
+class ColumnPlan:
+    """斗篷名稱及每個斗篷 meta/GA4/fail rate 所在的欄位索引
+
+    indices 為 (cloaks, 3) 陣列，找不到的指標為 -1（視為空白）。
+    """
+
+    def __init__(self, cloaks, indices, source, fingerprint=None):
+        self.cloaks = list(cloaks)
+        self.indices = np.asarray(indices, dtype=np.intp).reshape(len(self.cloaks), METRICS_PER_CLOAK)
+        self.source = source  # 'header' 從標題找到；'fallback' 使用寫死的欄位位置
+        self.fingerprint = fingerprint
+
+        # csv.reader 的行是列表，用 itemgetter 一次取出所有儲存格；缺少的指標指向補空白的欄位
+        present = self.indices[self.indices >= 0]
+        self.width = int(present.max()) + 1 if present.size else 0
+        flat = np.where(self.indices >= 0, self.indices, self.width).ravel().tolist()
+        self._pad_to = max(flat) + 1 if flat else 0
+        self._getter = itemgetter(*flat) if len(flat) > 1 else (lambda row: tuple(row[i] for i in flat))
+
+    def take(self, row):
+        """從一行中取出所有斗篷的儲存格，返回長度為 cloaks x 3 的tuple"""
+        if len(row) < self._pad_to:
+            row = list(row) + [''] * (self._pad_to - len(row))
+        return self._getter(row)
+
+    def available(self, column_count):
+        """欄位數不足以容納整個斗篷時，該斗篷視為沒有數據"""
+        return ((self.indices < column_count) | (self.indices < 0)).all(axis=1)
+
+    def signature(self):
+        return (tuple(self.cloaks), self.indices.tobytes())
+
+    def describe(self):
+        return {'source': self.source, 'cloaks': len(self.cloaks), 'fingerprint': self.fingerprint}
+
+
+def plan_from_series(series_config):
+    """從寫死的系列設定建立欄位計劃
+
+    series_config: {系列: {'cloaks': [...], 'start_col': 欄位索引, 'order': 指標順序（預設meta/GA4/fail rate）}}
+    """
+    cloaks = []
+    indices = []
+    for config in series_config.values():
+        order = config.get('order', METRICS)
+        offsets = [order.index(metric) for metric in METRICS]
+        for i, cloak in enumerate(config['cloaks']):
+            base = config['start_col'] + i * METRICS_PER_CLOAK
+            cloaks.append(cloak)
+            indices.append([base + offset for offset in offsets])
+    return ColumnPlan(cloaks, indices, 'fallback')
+
+
+def _clean(cell):
+    if cell is None:
+        return ''
+    text = str(cell).strip()
+    if text.lower() == 'nan' or _UNNAMED_PATTERN.match(text):
+        return ''
+    return text
+
+
+def _metric_of(cells):
+    for cell in cells:
+        text = _CLOAK_PATTERN.sub(' ', cell)
+        for metric, pattern in _METRIC_PATTERNS:
+            if pattern.search(text):
+                return metric
+    return None
+
+
+def discover_plan(header_rows, fallback=None):
+    """從標題行找出斗篷區塊及其指標順序，找不到任何斗篷時返回None
+
+    斗篷名稱 (jtNN/jtwNN/jtgNN) 所在的欄位開始一個區塊，合併儲存格只在第一欄有名稱，
+    因此名稱沿用到其後最多3欄；指標名稱 (Meta/GA4/Fail Rate) 可以和斗篷名稱在同一格或
+    在其他標題行。沒有指標名稱時沿用fallback中同一斗篷的順序。
+    """
+    rows = [[_clean(cell) for cell in row] for row in header_rows]
+    width = max((len(row) for row in rows), default=0)
+    fallback_order = {}
+    if fallback is not None:
+        for cloak, columns in zip(fallback.cloaks, fallback.indices):
+            fallback_order[cloak] = [METRICS[k] for k in np.argsort(columns)]
+
+    slots = OrderedDict()  # 斗篷 -> {指標: 欄位}
+    current = None
+    start = 0
+    for c in range(width):
+        cells = [row[c] for row in rows if c < len(row) and row[c]]
+        match = next((m for m in map(_CLOAK_PATTERN.search, cells) if m), None)
+        if match:
+            current = f'{match.group(1).lower()}{int(match.group(2)):02d}'
+            start = c
+            slots.setdefault(current, {})
+        elif any(_SERIES_PATTERN.match(cell) for cell in cells) or c - start >= METRICS_PER_CLOAK:
+            # 系列標題 (JB/JW/JG) 或超出區塊範圍
+            current = None
+        if current is None:
+            continue
+
+        metric = _metric_of(cells)
+        if metric is None:
+            order = fallback_order.get(current, METRICS)
+            metric = order[c - start]
+        slots[current].setdefault(metric, c)
+
+    cloaks = [cloak for cloak, found in slots.items() if found]
+    if not cloaks:
+        return None
+    indices = [[slots[cloak].get(metric, -1) for metric in METRICS] for cloak in cloaks]
+    return ColumnPlan(cloaks, indices, 'header')
+
+
+def header_fingerprint(header_rows):
+    digest = hashlib.sha1()
+    for row in header_rows:
+        digest.update('\x1f'.join(_clean(cell) for cell in row).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()[:16]
+
+
+_plans = OrderedDict()
+_plans_lock = threading.Lock()
+
+
+def get_plan(header_rows, fallback):
+    """返回標題對應的欄位計劃；相同標題重用已編譯的計劃，只有標題變更時才重新分析"""
+    fingerprint = header_fingerprint(header_rows)
+    key = (fingerprint, fallback.signature())
+    with _plans_lock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            return plan
+
+    plan = discover_plan(header_rows, fallback)
+    if plan is None:
+        logger.warning("標題中找不到斗篷名稱，使用預設的欄位位置")
+        plan = ColumnPlan(fallback.cloaks, fallback.indices, 'fallback')
+    else:
+        logger.info(f"從標題找到 {len(plan.cloaks)} 個斗篷的欄位位置")
+    plan.fingerprint = fingerprint
+    PLAN_COMPILES.inc(source=plan.source)
+
+    with _plans_lock:
+        _plans[key] = plan
+        while len(_plans) > PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+    return plan
@@ -0,0 +1,39 @@
+import codecs
+
+# 每次從網絡讀取的區塊大小
+CHUNK_SIZE = 64 * 1024
+
+
+def response_charset(response):
+    """只採用Content-Type明確指定的編碼，否則視為UTF-8（Google導出的CSV皆為UTF-8）"""
+    content_type = response.headers.get('Content-Type', '')
+    for part in content_type.split(';'):
+        name, _, value = part.strip().partition('=')
+        if name.lower() == 'charset' and value:
+            return value.strip('"\'')
+    return 'utf-8'
+
+
+def iter_lines(chunks, encoding='utf-8', hasher=None):
+    """把位元組區塊解碼並切成文字行（保留行尾，csv.reader才能處理引號內的換行）
+
+    同一時間只保留一個區塊和未完成的一行；hasher會隨讀取更新內容雜湊。
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    pending = ''
+    for chunk in chunks:
+        if hasher is not None:
+            hasher.update(chunk)
+        pending += decoder.decode(chunk)
+        lines = pending.splitlines(keepends=True)
+        # 最後一段可能尚未讀完（包括\r\n被切在兩個區塊之間），留到下一個區塊
+        pending = lines.pop() if lines and not lines[-1].endswith('\n') else ''
+        yield from lines
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def iter_response_lines(response, hasher=None, chunk_size=CHUNK_SIZE):
+    """從 requests 的串流回應 (stream=True) 逐行讀取CSV文字"""
+    return iter_lines(response.iter_content(chunk_size), response_charset(response), hasher)
@@ -0,0 +1,166 @@
+import fnmatch
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import date
+
+from aggregation import SERIES_PREFIXES, expand_cloaks
+from api_format import encode_payload
+from cloak_table import FIELDS, as_table
+from history_store import cloak_series, normalize_date
+
+# 每份快照最多保留幾種篩選後的回應
+QUERY_CACHE_SIZE = 64
+
+
+def _split(value):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def parse_filter_args(args):
+    """解析 /api/data 的篩選參數，返回標準化的查詢；沒有任何篩選時返回None
+
+    series=jb,jw、cloaks=jt01-jt08,jtw09（範圍寫法）、pattern=jtw0*（萬用字元）選擇斗篷，
+    三者取聯集；start/end=YYYY-MM-DD 限制日期；fields=failRate,meta 只返回部分欄位。
+    列表排序去重，寫法不同但內容相同的查詢得到相同的鍵。
+    """
+    series = sorted(set(s.lower() for s in _split(args.get('series'))))
+    unknown = [s for s in series if s not in SERIES_PREFIXES]
+    if unknown:
+        raise ValueError(f"series 應為 {'、'.join(SERIES_PREFIXES)}，收到: {', '.join(unknown)}")
+    cloaks = sorted(set(expand_cloaks(args.get('cloaks', ''))))
+    patterns = sorted(set(p.lower() for p in _split(args.get('pattern'))))
+
+    start = args.get('start') or None
+    end = args.get('end') or None
+    for value in (start, end):
+        if value:
+            try:
+                date.fromisoformat(value)
+            except ValueError:
+                raise ValueError('start/end 應為 YYYY-MM-DD 格式')
+
+    fields = _split(args.get('fields'))
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown:
+        raise ValueError(f"fields 應為 {'、'.join(FIELDS)}，收到: {', '.join(unknown)}")
+    fields = [f for f in FIELDS if f in fields]
+
+    if not (series or cloaks or patterns or start or end or fields):
+        return None
+    return {
+        'series': series,
+        'cloaks': cloaks,
+        'pattern': patterns,
+        'start': start,
+        'end': end,
+        # 全部欄位與不指定相同
+        'fields': fields if 0 < len(fields) < len(FIELDS) else None
+    }
+
+
+def query_key(query):
+    """標準化查詢的鍵，用於快取"""
+    return tuple(tuple(value) if isinstance(value, list) else value for value in query.values())
+
+
+class DataIndex:
+    """一份快照的篩選索引：系列到斗篷欄位、排序後的ISO日期到行
+
+    建立一次後，篩選只需與結果大小成正比的時間（日期以二分搜尋找出行區間，斗篷直接查表）。
+    """
+
+    def __init__(self, data):
+        self.table = as_table(data)
+        self.series_columns = {}
+        for j, cloak in enumerate(self.table.cloaks):
+            self.series_columns.setdefault(cloak_series(cloak), []).append(j)
+
+        # 無法辨識的日期沿用前一行的日期
+        self.iso_dates = []
+        current = ''
+        for label in self.table.dates:
+            current = normalize_date(label) or current
+            self.iso_dates.append(current)
+        self.dates_sorted = all(a <= b for a, b in zip(self.iso_dates, self.iso_dates[1:]))
+
+    def columns(self, query):
+        """返回 (斗篷欄位索引, 不存在的斗篷)；沒有指定斗篷時為全部"""
+        table = self.table
+        if not (query['series'] or query['cloaks'] or query['pattern']):
+            return list(range(len(table.cloaks))), []
+        selected = set()
+        for series in query['series']:
+            selected.update(self.series_columns.get(series, ()))
+        unknown = []
+        for cloak in query['cloaks']:
+            j = table.cloak_index.get(cloak)
+            if j is None:
+                unknown.append(cloak)
+            else:
+                selected.add(j)
+        for pattern in query['pattern']:
+            selected.update(j for j, cloak in enumerate(table.cloaks) if fnmatch.fnmatchcase(cloak, pattern))
+        return sorted(selected), unknown
+
+    def rows(self, start=None, end=None):
+        """日期區間內的行，日期已排序時返回slice"""
+        if start is None and end is None:
+            return slice(0, len(self.iso_dates))
+        if not self.dates_sorted:
+            return [i for i, d in enumerate(self.iso_dates) if (not start or d >= start) and (not end or d <= end)]
+        l = bisect_left(self.iso_dates, start) if start else 0
+        r = bisect_right(self.iso_dates, end) if end else len(self.iso_dates)
+        return slice(l, max(l, r))
+
+    def select(self, query):
+        """返回 (篩選後的 CloakTable, 不存在的斗篷)"""
+        columns, unknown = self.columns(query)
+        rows = self.rows(query['start'], query['end'])
+        if rows == slice(0, len(self.table)) and len(columns) == len(self.table.cloaks):
+            return self.table, unknown
+        return self.table.take(rows, columns), unknown
+
+
+class DataQueryCache:
+    """最新快照的 DataIndex 及篩選後回應的LRU（以標準化的查詢鍵為鍵），快照版本變更時清空"""
+
+    def __init__(self, size=QUERY_CACHE_SIZE):
+        self.size = size
+        self._version = None
+        self._index = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _reset(self, version):
+        if version != self._version:
+            self._version = version
+            self._index = None
+            self._entries.clear()
+
+    def index(self, data, version):
+        """該版本的篩選索引，可作為快照的監聽器預先建立"""
+        with self._lock:
+            self._reset(version)
+            if self._index is not None:
+                return self._index
+        index = DataIndex(data)
+        with self._lock:
+            if version == self._version:
+                self._index = index
+        return index
+
+    def encoded(self, version, key, payload):
+        """已序列化和壓縮的篩選結果，沒有快取時呼叫payload建立"""
+        with self._lock:
+            self._reset(version)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        entry = encode_payload(payload())
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = entry
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return entry
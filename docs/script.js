@@ -28,6 +28,10 @@ let newAFaceActive = false;
 // Google Sheets數據URL
 const GOOGLE_SHEETS_URL = 'https://docs.google.com/spreadsheets/d/147oXFJ07Hmrc1GoUKlq4dSrvKXYJ6u4to_LiJ7GC_Mg/export?format=csv&gid=599397897';
 
+// build_static.py 產生的靜態快照：latest.json 指向內容雜湊命名的快照檔案
+const STATIC_MANIFEST_URL = 'data/latest.json';
+let staticSnapshot = null;
+
 // 顯示載入狀態
 function showLoading() {
     const chartContainer = document.querySelector('.chart-container');
@@ -41,6 +45,28 @@ function hideLoading() {
     initializeChart();
 }
 
+// 從預先產生的靜態快照獲取數據（已解析，並包含分組加總和統計）
+async function fetchStaticSnapshot() {
+    // latest.json 每次都向伺服器確認；快照檔名隨內容變化，可以直接使用瀏覽器快取
+    const manifestResponse = await fetch(STATIC_MANIFEST_URL, { cache: 'no-cache' });
+    if (!manifestResponse.ok) {
+        throw new Error(`HTTP error! status: ${manifestResponse.status}`);
+    }
+    const manifest = await manifestResponse.json();
+    
+    const response = await fetch(`data/${manifest.file}`);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+    const snapshot = await response.json();
+    
+    staticSnapshot = snapshot;
+    rawData = snapshot.data;
+    lastUpdateTime = manifest.lastUpdate || manifest.generatedAt;
+    console.log('靜態快照載入成功，版本', manifest.version, '共', rawData.length, '天的數據');
+    return { success: true, data: rawData };
+}
+
 // 從Google Sheets獲取數據
 async function fetchDataFromGoogleSheets() {
     try {
@@ -206,7 +232,15 @@ document.addEventListener('DOMContentLoaded', function() {
 // 載入數據
 async function loadData() {
     showLoading();
-    const result = await fetchDataFromGoogleSheets();
+    let result;
+    try {
+        result = await fetchStaticSnapshot();
+    } catch (error) {
+        // 沒有靜態快照（例如尚未執行 build_static.py）時改為直接下載CSV
+        console.warn('靜態快照載入失敗，改從Google Sheets獲取:', error);
+        staticSnapshot = null;
+        result = await fetchDataFromGoogleSheets();
+    }
     if (result.success) {
         hideLoading();
         filterData();
@@ -640,6 +674,17 @@ function updateChart() {
 function updateStats() {
     const cloakFilter = document.getElementById('cloakFilter').value;
     
+    // 選中整個系列時直接使用靜態快照中預先計算的統計
+    const seriesStats = staticSnapshot && staticSnapshot.stats ? staticSnapshot.stats[cloakFilter] : null;
+    const selected = getSelectedCloaks(cloakFilter);
+    if (seriesStats && selected.length === seriesStats.cloaks.length && selected.every(cloak => seriesStats.cloaks.includes(cloak))) {
+        document.getElementById('avgFailRate').textContent = seriesStats.avgFailRate.toFixed(2) + '%';
+        document.getElementById('maxFailRate').textContent = seriesStats.maxFailRate.toFixed(2) + '%';
+        document.getElementById('minFailRate').textContent = seriesStats.minFailRate.toFixed(2) + '%';
+        document.getElementById('totalVolume').textContent = seriesStats.totalVolume.toLocaleString();
+        return;
+    }
+    
     let failRates = [];
     let totalVolume = 0;
     
@@ -782,6 +827,11 @@ function toggleDataLabels() {
 
 // 計算聚合數據
 function calculateAggregatedData() {
+    // 靜態快照已包含所有新舊A面的分組加總
+    if (staticSnapshot && staticSnapshot.aggregates) {
+        return staticSnapshot.aggregates;
+    }
+    
     const cloakRanges = {
         oldAFace: {
             jb: ['jt01', 'jt02', 'jt03', 'jt04', 'jt05', 'jt06', 'jt07', 'jt08'],
@@ -0,0 +1,92 @@
+import json
+import queue
+import threading
+
+from metrics import REGISTRY, Counter
+
+# 沒有新事件時每隔幾秒送出註解行，避免代理或瀏覽器判斷連線閒置而中斷
+STREAM_HEARTBEAT_SECONDS = 15
+# 每個客戶端最多積壓幾個事件，超過時視為過慢並中斷，客戶端重新連線後會補回完整數據
+STREAM_QUEUE_SIZE = 16
+# 連線中斷後瀏覽器重新連線的等待時間（毫秒）
+STREAM_RETRY_MS = 5000
+
+STREAM_EVENTS = REGISTRY.register(Counter(
+    'jita_stream_events', '推送給SSE客戶端的事件數', labels=('event',)
+))
+STREAM_DROPPED = REGISTRY.register(Counter(
+    'jita_stream_dropped_clients', '因積壓過多事件而中斷的SSE客戶端數'
+))
+
+
+def format_event(event, data, event_id=None):
+    """Server-Sent Events 格式的一個事件，data 以JSON序列化"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+class Broadcaster:
+    """把同一個事件推送給所有訂閱的SSE連線
+
+    事件只序列化一次；每個連線有自己的有界佇列，發布時不會被慢的客戶端阻塞。
+    """
+
+    def __init__(self, heartbeat=STREAM_HEARTBEAT_SECONDS, queue_size=STREAM_QUEUE_SIZE):
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def client_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def publish(self, event, data, event_id=None):
+        """推送事件給所有客戶端，返回收到事件的客戶端數"""
+        frame = format_event(event, data, event_id)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        delivered = 0
+        for q in subscribers:
+            try:
+                q.put_nowait(frame)
+                delivered += 1
+            except queue.Full:
+                self._drop(q)
+        STREAM_EVENTS.inc(delivered, event=event)
+        return delivered
+
+    def _drop(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+        # 清空積壓的事件並通知該連線結束
+        with q.mutex:
+            q.queue.clear()
+        q.put_nowait(None)
+        STREAM_DROPPED.inc()
+
+    def stream(self, initial=None):
+        """單一連線的事件產生器，initial 為連線後先送出的事件"""
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(q)
+        try:
+            yield f'retry: {STREAM_RETRY_MS}\n\n'
+            if initial:
+                yield initial
+            while True:
+                try:
+                    frame = q.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            with self._lock:
+                self._subscribers.discard(q)
@@ -0,0 +1,220 @@
+import logging
+import math
+
+import numpy as np
+
+from cloak_table import CloakTable
+from column_plan import METRICS_PER_CLOAK, get_plan, plan_from_series
+from metrics import PARSE_CELL_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+def _is_blank(values):
+    """空值或空白字符串"""
+    # pandas只在快速轉換失敗、需要逐格處理時才載入，啟動和一般的解析都不必匯入
+    import pandas as pd
+    text = pd.Series(values, dtype=object).astype(str).str.strip()
+    return (pd.isna(values) | (text == '')).to_numpy()
+
+
+def _fast_floats(values, strip_percent=False):
+    """儲存格都是數字字符串或空白時（CSV的常見情況）一次轉換，否則返回None
+
+    每格前面補0後以空格連接：空白變成0，'.5' 變成 '0.5'；含空格、正負號或其他
+    內容的儲存格會讓切分後的數量或轉換失敗，交由逐格處理。
+    """
+    try:
+        text = '0' + ' 0'.join(values)
+    except TypeError:  # 不是字符串（例如pandas讀出的數值或NaN）
+        return None
+    if strip_percent:
+        text = text.replace('%', '')
+    if '_' in text:
+        return None
+    parts = text.split()
+    if len(parts) != len(values):
+        return None
+    try:
+        numbers = np.fromiter(map(float, parts), dtype=float, count=len(parts))
+    except ValueError:
+        return None
+    return numbers if np.isfinite(numbers).all() else None
+
+
+def _retry_floats(values):
+    """pandas無法轉換的儲存格再以 float() 逐格嘗試（例如 '1_000'），與逐行解析的結果相同
+
+    無法轉換或不是有限值時為NaN。
+    """
+    numbers = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            number = float(str(value).strip())
+        except ValueError:
+            continue
+        if math.isfinite(number):
+            numbers[i] = number
+    return numbers
+
+
+def _to_numbers(values):
+    """把object陣列轉成float，返回(數值, 無法轉換遮罩)；空白視為0"""
+    numbers = _fast_floats(values)
+    if numbers is not None:
+        return numbers, np.zeros(len(values), dtype=bool)
+
+    import pandas as pd
+    numbers = np.asarray(pd.to_numeric(values, errors='coerce'), dtype=float)
+    failed = np.flatnonzero(~np.isfinite(numbers))
+    invalid = np.zeros(len(values), dtype=bool)
+    if len(failed):
+        # 只對轉換失敗的儲存格做字符串處理，分辨空白和無效值
+        retry = _retry_floats(values[failed])
+        ok = np.isfinite(retry)
+        invalid[failed] = ~ok & ~_is_blank(values[failed])
+        numbers[failed] = np.where(ok, retry, 0.0)
+    return numbers, invalid
+
+
+def _to_fail_rates(values):
+    """把fail rate轉成float，去掉%並排除日期字符串"""
+    numbers = _fast_floats(values, strip_percent=True)
+    if numbers is not None:
+        return numbers
+
+    import pandas as pd
+    numbers = np.asarray(pd.to_numeric(values, errors='coerce'), dtype=float)
+    failed = np.flatnonzero(~np.isfinite(numbers))
+    if len(failed):
+        text = pd.Series(values[failed], dtype=object).astype(str).str.replace('%', '', regex=False).str.strip()
+        is_date = text.str.contains('/', regex=False).to_numpy()
+        text = text.where(~is_date & pd.notna(values[failed]))
+        retry = pd.to_numeric(text, errors='coerce').to_numpy(dtype=float)
+        still = np.flatnonzero(~np.isfinite(retry) & text.notna().to_numpy())
+        if len(still):
+            retry[still] = _retry_floats(text.to_numpy(dtype=object)[still])
+        numbers[failed] = np.where(np.isfinite(retry), retry, 0.0)
+    return numbers
+
+
+def convert_cells(block, zero_invalid_cloak=True):
+    """把 (days, cloaks, 3) 的儲存格陣列轉成數值
+
+    meta/GA4取整數部分，fail rate去掉%；zero_invalid_cloak時meta或GA4無法轉換的斗篷
+    當天數據全部設為0，否則只有該儲存格為0。
+    """
+    days, cloaks = block.shape[:2]
+    if block.size == 0:
+        return np.zeros((days, cloaks, METRICS_PER_CLOAK), dtype=float)
+
+    meta, meta_invalid = _to_numbers(block[:, :, 0].ravel())
+    ga4, ga4_invalid = _to_numbers(block[:, :, 1].ravel())
+    fail_rate = _to_fail_rates(block[:, :, 2].ravel())
+
+    parsed = np.stack([np.trunc(meta), np.trunc(ga4), fail_rate], axis=-1)
+    invalid = meta_invalid | ga4_invalid
+    if invalid.any():
+        PARSE_CELL_ERRORS.inc(int(invalid.sum()))
+        logger.debug(f"{int(invalid.sum())} 個斗篷數據無法轉換，已設為0")
+        if zero_invalid_cloak:
+            parsed[invalid] = 0.0
+    return parsed.reshape(days, cloaks, METRICS_PER_CLOAK)
+
+
+def parse_frame_with_plan(df, plan, first_row=2, last_row=33):
+    """按照欄位計劃向量化解析DataFrame，返回(日期列表, 斗篷名稱列表, values陣列(days, cloaks, 3))"""
+    rows = df.iloc[first_row:last_row]
+
+    # A欄日期，空白的行整行跳過
+    date_column = rows.iloc[:, 0]
+    date_text = date_column.astype(str)
+    keep = (date_column.notna() & (date_text.str.strip() != '')).to_numpy()
+    rows = rows[keep]
+    dates = date_text[keep].tolist()
+
+    cloaks = plan.cloaks
+    available = plan.available(df.shape[1])
+    values = np.zeros((len(rows), len(cloaks), METRICS_PER_CLOAK), dtype=float)
+    if len(rows) == 0 or not available.any():
+        return dates, cloaks, values
+
+    # 一次取出所有存在的斗篷欄位，整理成 (days, cloaks, 3)；計劃中缺少的指標為空白
+    indices = plan.indices[available]
+    block = rows.iloc[:, np.where(indices >= 0, indices, 0).ravel()].to_numpy(dtype=object)
+    block = block.reshape(len(rows), -1, METRICS_PER_CLOAK)
+    block[:, indices < 0] = None
+
+    values[:, available] = convert_cells(block)
+    return dates, cloaks, values
+
+
+def parse_cloak_blocks(df, series_config, first_row=2, last_row=33):
+    """向量化解析斗篷欄位，返回(日期列表, 斗篷名稱列表, values陣列(days, cloaks, 3))"""
+    return parse_frame_with_plan(df, plan_from_series(series_config), first_row, last_row)
+
+
+def frame_header_rows(df, first_row=2):
+    """DataFrame的欄名加上數據之前的各行，作為分析欄位位置的標題"""
+    return [list(df.columns)] + df.iloc[:first_row].to_numpy(dtype=object).tolist()
+
+
+def plan_for_frame(df, series_config, first_row=2):
+    """從DataFrame的標題找出欄位計劃，標題中沒有斗篷名稱時使用series_config的位置"""
+    return get_plan(frame_header_rows(df, first_row), plan_from_series(series_config))
+
+
+def parse_rows_with_plan(rows, plan, zero_invalid_cloak=False):
+    """按照欄位計劃解析csv.reader的行，沒有日期的行跳過，返回 CloakTable"""
+    take = plan.take
+    dates = []
+    cells = []
+    for row in rows:
+        if not row or not row[0].strip():
+            continue
+        dates.append(row[0].strip())
+        cells.append(take(row))
+
+    block = np.empty((len(cells), len(plan.cloaks) * METRICS_PER_CLOAK), dtype=object)
+    if cells:
+        block[:] = cells
+    block = block.reshape(len(cells), len(plan.cloaks), METRICS_PER_CLOAK)
+    return CloakTable.from_blocks(dates, plan.cloaks, convert_cells(block, zero_invalid_cloak))
+
+
+def blocks_to_records(dates, cloaks, values):
+    """把陣列轉換為API使用的每日字典格式"""
+    meta = values[:, :, 0].astype(np.int64).tolist()
+    ga4 = values[:, :, 1].astype(np.int64).tolist()
+    fail_rate = values[:, :, 2].tolist()
+
+    result_data = []
+    for d, date_str in enumerate(dates):
+        date_data = {'date': date_str}
+        meta_row, ga4_row, fail_rate_row = meta[d], ga4[d], fail_rate[d]
+        for c, cloak in enumerate(cloaks):
+            date_data[cloak] = {
+                'meta': meta_row[c],
+                'ga4': ga4_row[c],
+                'failRate': round(fail_rate_row[c], 2)
+            }
+        result_data.append(date_data)
+    return result_data
+
+
+def parse_sheet_frame(df, series_config, first_row=2, last_row=33):
+    """向量化解析Google Sheets DataFrame，輸出與逐行解析相同"""
+    dates, cloaks, values = parse_cloak_blocks(df, series_config, first_row, last_row)
+    logger.debug(f"向量化解析完成: {len(dates)} 個日期 x {len(cloaks)} 個斗篷")
+    return blocks_to_records(dates, cloaks, values)
+
+
+def parse_sheet_table(df, series_config, first_row=2, last_row=33):
+    """向量化解析Google Sheets DataFrame，直接返回 CloakTable，不建立每日字典
+
+    欄位位置優先從標題行找出（相同標題重用已編譯的計劃），找不到時使用series_config。
+    """
+    plan = plan_for_frame(df, series_config, first_row)
+    dates, cloaks, values = parse_frame_with_plan(df, plan, first_row, last_row)
+    logger.debug(f"向量化解析完成: {len(dates)} 個日期 x {len(cloaks)} 個斗篷")
+    return CloakTable.from_blocks(dates, cloaks, values)
@@ -0,0 +1,222 @@
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY, Counter
+
+logger = logging.getLogger(__name__)
+
+# 單次抓取失敗後最多重試幾次
+FETCH_RETRIES = 2
+# 重試等待時間的基數和上限（秒），實際等待為 0 到 min(上限, 基數 x 2^次數) 之間的隨機值
+FETCH_BACKOFF_BASE = 0.5
+FETCH_BACKOFF_MAX = 8.0
+# 同一主機連續失敗幾次後斷路，斷路期間直接失敗不再請求上游
+BREAKER_FAILURE_THRESHOLD = 5
+# 斷路多久後放行一個試探請求（秒）
+BREAKER_RESET_SECONDS = 30
+# 每個主機保持的keep-alive連線數
+POOL_SIZE = 8
+
+# 視為暫時性錯誤而重試的HTTP狀態碼
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+FETCH_RETRIES_TOTAL = REGISTRY.register(Counter(
+    'jita_fetch_retries', '上游請求重試的次數'
+))
+FETCH_COALESCED = REGISTRY.register(Counter(
+    'jita_fetch_coalesced', '與進行中的相同請求合併、沒有另外發出的請求數'
+))
+CIRCUIT_REJECTED = REGISTRY.register(Counter(
+    'jita_circuit_rejected', '斷路期間直接拒絕的上游請求數', labels=('host',)
+))
+
+
+class CircuitOpenError(requests.RequestException):
+    """上游連續失敗而斷路，請求沒有發出"""
+
+
+class CircuitBreaker:
+    """連續失敗達到門檻後斷路；冷卻時間過後只放行一個試探請求，成功才恢復"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    logger.warning(f"上游連續失敗 {self.failures} 次，暫停請求 {self.reset_seconds} 秒")
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class _Call:
+    """進行中的請求，相同請求的其他呼叫者等待其結果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class FetchGateway:
+    """所有上游請求的入口：共用連線池、合併相同的並發請求、帶抖動的重試和斷路器
+
+    非串流的相同請求（URL及標頭相同）同時只發出一個，其他呼叫者共用同一個回應；
+    串流回應只能讀取一次，不合併（SheetCache的刷新鎖已避免同一快取重複抓取）。
+    """
+
+    def __init__(self, retries=FETCH_RETRIES, backoff_base=FETCH_BACKOFF_BASE, backoff_max=FETCH_BACKOFF_MAX,
+                 failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS,
+                 pool_size=POOL_SIZE, sleep=time.sleep):
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._sleep = sleep
+
+        self.session = requests.Session()
+        # 重試由閘道自行處理，連線池不再重試
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._breakers = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+            return breaker
+
+    def get(self, url, headers=None, timeout=10, stream=False):
+        """GET請求；4xx等非暫時性錯誤直接返回回應，由呼叫者決定如何處理"""
+        if stream:
+            return self._fetch(url, headers, timeout, stream=True)
+
+        key = (url, tuple(sorted((headers or {}).items())))
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            FETCH_COALESCED.inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.response
+
+        try:
+            call.response = self._fetch(url, headers, timeout, stream=False)
+            return call.response
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), self.backoff_max))
+        return delay
+
+    def _fetch(self, url, headers, timeout, stream):
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            CIRCUIT_REJECTED.inc(host=urlsplit(url).netloc)
+            raise CircuitOpenError(f'上游暫停請求中（連續失敗 {breaker.failures} 次）: {url}')
+
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self.session.get(url, headers=headers, timeout=timeout, stream=stream)
+                if response.status_code not in RETRY_STATUSES:
+                    if not stream:
+                        response.content  # 在合併的呼叫者之間共用前先讀取完畢
+                    breaker.record_success()
+                    return response
+                error = requests.HTTPError(f'{response.status_code} 錯誤: {url}', response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except Exception:
+                breaker.record_failure()
+                raise
+
+            if attempt >= self.retries:
+                breaker.record_failure()
+                if response is not None:
+                    # 暫時性錯誤重試用盡，返回最後的回應讓呼叫者raise_for_status
+                    return response
+                raise error
+
+            delay = self._backoff(attempt, response)
+            if response is not None:
+                response.close()
+            attempt += 1
+            FETCH_RETRIES_TOTAL.inc()
+            logger.warning(f"上游請求失敗，{delay:.1f} 秒後第 {attempt} 次重試: {error}")
+            self._sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            host: {'state': breaker.state, 'failures': breaker.failures}
+            for host, breaker in breakers.items()
+        }
+
+
+# 同一進程內所有模組共用的閘道，共用連線池和斷路狀態
+default_gateway = FetchGateway()
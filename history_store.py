@@ -0,0 +1,169 @@
+import logging
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# 斗篷名稱前綴對應的系列（jtw/jtg需先於jt比對）
+CLOAK_SERIES = (('jtw', 'jw'), ('jtg', 'jg'), ('jt', 'jb'))
+
+_DATE_PATTERNS = (
+    (re.compile(r'^(\d{4})[/-](\d{1,2})[/-](\d{1,2})$'), ('year', 'month', 'day')),
+    (re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})$'), ('month', 'day', 'year')),
+    (re.compile(r'^(\d{1,2})/(\d{1,2})$'), ('month', 'day')),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cloak_daily (
+    date TEXT NOT NULL,          -- ISO日期 YYYY-MM-DD
+    series TEXT NOT NULL,        -- jb / jw / jg
+    cloak TEXT NOT NULL,
+    label TEXT NOT NULL,         -- 表格上的原始日期字符串
+    meta INTEGER NOT NULL,
+    ga4 INTEGER NOT NULL,
+    fail_rate REAL NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (date, series, cloak)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_cloak_daily_cloak ON cloak_daily (series, cloak, date);
+"""
+
+UPSERT = """
+INSERT INTO cloak_daily (date, series, cloak, label, meta, ga4, fail_rate, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (date, series, cloak) DO UPDATE SET
+    label = excluded.label,
+    meta = excluded.meta,
+    ga4 = excluded.ga4,
+    fail_rate = excluded.fail_rate,
+    updated_at = excluded.updated_at
+WHERE meta != excluded.meta OR ga4 != excluded.ga4 OR fail_rate != excluded.fail_rate
+"""
+
+
+def cloak_series(cloak):
+    """根據斗篷名稱判斷系列"""
+    for prefix, series in CLOAK_SERIES:
+        if cloak.startswith(prefix):
+            return series
+    return cloak  # jb / jw / jg 產品層級的數據
+
+
+def normalize_date(label, today=None):
+    """把表格日期轉成ISO日期；只有月/日時推算年份，無法辨識時返回None"""
+    today = today or date.today()
+    text = str(label).strip()
+    for pattern, fields in _DATE_PATTERNS:
+        match = pattern.match(text)
+        if not match:
+            continue
+        parts = dict(zip(fields, (int(v) for v in match.groups())))
+        year = parts.get('year', today.year)
+        try:
+            value = date(year, parts['month'], parts['day'])
+        except ValueError:
+            return None
+        # 沒有年份且日期遠在未來時，應屬於去年 (例如一月時看到12/31)
+        if 'year' not in parts and value > today + timedelta(days=31):
+            value = value.replace(year=year - 1)
+        return value.isoformat()
+    return None
+
+
+def _iter_record_cells(data):
+    """逐格產生每日字典格式中的 (日期, 斗篷, meta, ga4, failRate)"""
+    for item in data:
+        label = item.get('date')
+        for cloak, values in item.items():
+            if cloak != 'date':
+                yield label, cloak, values['meta'], values['ga4'], values['failRate']
+
+
+class HistoryStore:
+    """以SQLite保存每日斗篷數據的歷史，依 (date, series, cloak) 建立索引"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self.revision = 0  # 每次寫入變更時遞增，用於快取鍵
+        self._written = {}  # (date, cloak) -> 最後寫入的數值，未變化的數據不必送進SQLite
+
+    def record(self, data, version=None):
+        """寫入一份解析後的快照，只更新有變化的 (date, cloak)，返回變更筆數"""
+        now = datetime.now().isoformat()
+        rows = []
+        skipped = set()
+        iso_dates = {}
+        # CloakTable直接逐格讀取陣列，避免為了寫入而建立每日字典
+        cells = data.iter_cells() if hasattr(data, 'iter_cells') else _iter_record_cells(data)
+        for label, cloak, meta, ga4, fail_rate in cells:
+            if label not in iso_dates:
+                iso_dates[label] = normalize_date(label)
+            iso_date = iso_dates[label]
+            if iso_date is None:
+                skipped.add(label)
+                continue
+            metrics = (int(meta), int(ga4), float(fail_rate))
+            if self._written.get((iso_date, cloak)) == metrics:
+                continue
+            rows.append((iso_date, cloak_series(cloak), cloak, str(label)) + metrics + (now,))
+
+        with self._lock:
+            before = self._conn.total_changes
+            with self._conn:
+                self._conn.executemany(UPSERT, rows)
+            changed = self._conn.total_changes - before
+            if changed:
+                self.revision += 1
+            for row in rows:
+                self._written[(row[0], row[2])] = row[4:7]
+
+        if skipped:
+            logger.debug(f"歷史數據略過 {len(skipped)} 個無法辨識的日期")
+        logger.info(f"歷史數據已寫入快照 {version}: {changed} 筆變更")
+        return changed
+
+    def query(self, date_from=None, date_to=None, cloaks=None):
+        """查詢日期範圍內的數據，返回與 /api/data 相同的每日格式（日期為ISO格式）"""
+        sql = 'SELECT date, cloak, meta, ga4, fail_rate FROM cloak_daily'
+        conditions = []
+        params = []
+        if date_from:
+            conditions.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append('date <= ?')
+            params.append(date_to)
+        if cloaks:
+            conditions.append(f"cloak IN ({','.join('?' * len(cloaks))})")
+            params.extend(cloaks)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY date, series, cloak'
+
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            records = cursor.fetchall()
+
+        result_data = []
+        current = None
+        for iso_date, cloak, meta, ga4, fail_rate in records:
+            if current is None or current['date'] != iso_date:
+                current = {'date': iso_date}
+                result_data.append(current)
+            current[cloak] = {'meta': meta, 'ga4': ga4, 'failRate': fail_rate}
+        return result_data
+
+    def date_range(self):
+        """返回已保存的最早和最晚日期"""
+        with self._lock:
+            return self._conn.execute('SELECT MIN(date), MAX(date) FROM cloak_daily').fetchone()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,198 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response
+
+# 秒為單位的延遲分桶，涵蓋從記憶體內操作到上游逾時
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不減的計數器，可帶標籤"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = f'{name}_total'
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.label_names:
+            items = [((), 0)]
+        return [(self.name, _format_labels(self.label_names, key), value) for key, value in items]
+
+
+class Histogram:
+    """延遲分佈，累計分桶的格式與Prometheus相同"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # 標籤 -> [各分桶計數..., 總和, 次數]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += seconds
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(entry)) for key, entry in self._values.items())
+        samples = []
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                samples.append((self.name + '_bucket', _format_labels(self.label_names, key, ('le', _format_value(bound))), cumulative))
+            samples.append((self.name + '_bucket', _format_labels(self.label_names, key, ('le', '+Inf')), entry[-1]))
+            samples.append((self.name + '_sum', _format_labels(self.label_names, key), round(entry[-2], 6)))
+            samples.append((self.name + '_count', _format_labels(self.label_names, key), entry[-1]))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # 模組重新載入時沿用已存在的指標
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self, extra=()):
+        """輸出Prometheus文字格式；extra為 (名稱, 類型, 說明, 值) 的即時數值"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        for name, type_name, help_text, value in extra:
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {type_name}')
+            lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'jita_stage_seconds',
+    '各處理階段的耗時（fetch=上游請求, decode=CSV解碼, parse=解析, aggregate=分組加總, serialize=JSON序列化, compress=壓縮）',
+    labels=('stage',)
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    'jita_upstream_errors', '抓取或解析Google Sheets失敗的次數'
+))
+FALLBACK_TEST_DATA = REGISTRY.register(Counter(
+    'jita_fallback_test_data', '無法取得上游數據而改用備用測試數據的次數'
+))
+PARSE_CELL_ERRORS = REGISTRY.register(Counter(
+    'jita_parse_cell_errors', '無法轉換為數值的儲存格數'
+))
+
+
+def stage_timer(stage):
+    """量測一個處理階段：with stage_timer('parse'): ..."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+_last_logged = {}
+_last_logged_lock = threading.Lock()
+
+
+def log_sampled(log_func, key, message, interval=60):
+    """同一key在interval秒內只記錄一次日誌，避免熱路徑每次請求都寫日誌"""
+    now = time.monotonic()
+    with _last_logged_lock:
+        last = _last_logged.get(key)
+        if last is not None and now - last < interval:
+            return False
+        _last_logged[key] = now
+    log_func(message)
+    return True
+
+
+def cache_metrics(stats):
+    """把 SheetCache.stats() 轉成指標"""
+    samples = [
+        (f'jita_sheet_cache_{name}_total', 'counter', f'SheetCache {name} 次數', stats.get(key))
+        for key, name in (
+            ('hits', 'hits'), ('misses', 'misses'), ('staleHits', 'stale_hits'), ('refreshes', 'refreshes'),
+            ('notModified', 'not_modified'), ('unchanged', 'unchanged'), ('errors', 'errors')
+        )
+    ]
+    samples += [
+        ('jita_sheet_cache_age_seconds', 'gauge', '快取數據自上次確認為最新以來的秒數', stats.get('ageSeconds')),
+        ('jita_sheet_cache_version', 'gauge', '快取數據的版本', stats.get('version')),
+        ('jita_sheet_cache_last_refresh_seconds', 'gauge', '上一次刷新的耗時', stats.get('lastRefreshSeconds')),
+    ]
+    return samples
+
+
+def metrics_response(sheet_cache=None):
+    """/api/metrics 的回應"""
+    extra = cache_metrics(sheet_cache.stats()) if sheet_cache is not None else ()
+    return Response(REGISTRY.render(extra), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+
+from aggregation import CloakAggregator, fail_rate
+from cloak_table import CloakTable, as_table
+from history_store import normalize_date
+
+BUCKETS = ('week', 'month')
+# 每份快照最多保留幾種彙總/降採樣結果
+ROLLUP_CACHE_SIZE = 16
+# maxPoints 的下限：至少保留首尾及一個中間點
+MIN_POINTS = 3
+
+
+def bucket_label(iso_date, bucket):
+    """週以該週週一的ISO日期表示，月以 YYYY-MM 表示"""
+    if bucket == 'month':
+        return iso_date[:7]
+    day = date.fromisoformat(iso_date)
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def rollup_table(data, bucket):
+    """按週或月重新加總 meta/GA4，fail rate 由加總後的數值重新計算，不平均百分比
+
+    無法辨識的日期併入前一行所屬的區間。
+    """
+    table = as_table(data)
+    keys = []
+    current = None
+    for label in table.dates:
+        iso_date = normalize_date(label)
+        current = bucket_label(iso_date, bucket) if iso_date else current
+        keys.append(current)
+
+    labels = sorted({key for key in keys if key is not None})
+    position = {label: i for i, label in enumerate(labels)}
+    rows = np.array([key is not None for key in keys], dtype=bool)
+    groups = np.array([position[key] for key in keys if key is not None], dtype=np.intp)
+
+    shape = (len(labels), len(table.cloaks))
+    meta = np.zeros(shape, dtype=np.int64)
+    ga4 = np.zeros(shape, dtype=np.int64)
+    np.add.at(meta, groups, table.meta[rows])
+    np.add.at(ga4, groups, table.ga4[rows])
+    return CloakTable(labels, table.cloaks, meta, ga4, fail_rate(meta, ga4))
+
+
+def lttb_indices(values, max_points):
+    """Largest-Triangle-Three-Buckets 降採樣，返回保留的行索引（包括首尾）
+
+    values 為 (行, 數列) 矩陣；所有數列共用同一組x軸，三角形面積為各數列面積的總和，
+    選出的日期同時保留整體的形狀。
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if max_points >= n:
+        return np.arange(n)
+    if values.ndim == 1:
+        values = values[:, None]
+
+    x = np.arange(n, dtype=float)
+    every = (n - 2) / (max_points - 2)
+    selected = [0]
+    a = 0
+    for i in range(max_points - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = values[end:next_end].mean(axis=0)
+
+        ya = values[a]
+        area = np.abs(
+            (x[a] - avg_x) * (values[start:end] - ya) - (x[a] - x[start:end, None]) * (avg_y - ya)
+        ).sum(axis=1)
+        a = start + int(np.argmax(area))
+        selected.append(a)
+    selected.append(n - 1)
+    return np.array(selected, dtype=np.intp)
+
+
+def downsample_table(data, max_points):
+    """以各斗篷的 fail rate 選出保留的日期"""
+    table = as_table(data)
+    if not max_points or len(table) <= max_points:
+        return table
+    return table.take_rows(lttb_indices(table.fail_rate_values(), max_points))
+
+
+def downsample_records(records, names, max_points):
+    """以指定分組的 fail rate 降採樣每日字典列表（例如 /api/aggregate 的結果）"""
+    if not max_points or len(records) <= max_points:
+        return records
+    values = [[item[name]['failRate'] for name in names] for item in records]
+    return [records[i] for i in lttb_indices(values, max_points)]
+
+
+def parse_shape_args(args):
+    """解析 bucket / maxPoints 查詢參數，返回 (bucket, max_points)"""
+    bucket = args.get('bucket') or None
+    if bucket == 'day':
+        bucket = None
+    if bucket is not None and bucket not in BUCKETS:
+        raise ValueError(f"bucket 應為 day、{'、'.join(BUCKETS)}")
+    max_points = args.get('maxPoints')
+    if max_points:
+        if not max_points.isdigit() or int(max_points) < MIN_POINTS:
+            raise ValueError(f'maxPoints 應為不小於 {MIN_POINTS} 的整數')
+        max_points = int(max_points)
+    return bucket, max_points or None
+
+
+class RollupCache:
+    """最新快照的彙總、降採樣表格及其分組加總器，快照版本變更時清空"""
+
+    def __init__(self, size=ROLLUP_CACHE_SIZE):
+        self.size = size
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, version, key, build):
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._entries.clear()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = build()
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = value
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+        return value
+
+    def table(self, data, version, bucket=None, max_points=None):
+        """按 bucket 彙總後降採樣到 max_points"""
+        if max_points:
+            return self._get(version, ('table', bucket, max_points), lambda: downsample_table(
+                self.table(data, version, bucket), max_points
+            ))
+        if bucket:
+            return self._get(version, ('table', bucket, None), lambda: rollup_table(data, bucket))
+        return as_table(data)
+
+    def aggregator(self, data, version, bucket):
+        """彙總後表格的分組加總器"""
+        return self._get(version, ('aggregator', bucket), lambda: CloakAggregator(self.table(data, version, bucket)))
@@ -7,9 +7,15 @@ let lastUpdateTime = null;
 let showDataLabels = false;
 let oldAFaceActive = false;
 let newAFaceActive = false;
+let serverAggregatedData = null; // 服務器預先計算的新舊A面分組數據
+let dataVersion = null; // 目前數據的版本標記，刷新時只請求之後變化的格子
+let dataStale = false; // 服務器返回的是上游無法連線時保存的舊數據
 
 // API配置
 const API_BASE_URL = 'http://localhost:5003/api';
+// 瀏覽器不支援Server-Sent Events時，定期檢查數據更新的間隔（毫秒）
+const REFRESH_INTERVAL_MS = 60000;
+let updateStream = null;
 
 // 顯示載入狀態
 function showLoading() {
@@ -32,7 +38,8 @@ async function fetchDataFromAPI() {
         showLoading();
         
         console.log('開始獲取數據...');
-        const response = await fetch(`${API_BASE_URL}/data`);
+        // 使用欄式格式，瀏覽器會自動帶上ETag重新驗證並處理gzip/brotli解壓
+        const response = await fetch(`${API_BASE_URL}/data?format=columnar`);
         console.log('Response status:', response.status);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
@@ -42,11 +49,16 @@ async function fetchDataFromAPI() {
         console.log('API響應:', result);
         
         if (result.success) {
-            rawData = result.data;
-            lastUpdateTime = result.timestamp;
+            rawData = decodeColumnarData(result.data);
+            dataVersion = result.version || null;
+            lastUpdateTime = result.timestamp || result.lastUpdate;
+            dataStale = Boolean(result.stale);
             console.log('成功獲取數據:', rawData.length, '個日期');
             console.log('前5個數據項:', rawData.slice(0, 5));
             
+            // 新舊A面分組由服務器計算
+            await fetchAggregatedData();
+            
             // 更新最後更新時間顯示
             updateLastUpdateTime();
             
@@ -69,6 +81,131 @@ async function fetchDataFromAPI() {
     }
 }
 
+// 從API獲取新舊A面分組數據，失敗時改為在瀏覽器計算
+async function fetchAggregatedData() {
+    try {
+        const response = await fetch(`${API_BASE_URL}/aggregate`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        const result = await response.json();
+        if (!result.success) {
+            throw new Error(result.error || '獲取分組數據失敗');
+        }
+        serverAggregatedData = result.data;
+        console.log('成功獲取分組數據:', serverAggregatedData.length, '個日期');
+    } catch (error) {
+        console.warn('無法獲取服務器分組數據，改為在瀏覽器計算:', error);
+        serverAggregatedData = null;
+    }
+}
+
+// 只取得上次版本之後變化的格子並套用到rawData，數據有變化時才重新繪製
+async function refreshData() {
+    if (isLoading || !dataVersion) {
+        return;
+    }
+    try {
+        const response = await fetch(`${API_BASE_URL}/data?format=columnar&since=${encodeURIComponent(dataVersion)}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        const result = await response.json();
+        if (!result.success) {
+            throw new Error(result.error || '獲取數據失敗');
+        }
+        await applyUpdate(result);
+    } catch (error) {
+        console.warn('檢查數據更新失敗:', error);
+    }
+}
+
+// 套用完整數據 (reset) 或差異，版本沒有變化時不重新繪製
+async function applyUpdate(update) {
+    if (Boolean(update.stale) !== dataStale) {
+        dataStale = Boolean(update.stale);
+        updateLastUpdateTime();
+    }
+    if (update.version === dataVersion) {
+        return;
+    }
+    
+    if (update.reset) {
+        // 版本太舊或服務器已重啟，改用完整數據
+        rawData = decodeColumnarData(update.data);
+    } else {
+        rawData = applyDataChanges(rawData, update);
+        console.log('數據已更新:', update.changes.length, '個格子');
+    }
+    dataVersion = update.version;
+    lastUpdateTime = update.lastUpdate;
+    
+    await fetchAggregatedData();
+    updateLastUpdateTime();
+    filterData();
+}
+
+// 訂閱服務器推送的數據更新；所有分頁共用服務器的同一份快照，不再各自輪詢
+function subscribeToUpdates() {
+    if (!window.EventSource) {
+        setInterval(refreshData, REFRESH_INTERVAL_MS);
+        return;
+    }
+    
+    updateStream = new EventSource(`${API_BASE_URL}/stream`);
+    // 連線（或重新連線）時服務器送出目前版本，與本地不同時補取差異
+    updateStream.addEventListener('version', event => {
+        const { version } = JSON.parse(event.data);
+        if (version !== dataVersion) {
+            refreshData();
+        }
+    });
+    updateStream.addEventListener('delta', event => {
+        const delta = JSON.parse(event.data);
+        // 只有本地正好是差異的起點時才能直接套用，否則向服務器補取
+        if (delta.since === dataVersion && !isLoading) {
+            applyUpdate(delta);
+        } else {
+            refreshData();
+        }
+    });
+    updateStream.addEventListener('reset', () => refreshData());
+    updateStream.onerror = () => console.warn('數據更新連線中斷，瀏覽器將自動重新連線');
+}
+
+// 把差異 {changes: [[日期, 斗篷, meta, ga4, failRate]], removed, dates} 套用到每日數據
+function applyDataChanges(rows, delta) {
+    const byDate = new Map(rows.map(row => [row.date, row]));
+    delta.removed.forEach(date => byDate.delete(date));
+    delta.changes.forEach(([date, cloak, meta, ga4, failRate]) => {
+        if (!byDate.has(date)) {
+            byDate.set(date, { date });
+        }
+        byDate.get(date)[cloak] = { meta, ga4, failRate };
+    });
+    // 日期順序有變化時服務器會返回完整的日期列表
+    const dates = delta.dates || [...byDate.keys()];
+    return dates.filter(date => byDate.has(date)).map(date => byDate.get(date));
+}
+
+// 把欄式格式 {dates, cloaks: {cloak: {meta[], ga4[], failRate[]}}} 還原為每日數據
+function decodeColumnarData(data) {
+    if (!data || data.format !== 'columnar') {
+        return data;
+    }
+    
+    const rows = data.dates.map(date => ({ date }));
+    Object.entries(data.cloaks).forEach(([cloak, columns]) => {
+        const { meta, ga4, failRate } = columns;
+        for (let i = 0; i < rows.length; i++) {
+            rows[i][cloak] = { meta: meta[i], ga4: ga4[i], failRate: failRate[i] };
+        }
+    });
+    return rows;
+}
+
 // 顯示錯誤信息
 function showError(message) {
     const chartContainer = document.querySelector('.chart-container');
@@ -88,7 +225,9 @@ function updateLastUpdateTime() {
     if (lastUpdateTime) {
         const header = document.querySelector('header p');
         const updateTime = new Date(lastUpdateTime).toLocaleString('zh-TW');
-        header.textContent = `基於Google Sheets數據的互動式分析 - 最後更新: ${updateTime}`;
+        // 上游暫時無法連線時服務器提供保存的舊數據
+        const staleNote = dataStale ? '（Google Sheets暫時無法連線，顯示已保存的數據）' : '';
+        header.textContent = `基於Google Sheets數據的互動式分析 - 最後更新: ${updateTime}${staleNote}`;
     }
 }
 
@@ -96,6 +235,7 @@ function updateLastUpdateTime() {
 document.addEventListener('DOMContentLoaded', function() {
     setupEventListeners();
     fetchDataFromAPI();
+    subscribeToUpdates();
     
     // 初始化時檢查預設選項
     handleCloakFilterChange();
@@ -674,44 +814,78 @@ function updateChart() {
 }
 
 // 更新統計數據
-function updateStats() {
+let statsRequestId = 0; // 只顯示最後一次請求的統計結果
+
+// 統計面板由服務器的範圍統計索引計算，失敗時改為在瀏覽器計算
+async function updateStats() {
     const cloakFilter = document.getElementById('cloakFilter').value;
+    const requestId = ++statsRequestId;
     
-    let failRates = [];
-    let totalVolume = 0;
+    // 「全部」使用服務器預設的所有斗篷
+    const selectedCloaks = cloakFilter === 'all' ? null : getSelectedCloaks(cloakFilter);
+    if (selectedCloaks && selectedCloaks.length === 0) {
+        renderStats({ cells: 0, avgFailRate: 0, maxFailRate: 0, minFailRate: 0, totalVolume: 0 });
+        return;
+    }
     
-    currentData.forEach(item => {
-        if (cloakFilter === 'all') {
-            // 統計所有有數據的斗篷
-            const allCloaks = ['jt01', 'jt02', 'jt03', 'jt04', 'jt05', 'jt06', 'jt07', 'jt08', 'jt09', 'jt10', 'jt11', 'jt12', 'jt13',
-                              'jtw01', 'jtw02', 'jtw03', 'jtw04', 'jtw05', 'jtw06', 'jtw07', 'jtw08', 'jtw09', 'jtw10', 'jtw11', 'jtw12', 'jtw13',
-                              'jtg01', 'jtg02', 'jtg03', 'jtg04', 'jtg05', 'jtg06', 'jtg07', 'jtg08', 'jtg09', 'jtg10', 'jtg11', 'jtg12', 'jtg13'];
-            allCloaks.forEach(cloak => {
-                if (item[cloak] && (item[cloak].meta > 0 || item[cloak].ga4 > 0 || item[cloak].failRate > 0)) {
-                    failRates.push(item[cloak].failRate);
-                    totalVolume += item[cloak].meta;
-                }
-            });
-        } else {
-            // 根據選中的斗篷篩選
-            const selectedCloaks = getSelectedCloaks(cloakFilter);
-            selectedCloaks.forEach(cloak => {
-                if (item[cloak] && (item[cloak].meta > 0 || item[cloak].ga4 > 0 || item[cloak].failRate > 0)) {
-                    failRates.push(item[cloak].failRate);
-                    totalVolume += item[cloak].meta;
-                }
-            });
+    try {
+        const query = selectedCloaks ? `?cloaks=${encodeURIComponent(selectedCloaks.join(','))}` : '';
+        const response = await fetch(`${API_BASE_URL}/stats${query}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
         }
-    });
+        
+        const result = await response.json();
+        if (!result.success) {
+            throw new Error(result.error || '獲取統計數據失敗');
+        }
+        if (requestId === statsRequestId) {
+            renderStats(result.stats);
+        }
+    } catch (error) {
+        console.warn('無法獲取服務器統計數據，改為在瀏覽器計算:', error);
+        if (requestId === statsRequestId) {
+            renderStats(computeStatsLocally(cloakFilter));
+        }
+    }
+}
+
+// 在瀏覽器掃描目前的數據計算統計
+function computeStatsLocally(cloakFilter) {
+    const cloaks = cloakFilter === 'all'
+        ? ['jt01', 'jt02', 'jt03', 'jt04', 'jt05', 'jt06', 'jt07', 'jt08', 'jt09', 'jt10', 'jt11', 'jt12', 'jt13',
+           'jtw01', 'jtw02', 'jtw03', 'jtw04', 'jtw05', 'jtw06', 'jtw07', 'jtw08', 'jtw09', 'jtw10', 'jtw11', 'jtw12', 'jtw13',
+           'jtg01', 'jtg02', 'jtg03', 'jtg04', 'jtg05', 'jtg06', 'jtg07', 'jtg08', 'jtg09', 'jtg10', 'jtg11', 'jtg12', 'jtg13']
+        : getSelectedCloaks(cloakFilter);
     
-    const avgFailRate = failRates.length > 0 ? (failRates.reduce((a, b) => a + b, 0) / failRates.length).toFixed(2) : '0.00';
-    const maxFailRate = failRates.length > 0 ? Math.max(...failRates).toFixed(2) : '0.00';
-    const minFailRate = failRates.length > 0 ? Math.min(...failRates).toFixed(2) : '0.00';
+    const stats = { cells: 0, avgFailRate: 0, maxFailRate: -Infinity, minFailRate: Infinity, totalVolume: 0 };
+    let failRateSum = 0;
+    currentData.forEach(item => {
+        cloaks.forEach(cloak => {
+            const cell = item[cloak];
+            if (cell && (cell.meta > 0 || cell.ga4 > 0 || cell.failRate > 0)) {
+                stats.cells++;
+                failRateSum += cell.failRate;
+                // 逐一比較，避免 Math.max(...陣列) 在數據量大時超出參數上限
+                stats.maxFailRate = Math.max(stats.maxFailRate, cell.failRate);
+                stats.minFailRate = Math.min(stats.minFailRate, cell.failRate);
+                stats.totalVolume += cell.meta;
+            }
+        });
+    });
     
-    document.getElementById('avgFailRate').textContent = avgFailRate + '%';
-    document.getElementById('maxFailRate').textContent = maxFailRate + '%';
-    document.getElementById('minFailRate').textContent = minFailRate + '%';
-    document.getElementById('totalVolume').textContent = totalVolume.toLocaleString();
+    if (stats.cells === 0) {
+        return { cells: 0, avgFailRate: 0, maxFailRate: 0, minFailRate: 0, totalVolume: 0 };
+    }
+    stats.avgFailRate = failRateSum / stats.cells;
+    return stats;
+}
+
+function renderStats(stats) {
+    document.getElementById('avgFailRate').textContent = stats.avgFailRate.toFixed(2) + '%';
+    document.getElementById('maxFailRate').textContent = stats.maxFailRate.toFixed(2) + '%';
+    document.getElementById('minFailRate').textContent = stats.minFailRate.toFixed(2) + '%';
+    document.getElementById('totalVolume').textContent = stats.totalVolume.toLocaleString();
 }
 
 // 更新數據表格
@@ -850,8 +1024,16 @@ function toggleDataLabels() {
     updateChart();
 }
 
-// 計算聚合數據
+// 計算聚合數據，優先使用服務器預先計算的結果
 function calculateAggregatedData() {
+    if (serverAggregatedData) {
+        return serverAggregatedData;
+    }
+    return calculateAggregatedDataLocally();
+}
+
+// 在瀏覽器計算聚合數據（服務器不可用時的備用方案）
+function calculateAggregatedDataLocally() {
     const cloakRanges = {
         oldAFace: {
             jb: ['jt01', 'jt02', 'jt03', 'jt04', 'jt05', 'jt06', 'jt07', 'jt08'],
@@ -886,7 +1068,7 @@ function calculateAggregatedData() {
                 
                 // 計算fail rate: 1 - (GA4總和 ÷ Meta總和)
                 const conversionRate = totalMeta > 0 ? totalGA4 / totalMeta : 0;
-                const avgFailRate = (1 - conversionRate) * 100; // 轉換為百分比
+                const avgFailRate = totalMeta > 0 ? (1 - conversionRate) * 100 : 0; // 轉換為百分比，與服務器一致
                 
                 dateData[`${series}_old`] = {
                     meta: totalMeta,
@@ -912,7 +1094,7 @@ function calculateAggregatedData() {
                 
                 // 計算fail rate: 1 - (GA4總和 ÷ Meta總和)
                 const conversionRate = totalMeta > 0 ? totalGA4 / totalMeta : 0;
-                const avgFailRate = (1 - conversionRate) * 100; // 轉換為百分比
+                const avgFailRate = totalMeta > 0 ? (1 - conversionRate) * 100 : 0; // 轉換為百分比，與服務器一致
                 
                 dateData[`${series}_new`] = {
                     meta: totalMeta,
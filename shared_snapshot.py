@@ -0,0 +1,390 @@
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from api_format import encode_payload
+from cloak_table import CloakTable, as_table
+
+logger = logging.getLogger(__name__)
+
+# 檔案格式：MAGIC | header長度 (uint32) | header JSON | 對齊後依序存放的陣列和回應內容
+MAGIC = b'JITASNP1'
+_PREFIX = struct.Struct('<8sI')
+ALIGN = 64
+# 跟隨的worker檢查共享快照是否更新、以及嘗試接手刷新的間隔（秒）
+SHARED_SNAPSHOT_CHECK_SECONDS = 1.0
+
+_ARRAYS = (('meta', np.int32), ('ga4', np.int32), ('fail_rate', np.float32))
+
+
+def shared_epoch(path):
+    """共享快照的版本標記前綴，所有worker由檔案路徑得到相同的值"""
+    return hashlib.sha1(os.path.realpath(path).encode('utf-8')).hexdigest()[:10]
+
+
+def _read_header(buffer):
+    magic, length = _PREFIX.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError('不是共享快照檔案')
+    header = json.loads(bytes(buffer[_PREFIX.size:_PREFIX.size + length]))
+    start = -(-(_PREFIX.size + length) // ALIGN) * ALIGN
+    return header, start
+
+
+def read_header(path):
+    """只讀取快照檔案的header，檔案不存在或格式錯誤時返回None"""
+    try:
+        with open(path, 'rb') as f:
+            prefix = f.read(_PREFIX.size)
+            if len(prefix) < _PREFIX.size:
+                return None
+            magic, length = _PREFIX.unpack(prefix)
+            if magic != MAGIC:
+                return None
+            return json.loads(f.read(length))
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(path, header, blobs):
+    """寫入臨時檔案後以 os.replace 原子替換，讀取中的worker仍可使用舊檔案的映射"""
+    layout = {}
+    offset = 0
+    for name, blob in blobs:
+        layout[name] = [offset, len(blob)]
+        offset += -(-len(blob) // ALIGN) * ALIGN
+    header = dict(header, blobs=layout)
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    start = -(-(_PREFIX.size + len(header_bytes)) // ALIGN) * ALIGN
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix='.snapshot-', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_PREFIX.pack(MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            f.write(b'\0' * (start - _PREFIX.size - len(header_bytes)))
+            for name, blob in blobs:
+                f.write(blob)
+                f.write(b'\0' * (-len(blob) % ALIGN))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+class SnapshotView:
+    """映射到記憶體的一份共享快照；CloakTable的陣列和回應內容都直接指向映射，不複製"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._map)
+        header, self._start = _read_header(self._buffer)
+        self.header = header
+        self.version = header['version']
+        self.updated_at = header['updatedAt']
+        blob = self.blob
+
+        shape = (len(header['dates']), len(header['cloaks']))
+        arrays = {
+            name: np.frombuffer(blob(name), dtype=dtype).reshape(shape)
+            for name, dtype in _ARRAYS
+        }
+        self.table = CloakTable(header['dates'], header['cloaks'], arrays['meta'], arrays['ga4'], arrays['fail_rate'])
+
+        # fmt -> 與 api_format.encode_payload 相同格式的條目
+        self.bodies = {}
+        for fmt, body in header['bodies'].items():
+            entry = {'tag': body['tag'], 'size': body['size']}
+            for encoding in body['encodings']:
+                entry[encoding] = blob(f'{fmt}.{encoding}')
+            self.bodies[fmt] = entry
+
+    def blob(self, name):
+        offset, length = self.header['blobs'][name]
+        return self._buffer[self._start + offset:self._start + offset + length]
+
+
+def publish_snapshot(path, data, updated_at, build_payloads, status=None):
+    """把解析後的快照及預先序列化的回應寫入共享檔案，返回新的版本
+
+    版本沿用檔案中的版本加1，換了負責刷新的worker也不會倒退；沒有舊檔案時以目前的
+    毫秒時間開始，刪除檔案後舊的版本標記也不會和新快照混淆。
+    build_payloads(table, version, updated_at) 返回 {格式: 回應數據}；status 為額外寫入header的欄位。
+    """
+    table = as_table(data)
+    previous = read_header(path)
+    version = previous['version'] + 1 if previous else int(time.time() * 1000)
+
+    blobs = [
+        ('meta', np.ascontiguousarray(table.meta, dtype=np.int32).tobytes()),
+        ('ga4', np.ascontiguousarray(table.ga4, dtype=np.int32).tobytes()),
+        ('fail_rate', np.ascontiguousarray(table.fail_rate, dtype=np.float32).tobytes()),
+    ]
+    bodies = {}
+    for fmt, payload in build_payloads(table, version, updated_at).items():
+        entry = encode_payload(payload)
+        encodings = [encoding for encoding in ('identity', 'br', 'gzip') if encoding in entry]
+        bodies[fmt] = {'tag': entry['tag'], 'size': entry['size'], 'encodings': encodings}
+        blobs.extend((f'{fmt}.{encoding}', entry[encoding]) for encoding in encodings)
+
+    write_snapshot(path, dict(
+        status or {},
+        version=version,
+        updatedAt=updated_at,
+        dates=table.dates,
+        cloaks=table.cloaks,
+        bodies=bodies
+    ), blobs)
+    return version
+
+
+def update_status(path, view, status):
+    """只更新header中的status欄位重寫共享快照，版本、陣列和回應不變"""
+    layout = view.header['blobs']
+    names = sorted(layout, key=lambda name: layout[name][0])
+    header = {key: value for key, value in view.header.items() if key != 'blobs'}
+    header.update(status)
+    write_snapshot(path, header, [(name, view.blob(name)) for name in names])
+
+
+def save_table(path, data, updated_at):
+    """只保存數據陣列（不含預先序列化的回應），作為重啟或上游故障時可立即使用的最後一份正確數據"""
+    return publish_snapshot(path, data, updated_at, lambda table, version, updated_at: {})
+
+
+def load_table(path):
+    """讀取 save_table 保存的快照，返回 (數據, 更新時間, 保存時間)；檔案不存在或損壞時返回None
+
+    保存時間為檔案的修改時間（epoch秒），數據經上游確認沒有變化時會更新。
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        view = SnapshotView(path)
+        saved_at = os.stat(path).st_mtime
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"讀取保存的快照失敗 {path}: {e}")
+        return None
+    return view.table, view.updated_at, saved_at
+
+
+class SharedSnapshotCache:
+    """多個worker進程共用的快照，介面與 SheetCache 相同
+
+    取得檔案鎖的worker負責以source (SheetCache) 抓取上游，每次數據變更後把快照和
+    預先序列化的回應寫入共享檔案（建議放在 /dev/shm）；所有worker從記憶體映射讀取，
+    因此上游請求和解析只發生一次，各worker也總是提供同一個版本。負責刷新的worker
+    結束後檔案鎖釋放，其他worker會接手。
+    """
+
+    def __init__(self, path, source, build_payloads, check_interval=SHARED_SNAPSHOT_CHECK_SECONDS):
+        self.path = path
+        self.source = source
+        self.build_payloads = build_payloads
+        self.check_interval = check_interval
+        self.epoch = shared_epoch(path)
+        self.is_leader = False
+
+        self._lock = threading.Lock()
+        self._lead_lock = threading.Lock()  # 請求線程和監看線程可能同時嘗試接手
+        self._write_lock = threading.Lock()  # 發布新版本和更新上游狀態不能互相覆蓋
+        self._view = None
+        self._stat = None
+        self._notified_version = None
+        self._listeners = []
+        self._watcher = None
+        self._lock_file = None
+        self._polling = False  # start() 後負責刷新的worker需要定期刷新
+        self._poll_interval = None
+        source.add_listener(self._publish)
+
+    @property
+    def version(self):
+        view = self._view
+        return view.version if view is not None else 0
+
+    @property
+    def updated_at(self):
+        view = self._view
+        return view.updated_at if view is not None else None
+
+    def add_listener(self, func, leader_only=False):
+        """註冊新版本的回呼 func(data, version)；leader_only 時只在負責刷新的worker執行（例如寫入歷史數據）"""
+        self._listeners.append((func, leader_only))
+
+    def try_lead(self):
+        """嘗試取得檔案鎖成為負責刷新的worker
+
+        已呼叫 start() 時同時啟動 source 的定期刷新，不論由請求線程還是監看線程取得檔案鎖。
+        """
+        with self._lead_lock:
+            if not self.is_leader:
+                lock_file = open(self.path + '.lock', 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    return False
+                self._lock_file = lock_file
+                self.is_leader = True
+                logger.info(f"此worker (pid {os.getpid()}) 負責刷新共享快照 {self.path}")
+            if self._polling:
+                # 已在執行時不會重複啟動
+                self.source.start(self._poll_interval)
+        return True
+
+    def _status(self):
+        """負責刷新的worker的上游狀態，寫入共享檔案的header供其他worker計算 freshness()"""
+        stale, validated_wall = self.source.validation()
+        return {'stale': stale, 'validatedWall': validated_wall}
+
+    def _publish(self, data, version):
+        """source 的回呼：寫入共享檔案後立即載入"""
+        with self._write_lock:
+            view = self._load()
+            if view is not None and view.table == as_table(data):
+                # 剛接手的worker第一次抓取到的內容與共享檔案相同，不必發布新版本
+                self._write_status(view)
+                return
+            shared_version = publish_snapshot(
+                self.path, data, self.source.updated_at, self.build_payloads, self._status()
+            )
+            logger.info(f"共享快照已發布版本 {shared_version}")
+            self._load()
+
+    def _write_status(self, view):
+        status = self._status()
+        if all(view.header.get(key) == value for key, value in status.items()):
+            return
+        update_status(self.path, view, status)
+        self._load()
+
+    def sync_status(self):
+        """負責刷新的worker在每次刷新後（包括內容沒有變化或失敗時）更新共享檔案中的上游狀態"""
+        if not self.is_leader:
+            return
+        with self._write_lock:
+            view = self._load()
+            if view is not None:
+                self._write_status(view)
+
+    def _load(self):
+        """共享檔案變更時重新映射，返回目前的 SnapshotView"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        stat_key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            if stat_key == self._stat:
+                return self._view
+        try:
+            view = SnapshotView(self.path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"讀取共享快照失敗: {e}")
+            return self._view
+
+        with self._lock:
+            if self._view is not None and view.version < self._view.version:
+                return self._view
+            self._view = view
+            self._stat = stat_key
+            notify = view.version != self._notified_version
+            self._notified_version = view.version
+        if notify:
+            self._notify(view)
+        return view
+
+    def _notify(self, view):
+        for func, leader_only in self._listeners:
+            if leader_only and not self.is_leader:
+                continue
+            try:
+                func(view.table, view.version)
+            except Exception as e:
+                logger.error(f"快取更新回呼失敗 {getattr(func, '__name__', func)}: {e}")
+
+    def snapshot(self):
+        """返回(數據, 版本, 更新時間)"""
+        if self.is_leader or (self._view is None and self.try_lead()):
+            # 冷啟動時同步抓取；沒有背景刷新時由請求觸發TTL檢查，與單進程模式相同
+            self.source.snapshot()
+            self.sync_status()
+        view = self._load()
+        if view is None and not self.is_leader:
+            # 冷啟動：等待負責刷新的worker發布第一份快照
+            deadline = time.monotonic() + self.source.timeout
+            while view is None and time.monotonic() < deadline:
+                time.sleep(0.1)
+                view = self._load()
+        if view is None:
+            return None, 0, None
+        return view.table, view.version, view.updated_at
+
+    def get(self):
+        return self.snapshot()[0]
+
+    def freshness(self):
+        """返回 (是否陳舊, 年齡秒數)：負責刷新的worker直接取自 source，其他worker讀取共享檔案header中的狀態
+
+        負責刷新的worker停止後，其他worker的年齡仍隨時間增加。
+        """
+        if self.is_leader:
+            return self.source.freshness()
+        view = self._view
+        if view is None:
+            return False, None
+        validated = view.header.get('validatedWall')
+        age = round(time.time() - validated, 3) if validated is not None else None
+        return view.header.get('stale', False), age
+
+    def encoded_body(self, version, fmt):
+        """共享快照中預先序列化的回應，版本不符時返回None"""
+        view = self._view
+        if view is None or view.version != version:
+            return None
+        return view.bodies.get(fmt)
+
+    def start(self, interval=None):
+        """啟動監看線程：定期檢查共享檔案的新版本，並在沒有worker負責刷新時接手"""
+        def watch():
+            while True:
+                try:
+                    # 已經負責刷新時也呼叫：請求線程可能在 start() 之前取得了檔案鎖
+                    self.try_lead()
+                    self._load()
+                    self.sync_status()
+                except Exception as e:
+                    logger.error(f"監看共享快照失敗: {e}")
+                time.sleep(self.check_interval)
+
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._polling = True
+            self._poll_interval = interval
+            self._watcher = threading.Thread(target=watch, name='shared-snapshot-watcher', daemon=True)
+        self._watcher.start()
+
+    def stats(self):
+        stats = self.source.stats() if self.is_leader else {}
+        stats.update({
+            'version': self.version,
+            'hasData': self._view is not None,
+            'shared': {'path': self.path, 'leader': self.is_leader, 'pid': os.getpid()}
+        })
+        return stats
@@ -0,0 +1,445 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from cloak_table import CloakTable
+from csv_stream import iter_response_lines
+from fetch_gateway import default_gateway
+from history_store import normalize_date
+from metrics import UPSTREAM_ERRORS, stage_timer
+from shared_snapshot import load_table, save_table
+
+logger = logging.getLogger(__name__)
+
+
+class _Tab:
+    """單一工作表分頁的抓取狀態"""
+
+    def __init__(self, url):
+        self.url = url
+        self.data = None          # 最後一次成功解析的結果
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.error = None
+
+    def remember_validators(self, response):
+        # 只在解析成功後記住，避免解析失敗的內容之後被304當成最新
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+
+    def conditional_headers(self):
+        headers = {}
+        if self.data is not None:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+def merge_tabs(tab_datas):
+    """把多個分頁的數據合併成一條按日期排序的序列，同一日期以後面的分頁為準"""
+    if all(isinstance(data, CloakTable) for data in tab_datas):
+        return CloakTable.merge(tab_datas)
+    merged = {}
+    order = []
+    for tab_index, data in enumerate(tab_datas):
+        sort_key = ''
+        for row_index, item in enumerate(data):
+            label = item.get('date')
+            # 無法辨識的日期沿用前一行的排序位置
+            sort_key = normalize_date(label) or sort_key
+            if label in merged:
+                merged[label].update(item)
+            else:
+                merged[label] = dict(item)
+                order.append((sort_key, tab_index, row_index, label))
+    order.sort()
+    return [merged[label] for _, _, _, label in order]
+
+
+class SheetCache:
+    """Google Sheets數據快取：TTL、條件式重新驗證、背景刷新
+
+    url可以是單一分頁或多個分頁的CSV導出URL列表；多個分頁會在線程池中並行
+    抓取和解析後合併，單一分頁失敗時沿用該分頁上一次的數據。
+
+    提供stream_parse_func時使用串流模式：邊下載邊把逐行的CSV文字交給解析器，
+    不必先把整個回應讀進記憶體。上游請求經由 FetchGateway（連線池、重試、斷路器）。
+
+    提供content_parse_func時把回應的位元組內容（例如整個XLSX活頁簿）交給它解析；
+    url也可以是本機檔案路徑，以修改時間判斷是否變更。
+
+    提供persist_path時每次成功解析後把數據保存到磁碟，重啟後先以它提供服務，
+    上游恢復前回應標記為陳舊數據 (freshness)。
+    """
+
+    def __init__(self, url, parse_func, ttl=60, timeout=10, max_workers=4, stream_parse_func=None, gateway=None,
+                 persist_path=None, content_parse_func=None):
+        urls = [url] if isinstance(url, str) else list(url)
+        self._tabs = [_Tab(u) for u in urls]
+        self.parse_func = parse_func  # 接收CSV文字，返回解析後的數據
+        self.stream_parse_func = stream_parse_func  # 接收逐行CSV文字的迭代器
+        self.content_parse_func = content_parse_func  # 接收位元組內容，優先於以上兩者
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_workers = max(1, min(max_workers, len(self._tabs)))
+        self.gateway = gateway or default_gateway
+        self.persist_path = persist_path
+
+        self._lock = threading.Lock()          # 保護快取狀態
+        self._refresh_lock = threading.Lock()  # 同一時間只允許一個刷新
+        self._data = None
+        self._validated_at = None  # 最後一次確認數據為最新的時間 (monotonic)
+        self._validated_wall = None  # 同上，以epoch秒表示，可跨進程重啟計算數據年齡
+        self._upstream_failed = False  # 最近一次刷新所有分頁都失敗
+        self._warm_started = False
+        self._refreshing = False
+        self._poller = None
+        self._listeners = []
+        self.version = 0         # 每次數據內容變更時遞增
+        self.updated_at = None   # 數據內容最後變更的時間 (ISO格式)
+
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'staleHits': 0,
+            'refreshes': 0,
+            'notModified': 0,
+            'unchanged': 0,
+            'errors': 0,
+        }
+        self._last_refresh_seconds = None
+
+    @property
+    def urls(self):
+        return [tab.url for tab in self._tabs]
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def _age(self):
+        if self._validated_at is None:
+            return None
+        return time.monotonic() - self._validated_at
+
+    def get(self):
+        """返回解析後的數據；過期時返回舊數據並在背景刷新"""
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """返回(數據, 版本, 更新時間)，三者保證屬於同一份快照"""
+        with self._lock:
+            current = (self._data, self.version, self.updated_at)
+            age = self._age()
+
+        if current[0] is None and self.warm_start():
+            # 先以磁碟上的快照回應，下面會在背景向上游確認
+            with self._lock:
+                current = (self._data, self.version, self.updated_at)
+
+        if current[0] is None:
+            # 冷啟動：沒有任何數據時只能同步抓取
+            self._count('misses')
+            self.refresh()
+            with self._lock:
+                return self._data, self.version, self.updated_at
+
+        if age is not None and age <= self.ttl:
+            self._count('hits')
+            return current
+
+        self._count('staleHits')
+        # 定期刷新線程負責所有上游請求，請求端不再各自觸發刷新
+        if self._poller is None:
+            self.refresh_async()
+        return current
+
+    def warm_start(self):
+        """載入persist_path中上次成功解析的數據（只嘗試一次），之後的刷新成功前視為陳舊數據"""
+        with self._refresh_lock:
+            with self._lock:
+                if self.persist_path is None or self._warm_started or self._data is not None:
+                    return False
+                self._warm_started = True
+            loaded = load_table(self.persist_path)
+            if loaded is None:
+                return False
+            data, updated_at, saved_at = loaded
+            with self._lock:
+                self._data = data
+                self.version += 1
+                self.updated_at = updated_at
+                self._validated_wall = saved_at
+        logger.info(f"已載入保存的快照 {self.persist_path}，共 {len(data)} 個日期")
+        self._notify(data)
+        return True
+
+    def freshness(self):
+        """返回 (是否陳舊, 數據年齡秒數)
+
+        數據來自磁碟且尚未向上游確認，或最近一次刷新所有分頁都失敗時為陳舊；
+        年齡為距離上一次確認數據為最新的時間。
+        """
+        stale, validated = self.validation()
+        age = round(time.time() - validated, 3) if validated is not None else None
+        return stale, age
+
+    def validation(self):
+        """返回 (是否陳舊, 最後一次確認數據為最新的epoch秒)，供共享快照發布給其他進程"""
+        with self._lock:
+            stale = self._data is not None and (self._validated_at is None or self._upstream_failed)
+            return stale, self._validated_wall
+
+    def _persist(self, data, changed):
+        """保存數據，內容沒有變化時只更新檔案的修改時間"""
+        if self.persist_path is None:
+            return
+        try:
+            if changed or not os.path.exists(self.persist_path):
+                save_table(self.persist_path, data, self.updated_at)
+            else:
+                os.utime(self.persist_path)
+        except Exception as e:
+            logger.error(f"保存快照失敗 {self.persist_path}: {e}")
+
+    def refresh_async(self):
+        """在背景線程刷新，已有刷新進行中則略過"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        thread = threading.Thread(target=self._refresh_in_background, daemon=True)
+        thread.start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def refresh(self, force=False):
+        """抓取並解析上游數據，至少一個分頁成功時返回True"""
+        with self._refresh_lock:
+            # 等待鎖期間其他線程可能已經刷新過
+            with self._lock:
+                age = self._age()
+                if not force and self._data is not None and age is not None and age <= self.ttl:
+                    return True
+
+            started = time.monotonic()
+            try:
+                if len(self._tabs) == 1:
+                    results = [self._refresh_tab(self._tabs[0])]
+                else:
+                    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                        results = list(executor.map(self._refresh_tab, self._tabs))
+                return self._apply(results)
+            finally:
+                self._last_refresh_seconds = time.monotonic() - started
+
+    def _refresh_tab(self, tab):
+        """抓取並解析單一分頁，返回 'changed' / 'notModified' / 'unchanged' / 'error'"""
+        try:
+            return self._fetch_and_parse(tab)
+        except Exception as e:
+            tab.error = str(e)
+            UPSTREAM_ERRORS.inc()
+            logger.error(f"刷新Google Sheets快取失敗 {tab.url}: {e}")
+            return 'error'
+
+    def _fetch_and_parse(self, tab):
+        logger.debug(f"正在獲取Google Sheets數據: {tab.url}")
+        if not tab.url.startswith(('http://', 'https://')):
+            return self._read_local(tab)
+        if self.stream_parse_func is not None and self.content_parse_func is None:
+            return self._stream_and_parse(tab)
+
+        # 解碼和解析由parse_func自行量測
+        with stage_timer('fetch'):
+            response = self.gateway.get(tab.url, headers=tab.conditional_headers(), timeout=self.timeout)
+
+        if response.status_code == 304:
+            tab.error = None
+            logger.debug("上游數據未變更 (304)")
+            return 'notModified'
+
+        response.raise_for_status()
+
+        # 上游沒有ETag/Last-Modified時，以內容雜湊判斷是否需要重新解析
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        if tab.data is not None and content_hash == tab.content_hash:
+            tab.remember_validators(response)
+            tab.error = None
+            logger.debug("上游內容雜湊相同，略過解析")
+            return 'unchanged'
+
+        if self.content_parse_func is not None:
+            data = self.content_parse_func(response.content)
+        else:
+            data = self.parse_func(response.text)
+        if not data:
+            raise ValueError('解析結果為空')
+
+        tab.content_hash = content_hash
+        tab.remember_validators(response)
+        tab.error = None
+        # 內容位元組不同但解析結果相同（例如每次重新打包的XLSX），不發布新版本
+        if data == tab.data:
+            return 'unchanged'
+        tab.data = data
+        return 'changed'
+
+    def _read_local(self, tab):
+        """讀取本機檔案；修改時間和大小沒有變化時不重新解析"""
+        st = os.stat(tab.url)
+        stamp = f'{st.st_mtime_ns}-{st.st_size}'
+        if tab.data is not None and stamp == tab.etag:
+            tab.error = None
+            return 'notModified'
+
+        with stage_timer('fetch'):
+            with open(tab.url, 'rb') as f:
+                content = f.read()
+        if self.content_parse_func is not None:
+            data = self.content_parse_func(content)
+        else:
+            data = self.parse_func(content.decode('utf-8-sig'))
+        if not data:
+            raise ValueError('解析結果為空')
+
+        tab.etag = stamp
+        tab.error = None
+        if data == tab.data:
+            return 'unchanged'
+        tab.data = data
+        return 'changed'
+
+    def _stream_and_parse(self, tab):
+        """串流下載並同時解析；解析器提前結束時不會讀取剩餘的內容"""
+        # fetch只計算到收到回應標頭；其餘內容的下載與解析同時進行，計入parse
+        with stage_timer('fetch'):
+            response = self.gateway.get(tab.url, headers=tab.conditional_headers(), timeout=self.timeout, stream=True)
+        with response:
+            if response.status_code == 304:
+                tab.error = None
+                logger.debug("上游數據未變更 (304)")
+                return 'notModified'
+
+            response.raise_for_status()
+            data = self.stream_parse_func(iter_response_lines(response))
+
+        if not data:
+            raise ValueError('解析結果為空')
+
+        tab.remember_validators(response)
+        tab.error = None
+        # 串流模式無法在解析前比對內容雜湊，改為比對解析結果
+        if data == tab.data:
+            return 'unchanged'
+        tab.data = data
+        return 'changed'
+
+    def _apply(self, results):
+        """根據各分頁結果更新快照"""
+        failed = results.count('error')
+        if failed:
+            self._count('errors', failed)
+        if failed == len(results):
+            with self._lock:
+                self._upstream_failed = True
+            return False
+
+        if 'changed' in results:
+            tab_datas = [tab.data for tab in self._tabs if tab.data is not None]
+            data = tab_datas[0] if len(self._tabs) == 1 else merge_tabs(tab_datas)
+            if self._validated_at is None and data == self._data:
+                # 第一次抓取到的內容與啟動時載入的快照相同，沿用原本的版本
+                results = ['unchanged']
+
+        if 'changed' not in results:
+            with self._lock:
+                self._validated_at = time.monotonic()
+                self._validated_wall = time.time()
+                self._upstream_failed = False
+                data = self._data
+            self._count('notModified', results.count('notModified'))
+            self._count('unchanged', results.count('unchanged'))
+            self._persist(data, changed=False)
+            return True
+
+        with self._lock:
+            self._data = data
+            self.version += 1
+            self.updated_at = datetime.now().isoformat()
+            self._validated_at = time.monotonic()
+            self._validated_wall = time.time()
+            self._upstream_failed = False
+            self._counters['refreshes'] += 1
+        logger.info(f"Google Sheets快取已更新，共 {len(data)} 個日期")
+        self._persist(data, changed=True)
+        self._notify(data)
+        return True
+
+    def add_listener(self, func):
+        """註冊數據更新時的回呼 func(data, version)，用於預先計算衍生數據"""
+        self._listeners.append(func)
+
+    def _notify(self, data):
+        version = self.version
+        for func in self._listeners:
+            try:
+                func(data, version)
+            except Exception as e:
+                logger.error(f"快取更新回呼失敗 {getattr(func, '__name__', func)}: {e}")
+
+    def start(self, interval=None):
+        """啟動定期刷新的背景線程，讓請求永遠不必等待上游
+
+        啟動後上游請求只由這個線程發出，請求量固定，與同時連線的客戶端數無關。
+        """
+        interval = interval or self.ttl
+
+        def poll():
+            while True:
+                try:
+                    self.refresh(force=True)
+                except Exception as e:
+                    logger.error(f"定期刷新失敗: {e}")
+                time.sleep(interval)
+
+        with self._lock:
+            if self._poller is not None:
+                return
+            self._poller = threading.Thread(target=poll, name='sheet-cache-refresher', daemon=True)
+        self._poller.start()
+
+    def stats(self):
+        """快取命中/未命中/年齡等計數，用於調整TTL"""
+        with self._lock:
+            stats = dict(self._counters)
+            age = self._age()
+            stats['ageSeconds'] = round(age, 3) if age is not None else None
+            stats['hasData'] = self._data is not None
+            stats['refreshing'] = self._refreshing
+            stats['polling'] = self._poller is not None
+            stats['upstreamFailed'] = self._upstream_failed
+        stats['version'] = self.version
+        stats['ttlSeconds'] = self.ttl
+        stats['lastRefreshSeconds'] = (
+            round(self._last_refresh_seconds, 3) if self._last_refresh_seconds is not None else None
+        )
+        stats['upstream'] = self.gateway.stats()
+        if len(self._tabs) > 1:
+            stats['tabs'] = [
+                {'url': tab.url, 'hasData': tab.data is not None, 'error': tab.error}
+                for tab in self._tabs
+            ]
+        return stats
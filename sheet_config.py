@@ -0,0 +1,121 @@
+"""Google Sheets數據來源的設定、解析函數及建立 SheetCache 的工廠
+
+app_new 和 build_static 共用；匯入時不會建立任何快取、監聽器或數據庫。
+"""
+import csv
+import io
+import itertools
+import logging
+import os
+
+from column_plan import get_plan, plan_from_series
+from fast_parser import parse_rows_with_plan
+from metrics import stage_timer
+from sheet_cache import SheetCache
+from sheet_tabs import resolve_tab_urls, workbook_url
+from xlsx_workbook import parse_workbook
+
+logger = logging.getLogger(__name__)
+
+# Google Sheets URL (CSV export)
+SPREADSHEET_ID = "147oXFJ07Hmrc1GoUKlq4dSrvKXYJ6u4to_LiJ7GC_Mg"
+DEFAULT_TAB_GID = "599397897"
+
+# 每個月份一個分頁：逗號分隔的gid列表，或 auto 自動尋找所有分頁
+SHEET_TAB_GIDS = os.environ.get('SHEET_TAB_GIDS', DEFAULT_TAB_GID)
+# 抓取方式：csv 每個分頁各自導出CSV；xlsx 一次下載整個活頁簿並解析所有分頁
+SHEET_SOURCE = os.environ.get('SHEET_SOURCE', 'csv')
+# 改為讀取本機的XLSX檔案（設定時使用xlsx解析）
+SHEET_XLSX_PATH = os.environ.get('SHEET_XLSX_PATH') or None
+# 只讀取活頁簿中的這些分頁（逗號分隔的分頁名稱，預設全部）
+SHEET_XLSX_SHEETS = [name.strip() for name in os.environ.get('SHEET_XLSX_SHEETS', '').split(',') if name.strip()]
+# 直接指定導出URL（逗號分隔，例如負載測試的本機替身），設定時取代由 SPREADSHEET_ID 組成的URL
+SHEET_EXPORT_URLS = [url.strip() for url in os.environ.get('SHEET_EXPORT_URLS', '').split(',') if url.strip()]
+# 同時抓取分頁的最大線程數
+SHEET_FETCH_WORKERS = int(os.environ.get('SHEET_FETCH_WORKERS', '4'))
+
+# 數據行範圍 (A3:A33)，之前的行為標題
+FIRST_DATA_ROW = 2
+LAST_DATA_ROW = 33
+
+# 標題中找不到斗篷名稱時使用的欄位位置 (與 parse_date_row 相同)
+# JB從C欄 (索引2) 開始，順序為 GA4 / fail rate / meta；JW從AP (41)、JG從CE (81) 開始
+SERIES_LAYOUT = {
+    'jb': {'cloaks': [f'jt{n:02d}' for n in range(1, 14)], 'start_col': 2, 'order': ('ga4', 'failRate', 'meta')},
+    'jw': {'cloaks': [f'jtw{n:02d}' for n in range(1, 14)], 'start_col': 41},
+    'jg': {'cloaks': [f'jtg{n:02d}' for n in range(1, 14)], 'start_col': 81},
+}
+FALLBACK_PLAN = plan_from_series(SERIES_LAYOUT)
+
+# 串流模式：邊下載邊解析，記憶體只需保存一行原始數據
+SHEET_STREAMING = os.environ.get('SHEET_STREAMING', '1') == '1'
+
+# 快取存活時間（秒），過期後先返回舊數據再於背景刷新
+SHEET_CACHE_TTL = int(os.environ.get('SHEET_CACHE_TTL', '60'))
+
+# 每次成功解析後保存的快照（記憶體映射的二進位格式），啟動時先載入，上游無法連線時標記為陳舊數據提供；設為空字串停用
+SNAPSHOT_PERSIST_PATH = os.environ.get('SNAPSHOT_PERSIST_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'last_snapshot.bin')) or None
+
+USE_XLSX = SHEET_SOURCE == 'xlsx' or SHEET_XLSX_PATH is not None
+
+def parse_csv_rows(rows):
+    """解析CSV行的可迭代對象（逐行讀取，讀到第33行即停止）"""
+    try:
+        # csv.reader的解碼與解析同時進行，一併計入parse
+        with stage_timer('parse'):
+            rows = iter(rows)
+            # 標題行決定欄位計劃，相同標題重用已編譯的計劃
+            plan = get_plan(list(itertools.islice(rows, FIRST_DATA_ROW)), FALLBACK_PLAN)
+            data_rows = itertools.islice(rows, LAST_DATA_ROW - FIRST_DATA_ROW)  # A3:A33 對應數據
+            result_data = parse_rows_with_plan(data_rows, plan)
+        
+        logger.info(f"成功解析 {len(result_data)} 個日期的數據")
+        if result_data:
+            logger.debug(f"返回數據: {len(result_data)} 個日期，每個日期有 {len(result_data.cloaks)} 個斗篷")
+        
+        return result_data
+        
+    except Exception as e:
+        logger.error(f"解析Google Sheets數據時發生錯誤: {e}")
+        return []
+
+def parse_google_sheets_data(csv_content):
+    """解析Google Sheets的CSV數據"""
+    # 使用csv.reader處理CSV數據
+    return parse_csv_rows(csv.reader(io.StringIO(csv_content)))
+
+def parse_csv_stream(lines):
+    """串流模式：邊下載邊解析逐行到達的CSV文字"""
+    return parse_csv_rows(csv.reader(lines))
+
+def parse_xlsx_workbook(content):
+    """解析整個XLSX活頁簿：openpyxl唯讀串流逐行讀取，儲存格與CSV使用相同的數值轉換"""
+    try:
+        with stage_timer('parse'):
+            result_data = parse_workbook(content, FALLBACK_PLAN, FIRST_DATA_ROW, LAST_DATA_ROW, SHEET_XLSX_SHEETS)
+        logger.info(f"成功解析 {len(result_data)} 個日期的數據")
+        return result_data
+    except Exception as e:
+        logger.error(f"解析XLSX活頁簿時發生錯誤: {e}")
+        return []
+
+def sheet_urls():
+    """依設定決定抓取的URL：直接指定的導出URL、整個活頁簿，或每個月份分頁的CSV"""
+    if SHEET_EXPORT_URLS:
+        return SHEET_EXPORT_URLS
+    if USE_XLSX:
+        # 一個請求取代每個分頁各自的CSV請求
+        return [SHEET_XLSX_PATH or workbook_url(SPREADSHEET_ID)]
+    return resolve_tab_urls(SPREADSHEET_ID, SHEET_TAB_GIDS, DEFAULT_TAB_GID)
+
+def create_sheet_source(persist_path=SNAPSHOT_PERSIST_PATH):
+    """依設定建立 SheetCache，不註冊任何監聽器"""
+    return SheetCache(
+        sheet_urls(),
+        parse_google_sheets_data,
+        stream_parse_func=parse_csv_stream if SHEET_STREAMING else None,
+        content_parse_func=parse_xlsx_workbook if USE_XLSX else None,
+        ttl=SHEET_CACHE_TTL,
+        max_workers=SHEET_FETCH_WORKERS,
+        persist_path=persist_path
+    )
@@ -0,0 +1,51 @@
+import logging
+import re
+
+from fetch_gateway import default_gateway
+
+logger = logging.getLogger(__name__)
+
+EXPORT_URL = "https://docs.google.com/spreadsheets/d/{spreadsheet_id}/export?format={fmt}&gid={gid}"
+WORKBOOK_URL = "https://docs.google.com/spreadsheets/d/{spreadsheet_id}/export?format={fmt}"
+HTMLVIEW_URL = "https://docs.google.com/spreadsheets/d/{spreadsheet_id}/htmlview"
+
+_GID_PATTERN = re.compile(r'gid[=:]\s*"?(\d+)')
+
+
+def export_url(spreadsheet_id, gid, fmt='csv'):
+    """單一分頁的導出URL"""
+    return EXPORT_URL.format(spreadsheet_id=spreadsheet_id, fmt=fmt, gid=gid)
+
+
+def workbook_url(spreadsheet_id, fmt='xlsx'):
+    """整個活頁簿（所有分頁）的導出URL"""
+    return WORKBOOK_URL.format(spreadsheet_id=spreadsheet_id, fmt=fmt)
+
+
+def discover_gids(spreadsheet_id, timeout=10):
+    """從公開的htmlview頁面找出所有分頁的gid（依出現順序）"""
+    response = default_gateway.get(HTMLVIEW_URL.format(spreadsheet_id=spreadsheet_id), timeout=timeout)
+    response.raise_for_status()
+    gids = list(dict.fromkeys(_GID_PATTERN.findall(response.text)))
+    logger.info(f"找到 {len(gids)} 個分頁: {gids}")
+    return gids
+
+
+def resolve_tab_urls(spreadsheet_id, gids_setting, default_gid):
+    """根據設定返回所有分頁的CSV導出URL
+
+    gids_setting為逗號分隔的gid，或 'auto' 表示自動尋找；
+    自動尋找失敗時退回預設分頁。
+    """
+    setting = (gids_setting or '').strip()
+    if setting.lower() == 'auto':
+        try:
+            gids = discover_gids(spreadsheet_id)
+        except Exception as e:
+            logger.error(f"自動尋找分頁失敗，使用預設分頁: {e}")
+            gids = []
+    else:
+        gids = [gid.strip() for gid in setting.split(',') if gid.strip()]
+
+    gids = gids or [default_gid]
+    return [export_url(spreadsheet_id, gid) for gid in gids]
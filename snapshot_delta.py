@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from cloak_table import as_table
+
+# 最多保留幾個版本的快照供 since 查詢，更舊的版本直接返回完整數據
+DELTA_HISTORY_SIZE = 32
+
+
+def diff_tables(old, new):
+    """比較兩份快照，返回 (新快照中有變化的格子, 被移除的日期)
+
+    格子為 [日期, 斗篷, meta, ga4, failRate]；新增的日期整行都算變化。
+    斗篷組成不同時返回None，應改為傳送完整數據。
+    """
+    if old.cloaks != new.cloaks:
+        return None
+
+    # 新快照每個日期在舊快照中的行，新增的日期為-1
+    rows_old = np.array([old.date_index.get(label, -1) for label in new.dates], dtype=np.intp)
+
+    changed = np.ones((len(new.dates), len(new.cloaks)), dtype=bool)
+    present = rows_old >= 0
+    if present.any():
+        src = rows_old[present]
+        dst = np.flatnonzero(present)
+        changed[dst] = (
+            (old.meta[src] != new.meta[dst])
+            | (old.ga4[src] != new.ga4[dst])
+            | (old.fail_rate[src] != new.fail_rate[dst])
+        )
+
+    fail_rate = new.fail_rate_values()
+    cells = [
+        [new.dates[d], new.cloaks[c], int(new.meta[d, c]), int(new.ga4[d, c]), float(fail_rate[d, c])]
+        for d, c in zip(*np.nonzero(changed))
+    ]
+    removed = [label for label in old.dates if label not in new.date_index]
+    return cells, removed
+
+
+class DeltaLog:
+    """保存最近幾個版本的快照，計算任意舊版本到最新版本的差異
+
+    版本標記為「進程代號-版本號」，服務重啟後舊的標記不會被誤認為新快照的版本。
+    多個worker共用快照時傳入相同的epoch，各worker發出的標記可以互相使用。
+    """
+
+    def __init__(self, size=DELTA_HISTORY_SIZE, epoch=None):
+        self.size = size
+        self.epoch = epoch or format(int(time.time() * 1000), 'x')
+        self._tables = OrderedDict()  # 版本 -> CloakTable
+        self._deltas = {}  # (舊版本, 新版本) -> 差異，多個客戶端通常停在同一版本
+        self._lock = threading.Lock()
+
+    def token(self, version):
+        return f'{self.epoch}-{version}'
+
+    def parse_token(self, token):
+        """返回標記對應的版本號；其他進程或格式錯誤的標記返回None"""
+        epoch, sep, version = str(token).rpartition('-')
+        if not sep or epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def record(self, data, version):
+        """SheetCache 的回呼，記錄每個版本的快照"""
+        with self._lock:
+            self._tables[version] = as_table(data)
+            while len(self._tables) > self.size:
+                self._tables.popitem(last=False)
+            self._deltas.clear()
+
+    def delta(self, since_token, data, version):
+        """返回 since 到目前版本的差異 {'cells', 'removed', 'dates'}；無法計算時返回None（應傳送完整數據）"""
+        since = self.parse_token(since_token)
+        if since is None:
+            return None
+        if since == version:
+            return {'cells': [], 'removed': [], 'dates': None}
+        with self._lock:
+            old = self._tables.get(since)
+            cached = self._deltas.get((since, version))
+        if cached is not None or old is None:
+            return cached
+
+        new = as_table(data)
+        result = diff_tables(old, new)
+        if result is None:
+            return None
+        cells, removed = result
+        delta = {
+            'cells': cells,
+            'removed': removed,
+            # 日期順序有變化時一併傳送，客戶端據此重新排列
+            'dates': new.dates if new.dates != old.dates else None
+        }
+        with self._lock:
+            self._deltas[(since, version)] = delta
+        return delta
@@ -0,0 +1,129 @@
+import threading
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from cloak_table import as_table
+from history_store import cloak_series
+
+
+def _prefix(values):
+    """沿日期的前綴和，第0行為0：區間 [l, r] 的總和為 p[r+1] - p[l]"""
+    out = np.zeros((values.shape[0] + 1, values.shape[1]), dtype=values.dtype)
+    np.cumsum(values, axis=0, out=out[1:])
+    return out
+
+
+def _sparse_table(values, op):
+    """稀疏表：第k層的第i行為 [i, i+2^k) 的 op 結果，任意區間以兩個重疊的區塊O(1)求得"""
+    levels = [values]
+    k = 1
+    while (1 << k) <= values.shape[0]:
+        previous = levels[-1]
+        half = 1 << (k - 1)
+        length = values.shape[0] - (1 << k) + 1
+        levels.append(op(previous[:length], previous[half:half + length]))
+        k += 1
+    return levels
+
+
+class StatsIndex:
+    """一份快照的範圍統計索引，建立一次後任意 (斗篷集合, 日期區間) 的統計只需 O(斗篷數)
+
+    每個斗篷保存有數據的格子數、fail rate、meta、GA4 的前綴和，以及 fail rate
+    最大/最小值的稀疏表。與儀表板相同，meta、GA4、fail rate 全為0的格子不計入。
+    """
+
+    def __init__(self, data, iso_dates=None):
+        table = as_table(data)
+        self.dates = list(table.dates)
+        self.iso_dates = iso_dates  # 已排序的ISO日期，提供時才能以日期區間查詢
+        self.cloaks = list(table.cloaks)
+        self.cloak_index = table.cloak_index
+
+        meta = table.meta.astype(np.int64)
+        ga4 = table.ga4.astype(np.int64)
+        rate = table.fail_rate_values()
+        active = (meta > 0) | (ga4 > 0) | (rate > 0)
+
+        self.count = _prefix(active.astype(np.int64))
+        # fail rate 只有兩位小數，以百分之一為單位的整數累加，區間相減不會有浮點誤差
+        self.rate_sum = _prefix(np.where(active, np.rint(rate * 100), 0).astype(np.int64))
+        self.meta_sum = _prefix(np.where(active, meta, 0))
+        self.ga4_sum = _prefix(np.where(active, ga4, 0))
+        self.max_table = _sparse_table(np.where(active, rate, -np.inf), np.maximum)
+        self.min_table = _sparse_table(np.where(active, rate, np.inf), np.minimum)
+
+    def default_cloaks(self):
+        """儀表板「全部」使用的斗篷，不包括 jb/jw/jg 產品層級的數據"""
+        return [cloak for cloak in self.cloaks if cloak_series(cloak) != cloak]
+
+    def date_range(self, date_from=None, date_to=None):
+        """把ISO日期區間轉成行區間 (l, r)，沒有任何日期時返回None"""
+        if date_from is None and date_to is None:
+            l, r = 0, len(self.dates) - 1
+        else:
+            if self.iso_dates is None:
+                raise ValueError('此索引不支援日期區間查詢')
+            l = bisect_left(self.iso_dates, date_from) if date_from else 0
+            r = bisect_right(self.iso_dates, date_to) - 1 if date_to else len(self.iso_dates) - 1
+        return (l, r) if l <= r else None
+
+    def query(self, cloaks, date_from=None, date_to=None):
+        """返回指定斗篷及日期區間的平均/最大/最小 fail rate 及總量"""
+        columns = np.array([self.cloak_index[c] for c in cloaks if c in self.cloak_index], dtype=np.intp)
+        result = {
+            'cells': 0,
+            'avgFailRate': 0.0,
+            'maxFailRate': 0.0,
+            'minFailRate': 0.0,
+            'totalVolume': 0,
+            'totalGa4': 0,
+            'weightedFailRate': 0.0,
+            'unknownCloaks': [c for c in cloaks if c not in self.cloak_index]
+        }
+        bounds = self.date_range(date_from, date_to)
+        if bounds is None or len(columns) == 0:
+            return result
+        l, r = bounds
+
+        def total(prefix):
+            return prefix[r + 1, columns].sum() - prefix[l, columns].sum()
+
+        cells = int(total(self.count))
+        if cells == 0:
+            return result
+        k = (r - l + 1).bit_length() - 1
+        upper = np.maximum(self.max_table[k][l, columns], self.max_table[k][r - (1 << k) + 1, columns]).max()
+        lower = np.minimum(self.min_table[k][l, columns], self.min_table[k][r - (1 << k) + 1, columns]).min()
+        meta = int(total(self.meta_sum))
+        ga4 = int(total(self.ga4_sum))
+        result.update({
+            'cells': cells,
+            'avgFailRate': round(int(total(self.rate_sum)) / 100 / cells, 2),
+            'maxFailRate': round(float(upper), 2),
+            'minFailRate': round(float(lower), 2),
+            'totalVolume': meta,
+            'totalGa4': ga4,
+            'weightedFailRate': round((1 - ga4 / meta) * 100, 2) if meta > 0 else 0.0
+        })
+        return result
+
+
+class StatsIndexCache:
+    """保存最新的 StatsIndex，鍵（快照版本或歷史數據修訂號）變更時重建"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._index = None
+
+    def get(self, key, build):
+        with self._lock:
+            if self._index is not None and self._key == key:
+                return self._index
+        index = build()
+        with self._lock:
+            self._key = key
+            self._index = index
+        return index
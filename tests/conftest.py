@@ -0,0 +1,36 @@
+import csv
+import io
+import itertools
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+# 匯入 app_new / app_fixed 時不寫入正式的歷史數據庫和快照，也不啟動背景刷新
+os.environ.setdefault('HISTORY_DB_PATH', os.path.join(tempfile.mkdtemp(), 'history.sqlite3'))
+os.environ.setdefault('SNAPSHOT_PERSIST_PATH', '')
+os.environ.setdefault('SHEET_BACKGROUND_POLL', '0')
+
+from column_plan import get_plan, plan_from_series
+from fast_parser import parse_rows_with_plan
+from sheets_standin import SheetsStandIn
+from synthetic_sheet import HEADER_ROWS, series_config
+
+
+def parse_csv(text):
+    """以欄位計劃解析合成表格的CSV，與 app_new 的解析方式相同"""
+    rows = csv.reader(io.StringIO(text))
+    plan = get_plan(list(itertools.islice(rows, HEADER_ROWS)), plan_from_series(series_config()))
+    return parse_rows_with_plan(rows, plan)
+
+
+@pytest.fixture
+def standin():
+    """本機的Google Sheets替身，測試結束後關閉"""
+    server = SheetsStandIn(days=7).start()
+    yield server
+    server.stop()
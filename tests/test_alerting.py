@@ -0,0 +1,111 @@
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+from alerting import AlertEngine
+from cloak_table import CloakTable
+
+
+class WebhookReceiver:
+    """本機的webhook接收端，記錄收到的每個POST"""
+
+    def __init__(self):
+        self.posts = []
+        self.received = threading.Condition()
+        receiver = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                with receiver.received:
+                    receiver.posts.append(json.loads(body))
+                    receiver.received.notify_all()
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/hook'
+
+    def wait(self, count, timeout=5):
+        with self.received:
+            self.received.wait_for(lambda: len(self.posts) >= count, timeout)
+            return list(self.posts)
+
+
+@pytest.fixture
+def receiver():
+    receiver = WebhookReceiver()
+    yield receiver
+    receiver.server.shutdown()
+    receiver.server.server_close()
+
+
+def table(days):
+    """每天兩個斗篷的數據，days為 [(jt01的ga4, jt02的ga4), ...]，meta固定為100"""
+    ga4 = [list(day) for day in days]
+    meta = [[100, 100] for _ in days]
+    fail_rate = [[100 - g for g in day] for day in ga4]
+    return CloakTable([f'8/{d + 1}' for d in range(len(days))], ['jt01', 'jt02'], meta, ga4, fail_rate)
+
+
+def engine(url):
+    return AlertEngine(groups={}, fail_rate_threshold=50, min_meta=10, webhook_url=url)
+
+
+def test_webhook_posts_each_new_alert_once(receiver):
+    alerts = engine(receiver.url)
+    # 8/2 的 jt02 fail rate 80% 超過門檻
+    data = table([(90, 90), (90, 20), (90, 90)])
+    fresh = alerts.update(data)
+    assert [(a['date'][5:], a['name']) for a in fresh] == [('08-02', 'jt02')]
+
+    posts = receiver.wait(1)
+    assert len(posts) == 1
+    assert [(a['date'], a['name']) for a in posts[0]['alerts']] == [(fresh[0]['date'], 'jt02')]
+
+    # 相同的快照再次更新：已通知過，不再發送
+    assert alerts.update(data) == []
+    time.sleep(0.3)
+    assert len(receiver.posts) == 1
+
+    # 新的日期出現新的告警：只發送新的那一筆
+    fresh = alerts.update(table([(90, 90), (90, 20), (90, 90), (30, 90)]))
+    assert [a['name'] for a in fresh] == ['jt01']
+    posts = receiver.wait(2)
+    assert len(posts) == 2
+    assert [a['name'] for a in posts[1]['alerts']] == ['jt01']
+
+
+def test_webhook_skips_alerts_already_marked_notified(receiver):
+    alerts = engine(receiver.url)
+    data = table([(90, 90), (90, 20), (90, 90)])
+    # 例如另一次更新已經標記過這筆告警
+    alerts._mark_notified([{'date': alert['date'], 'name': alert['name']} for alert in engine(None).update(data)])
+    assert alerts.update(data) == []
+    time.sleep(0.3)
+    assert receiver.posts == []
+
+
+@pytest.mark.parametrize('limit', ['0', '-1', 'abc'])
+def test_alerts_endpoint_rejects_invalid_limit(limit):
+    import app_new
+
+    response = app_new.app.test_client().get(f'/api/alerts?limit={limit}')
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_alerts_limit():
+    alerts = engine(None)
+    alerts.update(table([(90, 90), (20, 20), (90, 90)]))
+    assert len(alerts.alerts()) == 2
+    assert len(alerts.alerts(limit=1)) == 1
+    with pytest.raises(ValueError):
+        alerts.alerts(limit=-1)
@@ -0,0 +1,18 @@
+import os
+
+import build_static
+from sheet_cache import SheetCache
+
+from conftest import parse_csv
+
+
+def test_unchanged_data_writes_no_new_snapshot(standin, tmp_path):
+    first = build_static.build(str(tmp_path), source=SheetCache(standin.url('csv'), parse_csv))
+    written = {name: os.path.getmtime(tmp_path / name) for name in os.listdir(tmp_path)}
+    assert first['file'] in written and first['lastUpdate']
+
+    # 新的快取有新的 updated_at，但數據相同
+    second = build_static.build(str(tmp_path), source=SheetCache(standin.url('csv'), parse_csv))
+    assert second == first
+    assert {name: os.path.getmtime(tmp_path / name) for name in os.listdir(tmp_path)} == written
+
@@ -0,0 +1,59 @@
+import pytest
+
+import app_new
+from data_query import DataQueryCache
+from history_store import normalize_date
+from sheet_cache import SheetCache
+
+
+@pytest.fixture
+def client(standin, monkeypatch):
+    """/api/data 讀取替身的CSV；篩選索引換成新的，不與其他測試的版本混淆"""
+    monkeypatch.setattr(app_new, 'sheet_cache', SheetCache(standin.url('csv'), app_new.parse_google_sheets_data))
+    monkeypatch.setattr(app_new, 'data_queries', DataQueryCache())
+    return app_new.app.test_client()
+
+
+def get(client, query):
+    response = client.get(f'/api/data?{query}')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['success'], body
+    return body
+
+
+def test_cloak_filter_and_field_projection(client):
+    body = get(client, 'cloaks=jt02,jt01-jt02,jt99&fields=failRate')
+    assert body['unknownCloaks'] == ['jt99']
+    assert body['filter']['cloaks'] == ['jt01', 'jt02', 'jt99']
+    assert len(body['data']) == 7
+    for item in body['data']:
+        assert sorted(item) == ['date', 'jt01', 'jt02']
+        assert list(item['jt01']) == ['failRate']
+
+    # 只有不存在的斗篷時返回空的斗篷集合，而不是全部
+    body = get(client, 'cloaks=jt99')
+    assert body['unknownCloaks'] == ['jt99']
+    assert all(list(item) == ['date'] for item in body['data'])
+
+
+def test_series_pattern_and_date_filters(client):
+    full = get(client, '')['data']
+    dates = [item['date'] for item in full]
+
+    body = get(client, 'series=jw&format=columnar&fields=meta,ga4')
+    assert sorted(body['data']['cloaks']) == [f'jtw{n:02d}' for n in range(1, 14)]
+    assert all(sorted(values) == ['ga4', 'meta'] for values in body['data']['cloaks'].values())
+
+    start, end = normalize_date(dates[2]), normalize_date(dates[4])
+    body = get(client, f'pattern=jtg1*&start={start}&end={end}')
+    assert [item['date'] for item in body['data']] == dates[2:5]
+    assert sorted(body['data'][0]) == ['date', 'jtg10', 'jtg11', 'jtg12', 'jtg13']
+    assert body['data'][0]['jtg10'] == full[2]['jtg10']
+
+
+@pytest.mark.parametrize('query', ['series=jx', 'fields=volume', 'start=2024-13-01'])
+def test_invalid_filters_are_rejected(client, query):
+    response = client.get(f'/api/data?{query}')
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
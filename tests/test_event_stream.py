@@ -0,0 +1,42 @@
+import pytest
+
+from event_stream import Broadcaster, format_event
+
+
+def subscribe(hub, initial=None):
+    """開始一個連線：讀取第一個 retry 行後即已訂閱"""
+    stream = hub.stream(initial)
+    assert next(stream).startswith('retry:')
+    return stream
+
+
+def test_publish_reaches_every_client():
+    hub = Broadcaster(heartbeat=0.1)
+    first = subscribe(hub, initial=format_event('version', {'version': 'e-1'}))
+    assert next(first) == 'event: version\ndata: {"version":"e-1"}\n\n'
+    second = subscribe(hub)
+    assert hub.client_count() == 2
+
+    assert hub.publish('delta', {'version': 'e-2'}, event_id='e-2') == 2
+    frame = 'id: e-2\nevent: delta\ndata: {"version":"e-2"}\n\n'
+    assert next(first) == frame and next(second) == frame
+    # 沒有事件時送出心跳
+    assert next(first) == ': keep-alive\n\n'
+
+    first.close()
+    assert hub.client_count() == 1
+
+
+def test_slow_client_is_evicted():
+    hub = Broadcaster(heartbeat=0.1, queue_size=2)
+    slow = subscribe(hub)
+    fast = subscribe(hub)
+    for n in range(3):
+        hub.publish('delta', {'n': n})
+        assert next(fast).endswith(f'{{"n":{n}}}\n\n')
+
+    # 積壓超過佇列大小的連線被移除，積壓的事件也一併丟棄
+    assert hub.client_count() == 1
+    with pytest.raises(StopIteration):
+        next(slow)
+    assert hub.publish('delta', {'n': 3}) == 1
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from fetch_gateway import CircuitOpenError, FetchGateway
+
+RESET_SECONDS = 0.3
+
+
+class Sleeps:
+    """記錄重試等待的秒數，不實際等待"""
+
+    def __init__(self):
+        self.delays = []
+
+    def __call__(self, seconds):
+        self.delays.append(seconds)
+
+
+def test_concurrent_identical_requests_share_one_upstream_request(standin):
+    standin.latency = 0.3
+    gateway = FetchGateway(sleep=Sleeps())
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(gateway.get(standin.url('csv')))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert standin.stats()['requests'] == 1
+    assert len(responses) == 8
+    assert all(response.status_code == 200 and response.content for response in responses)
+
+
+def test_retry_exhaustion_returns_last_5xx_response(standin):
+    standin.failure_rate = 1.0
+    sleeps = Sleeps()
+    gateway = FetchGateway(retries=2, sleep=sleeps)
+
+    response = gateway.get(standin.url('csv'))
+    assert response.status_code == 503
+    assert standin.stats()['requests'] == 3
+    assert len(sleeps.delays) == 2
+
+
+def test_retry_after_is_capped_by_backoff_max(standin):
+    standin.failure_rate = 1.0
+    standin.retry_after = 60
+    sleeps = Sleeps()
+    gateway = FetchGateway(retries=2, backoff_base=0.01, backoff_max=1.5, sleep=sleeps)
+
+    gateway.get(standin.url('csv'))
+    assert sleeps.delays == [1.5, 1.5]
+
+
+def test_breaker_opens_then_recovers_through_half_open(standin):
+    standin.failure_rate = 1.0
+    gateway = FetchGateway(retries=1, failure_threshold=2, reset_seconds=RESET_SECONDS, sleep=Sleeps())
+    url = standin.url('csv')
+    breaker = gateway.breaker(url)
+
+    for _ in range(2):
+        assert gateway.get(url).status_code == 503
+    assert breaker.state == 'open'
+    assert standin.stats()['requests'] == 4
+
+    # 斷路期間不請求上游
+    with pytest.raises(CircuitOpenError):
+        gateway.get(url)
+    assert standin.stats()['requests'] == 4
+
+    # 試探請求仍然失敗：重新斷路
+    time.sleep(RESET_SECONDS)
+    assert breaker.state == 'half_open'
+    assert gateway.get(url).status_code == 503
+    assert breaker.state == 'open'
+
+    # 上游恢復後的試探請求成功：恢復正常
+    standin.failure_rate = 0.0
+    time.sleep(RESET_SECONDS)
+    assert gateway.get(url).status_code == 200
+    assert breaker.state == 'closed'
+    assert gateway.get(url).status_code == 200
+
+
+def test_half_open_allows_a_single_probe(standin):
+    standin.failure_rate = 1.0
+    gateway = FetchGateway(retries=0, failure_threshold=1, reset_seconds=RESET_SECONDS, sleep=Sleeps())
+    url = standin.url('csv')
+    gateway.get(url)
+    assert gateway.breaker(url).state == 'open'
+
+    time.sleep(RESET_SECONDS)
+    standin.failure_rate = 0.0
+    standin.latency = 0.5
+    standin.reset_stats()
+    probe = threading.Thread(target=gateway.get, args=(url,))
+    probe.start()
+    time.sleep(0.1)
+    # 試探請求進行中，其他請求（標頭不同，不會合併）直接被拒絕
+    with pytest.raises(CircuitOpenError):
+        gateway.get(url, headers={'If-None-Match': 'x'})
+    probe.join()
+
+    assert standin.stats()['requests'] == 1
+    assert gateway.breaker(url).state == 'closed'
@@ -0,0 +1,85 @@
+import csv
+import io
+import random
+
+import pandas as pd
+import pytest
+
+import app_fixed
+import app_new
+from fast_parser import parse_sheet_frame
+from sheet_config import FALLBACK_PLAN
+from synthetic_sheet import generate_csv
+from xlsx_workbook import parse_workbook
+
+# 逐格解析需要處理的各種儲存格
+EDGE_CELLS = [
+    '', ' ', '0', '42', ' 17 ', '3.7', '.5', '-8', '1e3', '12.5%', '0.00%', ' 33.35% ', '100%',
+    '8/15', '8/15%', '1,234', '12,5%', 'abc', '-', 'N/A', '#DIV/0!', '--5', '5.', '1_000',
+]
+
+
+def edge_csv(days=31, seed=0):
+    """隨機放入各種儲存格、空白日期及長短不一的行"""
+    rng = random.Random(seed)
+    width = 121
+    lines = [['日期'] + [f'c{i}' for i in range(1, width)], [''] * width]
+    for d in range(days):
+        row = [rng.choice(EDGE_CELLS) for _ in range(width)]
+        row[0] = '' if d % 9 == 4 else f'8/{d + 1}'
+        if d % 5 == 3:
+            row = row[:rng.randint(1, width - 1)]  # 後面的斗篷欄位缺少
+        lines.append(row)
+    out = io.StringIO()
+    csv.writer(out).writerows(lines)
+    return out.getvalue()
+
+
+CASES = [generate_csv(31)] + [edge_csv(seed=seed) for seed in range(5)]
+CASE_IDS = ['synthetic'] + [f'edge{seed}' for seed in range(5)]
+
+
+def legacy_rows(text):
+    """app_new 的逐行解析（parse_date_row），數據範圍與 parse_csv_rows 相同"""
+    rows = list(csv.reader(io.StringIO(text)))[app_new.FIRST_DATA_ROW:app_new.LAST_DATA_ROW]
+    return [item for item in map(app_new.parse_date_row, rows) if item is not None]
+
+
+@pytest.mark.parametrize('text', CASES, ids=CASE_IDS)
+def test_parse_rows_with_plan_matches_row_parser(text):
+    assert app_new.parse_google_sheets_data(text).to_records() == legacy_rows(text)
+
+
+@pytest.mark.parametrize('text', CASES, ids=CASE_IDS)
+def test_vectorized_frame_parser_matches_row_parser(text):
+    df = pd.read_csv(io.StringIO(text))
+    expected = app_fixed.parse_google_sheets_data_rows(df)
+    assert parse_sheet_frame(df, app_fixed.SERIES_CONFIG, app_fixed.FIRST_DATA_ROW, app_fixed.LAST_DATA_ROW) == expected
+    # 標題中沒有斗篷名稱時 app_fixed 使用 SERIES_CONFIG 的位置，結果相同
+    if text.startswith('日期,c1'):
+        assert app_fixed.parse_google_sheets_data(df).to_records() == expected
+
+
+def text_workbook(text):
+    """以文字儲存格保存CSV的每一行（與手動輸入、未被Google Sheets轉成數字的儲存格相同）"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Sheet1')
+    for row in csv.reader(io.StringIO(text)):
+        worksheet.append([value or None for value in row])
+    out = io.BytesIO()
+    workbook.save(out)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('text', CASES, ids=CASE_IDS)
+def test_xlsx_text_cells_match_csv_parser(text):
+    assert parse_workbook(text_workbook(text), FALLBACK_PLAN) == app_new.parse_google_sheets_data(text)
+
+
+def test_xlsx_export_matches_csv_export(standin):
+    """替身的XLSX（數字儲存格、百分比格式的fail rate）與CSV導出解析出相同的數據"""
+    csv_table = app_new.parse_google_sheets_data(standin.bodies['csv'].decode('utf-8'))
+    assert len(csv_table) == 7
+    assert parse_workbook(standin.bodies['xlsx'], FALLBACK_PLAN) == csv_table
@@ -0,0 +1,52 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+from cloak_table import CloakTable
+from rollup import downsample_table, lttb_indices, rollup_table
+
+# 2024-12-29 為週日，2024-12-30 為週一；跨越週、月及年的邊界
+LABELS = ['2024/12/29', '2024/12/30', '2025/1/5', '備註', '2025/1/6']
+
+
+def table(labels, meta, ga4):
+    meta = np.array(meta, dtype=np.int64)[:, None]
+    ga4 = np.array(ga4, dtype=np.int64)[:, None]
+    return CloakTable(labels, ['jt01'], meta, ga4, np.zeros(meta.shape))
+
+
+def test_week_buckets_start_on_monday():
+    result = rollup_table(table(LABELS, [100, 10, 20, 30, 40], [50, 10, 10, 0, 40]), 'week')
+    assert result.dates == ['2024-12-23', '2024-12-30', '2025-01-06']
+    # 無法辨識的日期併入前一行的區間
+    assert result.meta[:, 0].tolist() == [100, 60, 40]
+    assert result.ga4[:, 0].tolist() == [50, 20, 40]
+    # fail rate 由加總後的數值重新計算：1 - 20/60
+    assert result.fail_rate_values()[:, 0].tolist() == [50.0, 66.67, 0.0]
+
+
+def test_month_buckets():
+    result = rollup_table(table(LABELS, [100, 10, 20, 30, 40], [50, 10, 10, 0, 40]), 'month')
+    assert result.dates == ['2024-12', '2025-01']
+    assert result.meta[:, 0].tolist() == [110, 90]
+    assert result.ga4[:, 0].tolist() == [60, 50]
+
+
+def test_lttb_keeps_first_last_and_spike():
+    values = np.sin(np.linspace(0, 6, 200))
+    values[137] = 10.0
+    kept = lttb_indices(values, 20)
+    assert len(kept) == 20
+    assert kept[0] == 0 and kept[-1] == 199
+    assert (np.diff(kept) > 0).all()
+    assert 137 in kept
+    assert lttb_indices(values, 500).tolist() == list(range(200))
+
+
+def test_downsample_table_keeps_first_and_last_dates():
+    labels = [(date(2024, 1, 1) + timedelta(days=d)).isoformat() for d in range(60)]
+    rng = np.random.default_rng(0)
+    meta = rng.integers(100, 1000, 60)
+    result = downsample_table(table(labels, meta, meta // 2), 10)
+    assert len(result) == 10
+    assert result.dates[0] == labels[0] and result.dates[-1] == labels[-1]
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from conftest import parse_csv
+from fetch_gateway import FetchGateway
+from shared_snapshot import SharedSnapshotCache
+from sheet_cache import SheetCache
+
+POLL_INTERVAL = 1
+
+
+def shared_cache(standin, tmp_path):
+    source = SheetCache(standin.url('csv'), parse_csv, ttl=POLL_INTERVAL, gateway=FetchGateway(sleep=lambda s: None))
+    return SharedSnapshotCache(
+        str(tmp_path / 'snapshot.bin'), source, lambda data, version, updated_at: {}, check_interval=0.1
+    )
+
+
+def wait_for_upstream(standin, seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and standin.stats()['requests'] == 0:
+        time.sleep(0.1)
+    return standin.stats()['requests']
+
+
+@pytest.mark.parametrize('start_first', [True, False])
+def test_leader_polls_upstream_without_traffic(standin, tmp_path, start_first):
+    """第一個請求取得檔案鎖後，負責刷新的worker仍然定期抓取上游"""
+    cache = shared_cache(standin, tmp_path)
+    # 與 before_request 相同：先啟動監看線程，同一個請求接著讀取快照（或相反的順序）
+    if start_first:
+        cache.start(POLL_INTERVAL)
+        data, version, _ = cache.snapshot()
+    else:
+        data, version, _ = cache.snapshot()
+        cache.start(POLL_INTERVAL)
+    assert cache.is_leader
+    assert len(data) == 7 and version > 0
+
+    standin.reset_stats()
+    assert wait_for_upstream(standin, 5 * POLL_INTERVAL) > 0
+    assert cache.source.stats()['polling']
+
+
+def test_follower_does_not_poll(standin, tmp_path):
+    leader = shared_cache(standin, tmp_path)
+    leader.snapshot()
+    follower = shared_cache(standin, tmp_path)
+    follower.start(POLL_INTERVAL)
+    data, _, _ = follower.snapshot()
+    assert not follower.is_leader
+    assert len(data) == 7
+    assert not follower.source.stats()['polling']
+
+
+def test_follower_reports_leader_freshness(standin, tmp_path):
+    leader = shared_cache(standin, tmp_path)
+    leader.snapshot()
+    follower = shared_cache(standin, tmp_path)
+    follower.snapshot()
+    stale, age = follower.freshness()
+    assert not stale and age is not None and age < 5
+
+    # 上游全部失敗：負責刷新的worker標記陳舊，其他worker從共享檔案讀到相同的狀態
+    standin.failure_rate = 1.0
+    version = leader.version
+    assert not leader.source.refresh(force=True)
+    leader.sync_status()
+    follower.snapshot()
+    assert follower.freshness()[0] and leader.freshness()[0]
+    assert follower.version == version
@@ -0,0 +1,34 @@
+import io
+import zipfile
+
+from column_plan import plan_from_series
+from fetch_gateway import FetchGateway
+from sheet_cache import SheetCache
+from synthetic_sheet import series_config
+from xlsx_workbook import parse_workbook
+
+
+def parse_xlsx(content):
+    return parse_workbook(content, plan_from_series(series_config()))
+
+
+def repack(content):
+    """內容相同但位元組不同的活頁簿（與每次導出都重新打包的zip相同）"""
+    out = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(content)) as source, zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            target.writestr(item.filename, source.read(item.filename))
+        target.comment = b'repacked'
+    return out.getvalue()
+
+
+def test_reexported_workbook_with_same_data_keeps_version(standin):
+    cache = SheetCache(standin.url('xlsx'), None, content_parse_func=parse_xlsx, gateway=FetchGateway())
+    data, version, _ = cache.snapshot()
+    assert len(data) == 7
+
+    standin.bodies['xlsx'] = repack(standin.bodies['xlsx'])
+    cache.refresh(force=True)
+    assert standin.stats()['requests'] == 2
+    assert cache.version == version
+    assert cache.stats()['unchanged'] == 1
@@ -0,0 +1,50 @@
+import numpy as np
+
+from cloak_table import CloakTable
+from snapshot_delta import DeltaLog
+
+CLOAKS = ['jt01', 'jtw01']
+
+
+def table(rows, cloaks=CLOAKS):
+    """rows: {日期: [(meta, ga4, failRate), ...每個斗篷]}"""
+    values = np.array([rows[label] for label in rows], dtype=float).reshape(len(rows), len(cloaks), 3)
+    return CloakTable.from_blocks(list(rows), cloaks, values)
+
+
+def test_token_round_trip():
+    log = DeltaLog(epoch='abc')
+    assert log.parse_token(log.token(7)) == 7
+    assert log.parse_token('abc-x') is None
+    assert log.parse_token('7') is None
+    # 其他進程（或重啟前）的標記
+    assert log.parse_token(DeltaLog(epoch='other').token(7)) is None
+
+
+def test_delta_reports_changed_new_and_removed_dates():
+    log = DeltaLog(epoch='e')
+    old = table({'8/1': [(10, 5, 50.0), (20, 10, 50.0)], '8/2': [(30, 3, 90.0), (0, 0, 0.0)]})
+    new = table({'8/2': [(30, 3, 90.0), (4, 2, 50.0)], '8/3': [(1, 1, 0.0), (2, 2, 0.0)]})
+    log.record(old, 1)
+    log.record(new, 2)
+
+    delta = log.delta(log.token(1), new, 2)
+    assert delta['cells'] == [
+        ['8/2', 'jtw01', 4, 2, 50.0],
+        ['8/3', 'jt01', 1, 1, 0.0],
+        ['8/3', 'jtw01', 2, 2, 0.0],
+    ]
+    assert delta['removed'] == ['8/1']
+    assert delta['dates'] == ['8/2', '8/3']
+    assert log.delta(log.token(2), new, 2) == {'cells': [], 'removed': [], 'dates': None}
+
+
+def test_delta_requires_full_data():
+    log = DeltaLog(epoch='e')
+    old = table({'8/1': [(10, 5, 50.0), (20, 10, 50.0)]})
+    log.record(old, 1)
+
+    # 版本標記來自其他epoch、版本已不在記錄中、或斗篷組成改變
+    assert log.delta(DeltaLog(epoch='other').token(1), old, 2) is None
+    assert log.delta(log.token(0), old, 2) is None
+    assert log.delta(log.token(1), table({'8/1': [(10, 5, 50.0)]}, ['jt01']), 2) is None
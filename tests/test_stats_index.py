@@ -0,0 +1,59 @@
+import random
+from datetime import date, timedelta
+
+import numpy as np
+
+from conftest import parse_csv
+from stats_index import StatsIndex
+from synthetic_sheet import generate_csv
+
+
+def brute_force(table, cloaks, rows):
+    """逐格計算的參考結果，與 StatsIndex.query 的欄位相同"""
+    rates = []
+    hundredths = 0
+    meta = ga4 = 0
+    for d in rows:
+        for cloak in cloaks:
+            c = table.cloak_index[cloak]
+            m, g, rate = int(table.meta[d, c]), int(table.ga4[d, c]), round(float(table.fail_rate[d, c]), 2)
+            if m > 0 or g > 0 or rate > 0:
+                rates.append(rate)
+                hundredths += round(rate * 100)
+                meta += m
+                ga4 += g
+    if not rates:
+        return {'cells': 0}
+    return {
+        'cells': len(rates),
+        'avgFailRate': round(hundredths / 100 / len(rates), 2),
+        'maxFailRate': round(max(rates), 2),
+        'minFailRate': round(min(rates), 2),
+        'totalVolume': meta,
+        'totalGa4': ga4,
+        'weightedFailRate': round((1 - ga4 / meta) * 100, 2) if meta > 0 else 0.0
+    }
+
+
+def test_query_matches_brute_force():
+    table = parse_csv(generate_csv(45, cloaks_per_series=5))
+    iso_dates = [(date(2024, 8, 1) + timedelta(days=d)).isoformat() for d in range(len(table))]
+    index = StatsIndex(table, iso_dates)
+    rng = random.Random(0)
+    for _ in range(200):
+        cloaks = rng.sample(table.cloaks, rng.randint(1, len(table.cloaks)))
+        l = rng.randrange(len(table))
+        r = rng.randrange(l, len(table))
+        result = index.query(cloaks, iso_dates[l], iso_dates[r])
+        expected = brute_force(table, cloaks, range(l, r + 1))
+        assert {key: result[key] for key in expected} == expected
+        assert result['unknownCloaks'] == []
+
+
+def test_query_without_dates_covers_whole_snapshot():
+    table = parse_csv(generate_csv(10, cloaks_per_series=3))
+    result = StatsIndex(table).query(table.cloaks + ['jt99'])
+    expected = brute_force(table, table.cloaks, range(len(table)))
+    assert {key: result[key] for key in expected} == expected
+    assert result['unknownCloaks'] == ['jt99']
+    assert np.isfinite(result['maxFailRate'])
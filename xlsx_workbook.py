@@ -0,0 +1,116 @@
+import io
+import itertools
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+
+from cloak_table import CloakTable
+from column_plan import METRICS_PER_CLOAK, get_plan
+from fast_parser import convert_cells
+
+logger = logging.getLogger(__name__)
+
+_FAIL_RATE = 2  # ColumnPlan.indices 中 fail rate 的位置
+
+
+def date_label(value):
+    """日期儲存格轉成與CSV導出相同的 月/日 標籤，空白時返回None"""
+    if isinstance(value, (datetime, date)):
+        return f'{value.month}/{value.day}'
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+def cell_text(value, percent=False):
+    """儲存格轉成CSV導出中的文字，之後與CSV使用相同的 convert_cells 轉換
+
+    百分比格式的數字由比例 (0.3352) 以十進位轉成百分比 ('33.52')，不經過浮點乘法；
+    布林、日期等其他類型與CSV中的文字一樣無法轉換為數字。
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return format(Decimal(repr(value)).scaleb(2), 'f') if percent else repr(value)
+    return str(value)
+
+
+def percent_columns(worksheet, plan, first_row, last_row):
+    """格式為百分比的 fail rate 欄位：XLSX存的是比例 (0.3352)，需要乘以100
+
+    values_only 不提供儲存格格式，另外讀取數據範圍內 fail rate 欄位的格式（只有數據行，成本很小）。
+    """
+    columns = set(int(c) for c in plan.indices[:, _FAIL_RATE] if c >= 0)
+    found = set()
+    if not columns:
+        return found
+    for row in worksheet.iter_rows(min_row=first_row + 1, max_row=last_row, max_col=max(columns) + 1):
+        for cell in row:
+            column = getattr(cell, 'column', None)
+            if column is None or column - 1 not in columns or cell.value is None:
+                continue
+            if '%' in (cell.number_format or ''):
+                found.add(column - 1)
+    return found
+
+
+def parse_worksheet(worksheet, fallback_plan, first_row=2, last_row=33):
+    """逐行讀取一個分頁 (read_only + values_only)，返回 CloakTable；沒有任何日期時返回None"""
+    rows = worksheet.iter_rows(values_only=True)
+    plan = get_plan([list(row) for row in itertools.islice(rows, first_row)], fallback_plan)
+    scaled = percent_columns(worksheet, plan, first_row, last_row)
+    percent = [int(c) in scaled for c in plan.indices.ravel()]
+    take = plan.take
+
+    dates = []
+    cells = []
+    for row in itertools.islice(rows, last_row - first_row):
+        label = date_label(row[0]) if row else None
+        if label is None:
+            continue
+        # 與 parse_rows_with_plan 相同的取欄方式，缺少的欄位為空白
+        dates.append(label)
+        cells.append([cell_text(value, p) for value, p in zip(take(row), percent)])
+
+    if not dates:
+        return None
+    block = np.empty((len(cells), len(percent)), dtype=object)
+    block[:] = cells
+    block = block.reshape(len(cells), len(plan.cloaks), METRICS_PER_CLOAK)
+    return CloakTable.from_blocks(dates, plan.cloaks, convert_cells(block, zero_invalid_cloak=False))
+
+
+def parse_workbook(source, fallback_plan, first_row=2, last_row=33, sheet_names=None):
+    """以 openpyxl 的唯讀串流模式解析整個活頁簿，所有月份分頁合併成一個 CloakTable
+
+    source為XLSX的位元組內容、檔案路徑或檔案物件；sheet_names指定只讀取哪些分頁（預設全部）。
+    同一日期出現在多個分頁時以後面的分頁為準，與多分頁CSV的合併方式相同。
+    """
+    # 只有使用XLSX時才需要openpyxl
+    from openpyxl import load_workbook
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        tables = []
+        for worksheet in workbook.worksheets:
+            if sheet_names and worksheet.title not in sheet_names:
+                continue
+            table = parse_worksheet(worksheet, fallback_plan, first_row, last_row)
+            if table is None:
+                logger.debug(f"分頁 {worksheet.title} 沒有數據，略過")
+                continue
+            tables.append(table)
+    finally:
+        workbook.close()
+
+    logger.info(f"活頁簿共解析 {len(tables)} 個分頁")
+    if not tables:
+        return []
+    return tables[0] if len(tables) == 1 else CloakTable.merge(tables)